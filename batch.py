@@ -0,0 +1,659 @@
+import numpy as np
+import pandas as pd
+from thin_layer import thin_layer_correction
+
+# Batched version of the functions.py pipeline. Instead of one DataFrame per site, the depth series of every site are
+# concatenated into flat arrays (like a CSR matrix):
+#   batch['rows'][column]  -> one value per depth reading of every site
+#   batch['sites'][column] -> one value per site (GWT, PGA, Liquefaction, LPI, ...)
+#   batch['offsets']       -> rows of site k are offsets[k]:offsets[k + 1]
+#   batch['seg']           -> site number of every row, used to broadcast the site values to the rows
+# soil_parameters, FS_liq, LPI, LSN, ... are then done as single array operations over every site at once, with
+# segmented sums/cumsums taking the place of the per site loops. Column names are the same as in functions.py so the
+# results can be turned back into the usual per site DataFrames with unbatch.
+
+Pa = 101.325  # Atmospheric pressure in kPa
+
+ROW_COLUMNS = ['Depth (m)', 'qc (MPa)', 'fs (kPa)', 'u (kPa)', 'qt (MPa)']
+SITE_COLUMNS = ['GWT [m]', 'preforo [m]']
+
+
+# /////////////////////////////////////////////// BUILDING THE BATCH \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+
+# Splits a site DataFrame (as read from the input spreadsheets) into its depth series and its first row values
+def frame_to_sounding(df, site):
+    rows = {column: pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float) for column in ROW_COLUMNS}
+    meta = {column: df.loc[0][column] for column in df.columns if column not in ROW_COLUMNS}
+    return {'site': site, 'rows': rows, 'meta': meta}
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('NaN')
+
+
+# soundings is a list of {'site': name, 'rows': {column: array}, 'meta': {column: value}}. Any numeric meta value
+# (GWT, preforo, PGA, ...) becomes a site column. The rest of the meta data is kept to rebuild the DataFrames.
+def build_batch(soundings):
+    lengths = np.array([len(s['rows']['Depth (m)']) for s in soundings], dtype=np.int64)
+    offsets = np.zeros(len(soundings) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    rows = {}
+    for column in ROW_COLUMNS:
+        rows[column] = np.concatenate([np.asarray(s['rows'].get(column, np.full(n, np.nan)), dtype=float)
+                                       for s, n in zip(soundings, lengths)]) if len(soundings) else np.zeros(0)
+
+    site_columns = list(SITE_COLUMNS)
+    for s in soundings:
+        for column in s['meta']:
+            if column not in site_columns and not isinstance(s['meta'][column], (str, pd.Timestamp)):
+                site_columns.append(column)
+    sites = {column: np.array([to_float(s['meta'].get(column)) for s in soundings]) for column in site_columns}
+
+    return {'site': [s['site'] for s in soundings],
+            'meta': [s['meta'] for s in soundings],
+            'offsets': offsets,
+            'seg': np.repeat(np.arange(len(soundings)), lengths),
+            'rows': rows,
+            'sites': sites}
+
+
+# Copy of the batch that can go through the calculations without changing the original
+def copy_batch(batch):
+    return {'site': list(batch['site']),
+            'meta': [dict(meta) for meta in batch['meta']],
+            'offsets': batch['offsets'].copy(),
+            'seg': batch['seg'].copy(),
+            'rows': {column: values.copy() for column, values in batch['rows'].items()},
+            'sites': {column: values.copy() for column, values in batch['sites'].items()}}
+
+
+# Joins batches (e.g. single site batches that have been cached) into one. Columns missing from a batch are NaN.
+def concat_batches(batches):
+    lengths = np.concatenate([site_lengths(b) for b in batches]) if batches else np.zeros(0, dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    def join(part, size):
+        columns = []
+        for b in batches:
+            columns += [column for column in b[part] if column not in columns]
+        return {column: np.concatenate([b[part][column] if column in b[part] else np.full(size(b), np.nan)
+                                        for b in batches]) for column in columns}
+
+    return {'site': [site for b in batches for site in b['site']],
+            'meta': [meta for b in batches for meta in b['meta']],
+            'offsets': offsets,
+            'seg': np.repeat(np.arange(len(lengths)), lengths),
+            'rows': join('rows', lambda b: len(b['seg'])),
+            'sites': join('sites', lambda b: len(b['site']))}
+
+
+# Batch with only the sites numbered index, in that order
+def take_sites(batch, index):
+    index = np.asarray(index, dtype=np.int64)
+    lengths = site_lengths(batch)[index]
+    offsets = np.zeros(len(index) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    rows = np.repeat(batch['offsets'][:-1][index] - offsets[:-1], lengths) + np.arange(offsets[-1])
+    return {'site': [batch['site'][k] for k in index],
+            'meta': [batch['meta'][k] for k in index],
+            'offsets': offsets,
+            'seg': np.repeat(np.arange(len(index)), lengths),
+            'rows': {column: values[rows] for column, values in batch['rows'].items()},
+            'sites': {column: values[index] for column, values in batch['sites'].items()}}
+
+
+def site_lengths(batch):
+    return np.diff(batch['offsets'])
+
+
+# True for the first row of each site
+def first_rows(batch):
+    first = np.zeros(len(batch['seg']), dtype=bool)
+    starts = batch['offsets'][:-1][site_lengths(batch) > 0]
+    first[starts] = True
+    return first
+
+
+# Broadcasts one value per site to every row of that site
+def site_to_rows(values, batch):
+    return np.asarray(values)[batch['seg']]
+
+
+# Per site sum of the row values. NaN rows are skipped, like the integration loops in functions.py skip them.
+def segment_sum(values, batch, where=None):
+    values = np.where(np.isnan(values), 0.0, values)
+    if where is not None:
+        values = np.where(where, values, 0.0)
+    return np.bincount(batch['seg'], weights=values, minlength=len(batch['site']))
+
+
+def segment_any(mask, batch):
+    return np.bincount(batch['seg'], weights=mask.astype(float), minlength=len(batch['site'])) > 0
+
+
+# Per site cumulative sum. A NaN makes the rest of its site NaN, as it does in the row by row pandas version.
+def segment_cumsum(values, batch):
+    lengths = site_lengths(batch)
+    starts = batch['offsets'][:-1]
+    nan = np.isnan(values)
+    finite = np.where(nan, 0.0, values)
+    total = np.cumsum(finite)
+    nan_seen = np.cumsum(nan)
+    if len(values):
+        total -= np.repeat(total[np.minimum(starts, len(values) - 1)] - finite[np.minimum(starts, len(values) - 1)],
+                           lengths)
+        nan_seen -= np.repeat(nan_seen[np.minimum(starts, len(values) - 1)] - nan[np.minimum(starts, len(values) - 1)],
+                              lengths)
+    total[nan_seen > 0] = float('NaN')
+    return total
+
+
+# Depth of the row above each row. For the first row of a site the layer is taken as thick as the one below it,
+# which is what LPI and LPIish do for index 0.
+def depth_above(batch, depth_column_name='Depth (m)'):
+    depth = batch['rows'][depth_column_name]
+    above = np.empty_like(depth)
+    above[1:] = depth[:-1]
+    first = first_rows(batch)
+    below = np.full_like(depth, np.nan)
+    below[:-1] = depth[1:]
+    last = np.zeros(len(depth), dtype=bool)
+    last[batch['offsets'][1:][site_lengths(batch) > 0] - 1] = True
+    below[last] = float('NaN')
+    above[first] = depth[first] - (below[first] - depth[first])
+    return above
+
+
+# /////////////////////////////////////////////// end BUILDING THE BATCH \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+
+
+# Same calculations as functions.soil_parameters. The Ic and Dr iterations are done for every site at the same time,
+# and a site stops iterating as soon as all of its own rows meet the tolerance, so the results match the per site
+# version. thin_layer=True corrects qc and qt for thin layer effects first (see thin_layer.py). top is the
+# (depth, total stress) of every site above its first row, for profiles that are computed piece by piece (see
+# realtime.py). By default the first row starts from the ground surface. The number of Ic and Dr iterations of every
+# site goes in the 'Ic iterations' and 'Dr iterations' site columns, and min_iterations = (Ic, Dr) per site makes the
+# sites iterate at least that many times.
+def batch_soil_parameters(batch, max_iterations=100, thin_layer=False, top=None, min_iterations=None):
+    rows = batch['rows']
+    seg = batch['seg']
+    n_sites = len(batch['site'])
+    depth = rows['Depth (m)']
+    fs = rows['fs (kPa)']
+
+    with np.errstate(all='ignore'):
+        # ///////////////////////////////////////////// GENERAL CALCULATIONS \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+        qc_calc = rows['qc (MPa)'] * 1000
+        qt_calc = rows['qt (MPa)'] * 1000
+        qc_calc[qc_calc <= 0] = float('NaN')
+        qt_calc[qt_calc <= 0] = float('NaN')
+        if thin_layer:
+            qt_corrected = thin_layer_correction(depth, qt_calc, batch['offsets'])
+            qc_calc *= np.nan_to_num(qt_corrected / qt_calc, nan=1.0)
+            qt_calc = qt_corrected
+
+        # Rf calc
+        Rf = np.where((fs < 0.00001) | np.isnan(qt_calc), 0.0, fs / qt_calc * 100)
+
+        # Gamma calc
+        gamma = np.where(Rf <= 0, 18.08, 9.81 * (0.27 * np.log10(Rf) + 0.36 * np.log10(qt_calc / Pa) + 1.236))
+
+        # Total Stress calculation
+        dz = np.diff(depth, prepend=0.0)
+        first = first_rows(batch)
+        dz[first] = depth[first]
+        if top is not None:
+            dz[first] -= site_to_rows(top[0], batch)[first]
+        total = segment_cumsum(dz * gamma, batch)
+        if top is not None:
+            total += site_to_rows(top[1], batch)
+
+        # Effective Stress calculation. Sites without a GWT keep NaN stresses like the pandas version.
+        GWT = site_to_rows(batch['sites']['GWT [m]'], batch)
+        has_GWT = GWT > 0
+        below = has_GWT & (depth >= GWT)
+        effective = np.where(below, total - (depth - GWT) * 9.81, total)
+        effective[~has_GWT] = float('NaN')
+        u_calc = np.where(below, np.trunc((depth - GWT) * 9.81), 0.0)
+        u_calc[~has_GWT] = float('NaN')
+        Fr = np.where(fs <= 0, 0.0, fs / (qt_calc - total) * 100)
+        Fr[~has_GWT] = float('NaN')
+
+        # Qt calculation
+        Qt = (qt_calc - total) / effective
+        # ///////////////////////////////////////////// end GENERAL CALCULATIONS \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+
+        # ////////////////////////////////////////////// Ic CALCULATION \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+        n1 = np.ones_like(depth)
+        Cn = np.full_like(depth, np.nan)
+        Qtn = np.full_like(depth, np.nan)
+        Ic = np.full_like(depth, np.nan)
+        tolerance = 0.01  # Define the Ic iteration tolerance here
+
+        active = np.arange(len(depth))  # rows of the sites that are still iterating
+        Ic_iterations = np.ones(n_sites)
+        for iteration in range(1, max_iterations + 1):
+            if not len(active):
+                break
+            cn = (Pa / effective[active]) ** n1[active]
+            cn = np.where(cn >= 1.7, 1.7, cn)
+            qtn = (qt_calc[active] - total[active]) / Pa * cn
+            fr = Fr[active]
+            ic = np.where((fr <= 0) | (qtn <= 0), 0.0,
+                          ((3.47 - np.log10(qtn)) ** 2 + (np.log10(fr) + 1.22) ** 2) ** 0.5)
+            temp = 0.381 * ic + 0.05 * (effective[active] / Pa) - .15
+            n2 = np.where(temp > 1, 1.0, temp)
+            error = n1[active] - n2
+
+            Cn[active], Qtn[active], Ic[active], n1[active] = cn, qtn, ic, n2
+
+            # Sites with a row above the tolerance keep iterating
+            bad = (ic > 0) & (error > tolerance)
+            site_bad = np.bincount(seg[active], weights=bad.astype(float), minlength=n_sites) > 0
+            if min_iterations is not None:
+                site_bad |= iteration < min_iterations[0]
+            Ic_iterations += site_bad
+            active = active[site_bad[seg[active]]]
+        Ic_iterations = np.minimum(Ic_iterations, max_iterations)
+        # /////////////////////////////////////////// end Ic CALCULATION \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+
+        # //////////////////////////////// Dr CALCULATION Idriss and Boulanger 2008 \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+        qc1 = qc_calc.copy()  # Set recorded qc values as initial qc1n guess
+        Dr_I = np.full_like(depth, np.nan)
+        no_solution = np.zeros(len(depth), dtype=bool)
+        tolerance = 0.01  # Define the Dr iteration tolerance here
+
+        active = np.arange(len(depth))
+        it_counter = 0
+        Dr_iterations = np.ones(n_sites)
+        while len(active):
+            q1 = qc1[active]
+            Cn2 = (Pa / effective[active]) ** (1.338 - .249 * q1 ** .264)
+            qc2 = Cn2 * qc_calc[active] / Pa
+            dr = .478 * q1 ** .264 - 1.063
+            error2 = np.abs(q1 - qc2)
+            Dr_I[active], qc1[active] = dr, qc2
+            it_counter += 1
+
+            bad = (dr > 0) & (error2 > tolerance)
+            if it_counter == 100:
+                no_solution[active[bad]] = True
+                break
+            site_bad = np.bincount(seg[active], weights=bad.astype(float), minlength=n_sites) > 0
+            if min_iterations is not None:
+                site_bad |= it_counter < min_iterations[1]
+            Dr_iterations += site_bad
+            active = active[site_bad[seg[active]]]
+        # //////////////////////////////////// end Dr CALCULATION Idriss and Boulanger 2008 \\\\\\\\\\\\\\\\\\\\\\\\\\\\
+
+        cohesive = Ic >= 2.6
+        granular = (2.6 > Ic) & (Ic > 0)
+        Dr_I[cohesive | (Ic == 0)] = float('NaN')
+        no_solution[cohesive | (Ic == 0)] = False
+
+        qnet = qt_calc - total
+        avs = 10 ** (0.55 * Ic + 1.68)
+
+        # //////////////////////////////////////////// COHESIVE LAYER PROPERTIES \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+        OCR_R = np.where(cohesive, .25 * Qt ** 1.25, np.nan)  # Robertson 2009
+        OCR_K = np.where(cohesive & (Qt < 20), 0.33 * Qt, np.nan)  # Kulkawy and Mayne 1990
+
+        # cu, Mayne & Peuchen 2018
+        u0 = np.where(depth >= GWT, (depth - GWT) * 9.81, 0.0)
+        Bq_raw = (u_calc - u0) / qnet
+        Bq = np.where(Bq_raw <= -0.1, -0.009999999, Bq_raw)
+        Nkt = 10.5 - 4.6 * np.log(Bq + 0.1)
+        cu_bq = np.where(cohesive, qnet / Nkt, np.nan)
+        cu_14 = np.where(cohesive, qnet / 14, np.nan)
+
+        # M, Robertson 2009
+        M_clay = np.where(Qt >= 14, qnet * 14, qnet * Qt)
+        M = np.where(cohesive, M_clay, np.nan)
+
+        # k0, Kulhway and Mayne 1990
+        k0_1 = np.where(cohesive, qnet / effective * .1, np.nan)
+        k0_2 = np.where(cohesive, 0.5 * OCR_R ** 0.5, np.nan)
+
+        # Vs, Robertson 2009 and Mayne 2006
+        Vs_R = np.where(cohesive & (avs * qnet > 0), (avs * qnet / Pa) ** .5, np.nan)
+        Vs_M = np.where((cohesive | granular) & (fs > 0), 51.6 * np.log(fs) + 18.5, np.nan)
+
+        # k for permeability, Robertson 2015
+        k = np.where(cohesive & (Ic < 3.27), 10 ** (.952 - 3.04 * Ic), np.nan)
+        k = np.where(cohesive & (3.27 < Ic) & (Ic < 4), 10 ** (-4.52 - 1.37 * Ic), k)
+
+        # φ', Mayne 2006
+        Bq = np.where(Bq_raw <= 0, 0.1, np.where(Bq_raw > 1, 1.0, Bq_raw))
+        phi_M = np.where(cohesive & (Qt > 0), 29.5 * Bq ** 0.121 * (0.256 + 0.336 * Bq + np.log10(Qt)), np.nan)
+        # /////////////////////////////////////// end COHESIVE LAYER PROPERTIES \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+
+        # /////////////////////////////////////// NON-COHESIVE LAYER PROPERTIES \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+        # φ', Robertson and Campanella 1983, Kulhawy and Mayne 1990, Jefferies and Been 2006, Uzielli et al. 2013
+        phi_R = np.where(granular & (qc_calc > 0),
+                         np.degrees(np.arctan(1 / 2.68 * (np.log10(qc_calc / effective) + 0.29))), np.nan)
+        phi_K = np.where(granular, 17.6 + 11 * np.log10(Qtn), np.nan)
+        Kc = np.where(Ic <= 1.64, 1.0,
+                      np.where((1.64 < Ic) & (Ic < 2.36) & (Fr < 0.5), 1.0,
+                               np.where((1.64 < Ic) & (Ic <= 2.5),
+                                        5.58 * Ic ** 3 - 0.403 * Ic ** 4 - 21.63 * Ic ** 2 + 33.75 * Ic - 17.88,
+                                        6 * 10 ** -7 * Ic ** 16.76)))
+        phi_J = np.where(granular, 33 + 15.84 * (np.log10(Kc * Qtn)) - 26.88, np.nan)
+        phi_U = np.where(granular, 25 * (qt_calc / effective ** 0.5) ** 0.1, np.nan)
+
+        # Dr, Baldi et al. 1986, Kulhawy and Mayne 1990, Jamiolkowski et al. 2003
+        Qcn = (qc_calc / Pa) / (effective / Pa) ** 0.5
+        Dr_B = np.where(granular, (1 / 2.41) * np.log(Qcn / 15.7), np.nan)
+        Dr_K = np.where(granular, (Qtn / 350) ** 0.5, np.nan)
+        Dr_J = np.where(granular, 1 / 3.10 * np.log((qt_calc / Pa) / (17.68 * (effective / Pa) ** 0.5)), np.nan)
+
+        # ψ state parameter, Robertson 2010
+        psi = np.where(granular, 0.56 - 0.33 * np.log10(Kc * Qtn), np.nan)
+
+        # Vs, Robertson 2009
+        Vs_R = np.where(granular, (avs * qnet / Pa) ** 0.5, Vs_R)
+
+        # k for permeability, Robertson 2010
+        k = np.where(granular, 10 ** (0.952 - 3.04 * Ic), k)
+
+        # M, Robertson 2009
+        M = np.where(granular & (Ic > 2.2), M_clay, np.where(granular, 0.0188 * avs * qnet, M))
+
+        Ic[Ic == 0] = float('NaN')
+        # //////////////////////////////////////// end NON-COHESIVE LAYER PROPERTIES \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+
+    rows.update({'u calc': u_calc, "Rf (%)": Rf, "Gamma (kN/m^3)": gamma, "Total Stress (kPa)": total,
+                 "Effective Stress (kPa)": effective, "Fr (%)": Fr, "Ic": Ic, 'OCR R': OCR_R, 'OCR K': OCR_K,
+                 "cu_bq": cu_bq, "cu_14": cu_14, "M": M, "k0_1": k0_1, 'k0_2': k0_2, "Vs R": Vs_R, 'Vs M': Vs_M,
+                 "k (m/s)": k, 'ψ': psi, "φ' R": phi_R, "φ' K": phi_K, "φ' J": phi_J, "φ' M": phi_M,
+                 "φ' U": phi_U, 'Dr B': Dr_B, 'Dr K': Dr_K, 'Dr J': Dr_J, 'Dr I': Dr_I,
+                 'Dr I No Solution': no_solution})
+    batch['sites'].update({'Ic iterations': Ic_iterations, 'Dr iterations': Dr_iterations})
+    return batch
+
+
+# MSF, capped at 1.8
+def MSF(Magnitude):
+    return np.minimum(6.9 * np.exp(-Magnitude / 4) - .058, 1.8)
+
+
+# The parts of FS_liq that don't depend on the PGA, for one event magnitude. Returns the per row arrays
+# 'qc1n', 'qc1ncs', 'Kσ', 'rd', 'CRR' and 'CSR/PGA' (the CSR for a PGA of 1 g). FC_coeff and FC_exp are the constants
+# of the FC = FC_coeff * Ic ** FC_exp correlation. Magnitude, FC_coeff and FC_exp can be a number or one value per site.
+def liq_event_terms(batch, Magnitude, FC_coeff=2 * 2.8, FC_exp=2.6):
+    rows = batch['rows']
+    depth = rows['Depth (m)']
+    Ic = rows['Ic']
+    effective = rows["Effective Stress (kPa)"]
+    Magnitude, FC_coeff, FC_exp = [site_to_rows(np.asarray(value, dtype=float), batch) if np.ndim(value) else value
+                                   for value in [Magnitude, FC_coeff, FC_exp]]
+    msf = MSF(Magnitude)
+
+    with np.errstate(all='ignore'):
+        granular = (2.6 > Ic) & (Ic > 0)
+        Dr_I = np.where(rows['Dr I No Solution'], np.nan, rows['Dr I'])
+        qc1n = ((Dr_I + 1.063) / .478) ** (1 / .264)  # from Dr I iterative calc (we backcalculate here)
+
+        c_sigma = 1 / (37.3 - 8.27 * qc1n ** .264)
+        c_sigma = np.where(c_sigma > .3, .3, c_sigma)
+        K_sigma = 1 - c_sigma * np.log(effective / Pa)
+        K_sigma = np.where(K_sigma > 1.1, 1.1, K_sigma)
+
+        # rd is only good for depths less than 20 meters (pg 68)
+        alpha = -1.012 - 1.126 * np.sin(depth / 11.73 + 5.133)
+        beta = .106 + .118 * np.sin(depth / 11.28 + 5.142)
+        rd = np.where(depth < 20, np.exp(alpha + beta * Magnitude), np.nan)
+
+        g = 1
+        CSR_unit = .65 / g * rows["Total Stress (kPa)"] / effective * rd / msf / K_sigma
+
+        FC = np.clip(FC_coeff * Ic ** FC_exp, 0, 100)  # Taken from Emilia Romagna paper
+        qc1ncs = qc1n + (5.4 + qc1n / 16) * np.exp(1.63 + 9.7 / (FC + 0.01) - (15.7 / (FC + 0.01)) ** 2)
+        CRR = np.exp(qc1ncs / 540 + (qc1ncs / 67) ** 2 - (qc1ncs / 80) ** 3 + (qc1ncs / 114) ** 4 - 3) / msf / K_sigma
+
+    nan = np.full_like(depth, np.nan)
+    return {'qc1n': qc1n,
+            'qc1ncs': np.where(granular, qc1ncs, nan),
+            'Kσ': np.where(granular, K_sigma, nan),
+            'rd': np.where(granular, rd, nan),
+            'CRR': np.where(granular, CRR, nan),
+            'CSR/PGA': np.where(granular, CSR_unit, nan)}
+
+
+# FS from the event terms and one PGA per site. Rows above the GWT get the 9999 placeholder.
+def FS_from_terms(batch, terms, PGA):
+    rows = batch['rows']
+    with np.errstate(all='ignore'):
+        CSR = terms['CSR/PGA'] * site_to_rows(PGA, batch)
+        FS = terms['CRR'] / CSR
+    granular = (2.6 > rows['Ic']) & (rows['Ic'] > 0)
+    above_GWT = rows['Depth (m)'] <= site_to_rows(batch['sites']['GWT [m]'], batch)
+    FS = np.where(granular & above_GWT, 9999.0, FS)
+    return CSR, FS
+
+
+# Same as functions.FS_liq. Needs batch_soil_parameters and the PGA_<date> site columns.
+def batch_FS_liq(batch, Magnitude1, Magnitude2, date1, date2):
+    rows = batch['rows']
+    for Magnitude, date in [(Magnitude1, date1), (Magnitude2, date2)]:
+        terms = liq_event_terms(batch, Magnitude)
+        CSR, FS = FS_from_terms(batch, terms, batch['sites']['PGA_' + date])
+        rows['qc1n'] = terms['qc1n']
+        rows['qc1ncs'] = terms['qc1ncs']
+        rows['Kσ'] = terms['Kσ']
+        rows['rd_' + date] = terms['rd']
+        rows['CSR_' + date] = CSR
+        rows['CRR_' + date] = terms['CRR']
+        rows['FS_' + date] = FS
+    return batch
+
+
+# Row by row LPI contributions. The integral of (1 - FS) * (10 - 0.5 * z) over each layer has a closed form, so
+# scipy's quad isn't needed.
+def LPI_rows(depth, above, FS):
+    with np.errstate(invalid='ignore'):
+        layer = (10 * (depth - above) - 0.25 * (depth ** 2 - above ** 2)) * (1 - FS)
+    return np.where((depth <= 20) & (FS <= 1), layer, 0.0)
+
+
+def batch_LPI(batch, depth_column_name, FS_column_name, date):
+    depth = batch['rows'][depth_column_name]
+    LPI = LPI_rows(depth, depth_above(batch, depth_column_name), batch['rows'][FS_column_name])
+    batch['sites']["LPI_" + date] = segment_sum(LPI, batch)
+    return batch
+
+
+def batch_LPIish(batch, depth_column_name, FS_column_name, date, h1_column_name):
+    depth = batch['rows'][depth_column_name]
+    FS = batch['rows'][FS_column_name]
+    h1 = site_to_rows(batch['sites'][h1_column_name], batch)
+    with np.errstate(all='ignore'):
+        mFS = np.exp(5 / (25.56 * (1 - FS))) - 1
+        c = np.where((FS <= 1) & (h1 * mFS <= 3), 1 - FS, 0.0)
+        layer = 25.56 * c * np.log(depth / depth_above(batch, depth_column_name))
+    LPIish = np.where((h1 <= depth) & (depth <= 20) & (depth >= 0.4), layer, 0.0)
+    batch['sites']["LPIish_" + date] = segment_sum(LPIish, batch)
+    return batch
+
+
+# Row by row volumetric strain (%) used by LSN, Zhang et al. 2002 curves as implemented in functions.LSN
+def LSN_strain(qc1ncs, FS, depth):
+    with np.errstate(all='ignore'):
+        A1 = 102 * qc1ncs ** -.82
+        A3 = 2411 * qc1ncs ** -1.45
+        A5 = 1701 * qc1ncs ** -1.42
+        A7 = 1690 * qc1ncs ** -1.46
+        A9 = 1430 * qc1ncs ** -1.48
+        A10 = 64 * qc1ncs ** -.93
+        A11 = 11 * qc1ncs ** -.65
+        A12 = 9.7 * qc1ncs ** -.69
+        A13 = 7.6 * qc1ncs ** -.71
+
+        def interpolator(lower_limit_FS_ev, upper_limit_FS_ev, upper_limit_FS, FS):
+            return (upper_limit_FS - FS) * 10 * (lower_limit_FS_ev - upper_limit_FS_ev) + upper_limit_FS_ev
+
+        in_range = (20 <= qc1ncs) & (qc1ncs <= 200)
+        eps = np.where(in_range, np.where(qc1ncs < 33, 10.0, A1), np.nan)
+
+        conditions = [(.5 <= FS) & (FS <= .6) & (147 <= qc1ncs) & (qc1ncs <= 200),
+                      (.6 <= FS) & (FS <= .7) & (110 <= qc1ncs) & (qc1ncs <= 200),
+                      (.7 <= FS) & (FS <= .8) & (80 <= qc1ncs) & (qc1ncs <= 200),
+                      (.8 <= FS) & (FS <= .9) & (60 <= qc1ncs) & (qc1ncs <= 200),
+                      (.9 <= FS) & (FS <= 1) & in_range,
+                      (1 <= FS) & (FS <= 1.1) & in_range,
+                      (1.1 <= FS) & (FS <= 1.2) & in_range,
+                      (1.2 <= FS) & (FS <= 1.3) & in_range,
+                      (FS >= 1.3) & in_range]
+        choices = [interpolator(A1, A3, .6, FS),
+                   interpolator(np.where(qc1ncs < 147, eps, A3), A5, .7, FS),
+                   interpolator(np.where(qc1ncs < 110, eps, A5), A7, .8, FS),
+                   interpolator(np.where(qc1ncs < 80, eps, A7), A9, .9, FS),
+                   interpolator(np.where(qc1ncs < 60, eps, A9), A10, 1, FS),
+                   interpolator(A10, A11, 1.1, FS),
+                   interpolator(A11, A12, 1.2, FS),
+                   interpolator(A12, A13, 1.3, FS),
+                   interpolator(A13, 0, 2, np.minimum(FS, 2))]
+        eps = np.select(conditions, choices, eps)
+    return np.where((depth <= 20) & ~np.isnan(qc1ncs), eps, np.nan)
+
+
+# Row by row LSN contributions, the integral of eps * 10 / z over each layer
+def LSN_rows(batch, depth, eps):
+    above = np.empty_like(depth)
+    above[1:] = depth[:-1]
+    with np.errstate(all='ignore'):
+        layer = eps * 10 * np.log(depth / above)
+    return np.where(first_rows(batch) | np.isnan(eps), 0.0, layer)
+
+
+def batch_LSN(batch, depth_column_name, qc1ncs_column_name, FS_column_name, date):
+    rows = batch['rows']
+    depth = rows[depth_column_name]
+    eps = LSN_strain(rows[qc1ncs_column_name], rows[FS_column_name], depth)
+    batch['sites']["LSN_" + date] = segment_sum(LSN_rows(batch, depth, eps), batch)
+    return batch
+
+
+# h1 and h2 for one site, same rules as functions.h1_h2_basic. A site without readings gets h1 = NaN.
+def h1_h2_basic_arrays(depth, FS):
+    last_liq_depth = None
+    start_liq_depth = None
+    h1_index = 0
+    for index in range(len(depth)):
+        if FS[index] < 1 and (last_liq_depth is None or depth[index] - last_liq_depth <= 0.3):
+            last_liq_depth = depth[index]
+            if start_liq_depth is None:
+                start_liq_depth = depth[index]
+                h1_index = max(index - 1, 0)
+        elif last_liq_depth is not None and depth[index] - last_liq_depth > 0.3:
+            return depth[h1_index], last_liq_depth - start_liq_depth
+    return (depth[-1] if len(depth) else np.nan), 0
+
+
+# h1 and h2 for one site, same rules as functions.h1_h2_cumulative
+def h1_h2_cumulative_arrays(depth, FS):
+    current_depth = None
+    start_depth = None
+    h1_thickness = 10
+    for index in range(len(depth)):
+        if FS[index] < 1 and (current_depth is None or depth[index] - current_depth <= 0.3):
+            current_depth = depth[index]
+            if start_depth is None:
+                start_depth = depth[index]
+                h1_index = max(index - 1, 0)
+        else:
+            if current_depth is not None and current_depth - start_depth > 0.3:
+                h1_thickness = depth[h1_index]
+                break
+            current_depth = None
+            start_depth = None
+
+    # h2 is the sum of the liquefiable layers in the top 10 m
+    thickness = np.diff(depth, prepend=0.0)
+    if len(depth) > 1 and depth[0] > 0.05:
+        thickness[0] = depth[1] - depth[0]
+    with np.errstate(invalid='ignore'):
+        liquefiable = (0 < FS) & (FS < 1) & (depth <= 10)
+    h2_thickness = thickness[liquefiable].sum()
+    return h1_thickness, h2_thickness
+
+
+def batch_h1_h2(batch, depth_column_name, FS_column_name, method='basic'):
+    h1_h2 = h1_h2_basic_arrays if method == 'basic' else h1_h2_cumulative_arrays
+    depth = batch['rows'][depth_column_name]
+    FS = batch['rows'][FS_column_name]
+    offsets = batch['offsets']
+    values = np.array([h1_h2(depth[offsets[k]:offsets[k + 1]], FS[offsets[k]:offsets[k + 1]])
+                       for k in range(len(batch['site']))], dtype=float).reshape(-1, 2)
+    batch['sites']["h1_" + method + FS_column_name.lstrip("FS")] = values[:, 0]
+    batch['sites']["h2_" + method + FS_column_name.lstrip("FS")] = values[:, 1]
+    return batch
+
+
+# LPI, LSN, h1 and h2 of every site for one scenario, i.e. a magnitude and a PGA (a number or one value per site each).
+# The batch has to have gone through batch_soil_parameters and gets the scenario columns ('FS_scenario', ...).
+# FC_coeff and FC_exp are the constants of the FC correlation (see liq_event_terms).
+def batch_scenario(batch, Magnitude, PGA, depth_column_name='Depth (m)', FC_coeff=2 * 2.8, FC_exp=2.6):
+    terms = liq_event_terms(batch, Magnitude, FC_coeff, FC_exp)
+    _, FS = FS_from_terms(batch, terms, np.broadcast_to(np.asarray(PGA, dtype=float), (len(batch['site']),)))
+    batch['rows']['qc1ncs'] = terms['qc1ncs']
+    batch['rows']['FS_scenario'] = FS
+    batch = batch_h1_h2(batch, depth_column_name, 'FS_scenario', 'basic')
+    batch = batch_h1_h2(batch, depth_column_name, 'FS_scenario', 'cumulative')
+    batch = batch_LPI(batch, depth_column_name, 'FS_scenario', 'scenario')
+    batch = batch_LSN(batch, depth_column_name, 'qc1ncs', 'FS_scenario', 'scenario')
+    return batch
+
+
+# Same as functions.PGA_insertion for every site of the batch. Returns the batch and the sites missing from the PGA
+# workbook. PGA_filepath can also be the workbook already read into a DataFrame.
+def batch_PGA_insertion(batch, PGA_filepath, date1, date2):
+    pga = PGA_filepath if isinstance(PGA_filepath, pd.DataFrame) else pd.read_excel(PGA_filepath)
+    pga = pga.set_index('site')
+    missing = [site for site in batch['site'] if site not in pga.index]
+    pga = pga.reindex(batch['site'])
+    for column in ['PGA_' + date1, 'PGA_' + date2, 'Liquefaction']:
+        batch['sites'][column] = pd.to_numeric(pga[column], errors='coerce').to_numpy(dtype=float)
+    return batch, missing
+
+
+# Runs the same chain of calculations as main.py on every site of the batch
+def batch_pipeline(batch, Magnitude1, Magnitude2, date1, date2, depth_column_name='Depth (m)', thin_layer=False):
+    batch = batch_soil_parameters(batch, thin_layer=thin_layer)
+    batch = batch_FS_liq(batch, Magnitude1, Magnitude2, date1, date2)
+    for date in [date1, date2]:
+        FS = "FS_" + date
+        batch = batch_h1_h2(batch, depth_column_name, FS, 'basic')
+        batch = batch_h1_h2(batch, depth_column_name, FS, 'cumulative')
+        batch = batch_LPI(batch, depth_column_name, FS, date)
+        # main.py keeps the LPIish computed with the cumulative h1
+        batch = batch_LPIish(batch, depth_column_name, FS, date, "h1_cumulative_" + date)
+        batch = batch_LSN(batch, depth_column_name, "qc1ncs", FS, date)
+    return batch
+
+
+# Turns the batch back into {site: DataFrame}, with the site values on the first row like the pandas pipeline
+def unbatch(batch):
+    frames = {}
+    offsets = batch['offsets']
+    for k, site in enumerate(batch['site']):
+        start, end = offsets[k], offsets[k + 1]
+        df = pd.DataFrame({column: values[start:end] for column, values in batch['rows'].items()
+                           if column != 'Dr I No Solution'})
+        if 'Dr I' in df:
+            df['Dr I'] = df['Dr I'].astype(object)
+            df.loc[batch['rows']['Dr I No Solution'][start:end], 'Dr I'] = 'No Solution'
+        for column, value in batch['meta'][k].items():
+            df[column] = pd.Series([value], dtype=object)
+        for column, values in batch['sites'].items():
+            if column not in batch['meta'][k]:
+                df[column] = pd.Series([values[k]], dtype=float)
+        if len(df.index) > 1 and df.loc[0, 'GWT [m]'] < df.loc[0, 'preforo [m]']:
+            df['preforo [m]'] = df['preforo [m]'].astype(object)
+            df.at[1, 'preforo [m]'] = 'preforo is below GWT'
+        frames[site] = df
+    return frames
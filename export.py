@@ -0,0 +1,192 @@
+import os
+import re
+from collections import deque
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+# Formats understood by export_sites. "xlsx" is written with xlsxwriter in constant memory mode, "parquet" and
+# "feather" need pyarrow installed.
+EXPORT_FORMATS = ['xlsx', 'csv', 'parquet', 'feather']
+
+
+# Order of the columns in the exported site files
+def output_columns(depth_column_name, date1, date2):
+    return [depth_column_name, 'qc (MPa)', 'fs (kPa)', 'u (kPa)', 'qt (MPa)', "Rf (%)",
+            "Gamma (kN/m^3)", "Total Stress (kPa)", "Effective Stress (kPa)", "Fr (%)", "Ic",
+            'OCR R', 'OCR K', 'cu_bq', 'cu_14', "M", "k0_1", 'k0_2', "Vs R", 'Vs M', "k (m/s)", 'ψ', "φ' R",
+            "φ' K", "φ' J", "φ' M", "φ' U", 'Dr B', 'Dr K', 'Dr J', 'Dr I', 'qc1n', "u calc", "qc1ncs", 'Kσ',
+            'rd_' + date1, 'rd_' + date2, "CSR_" + date1,
+            "CRR_" + date1, 'CSR_' + date2, 'CRR_' + date2, "FS_" + date1, "FS_" + date2, 'h1_basic_' + date1,
+            'h2_basic_' + date1, 'h1_basic_' + date2, 'h2_basic_' + date2,
+            'h1_cumulative_' + date1, 'h2_cumulative_' + date1, 'h1_cumulative_' + date2, 'h2_cumulative_' + date2,
+            "LPI_" + date1, "LPI_" + date2, "LPIish_" + date1, "LPIish_" + date2,
+            'LSN_' + date1, 'LSN_' + date2,
+            "Unnamed: 5", 'GWT [m]', 'Date of CPT [gg/mm/aa]', 'u [si/no]', 'preforo [m]', 'PGA_' + date1,
+            'PGA_' + date2, 'Liquefaction']  # TODO: should we move date to the end so that it's easy to take out for the ML model code?
+
+
+def file_extension(fmt):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format: ' + str(fmt))
+    return '.' + fmt
+
+
+# Excel sheet names are limited to 31 characters and can't contain []:*?/\
+def sheet_name(site, used_names):
+    name = re.sub(r'[\[\]:*?/\\]', '_', str(site))[:31]
+    base = name
+    i = 1
+    while name.lower() in used_names:
+        suffix = '_' + str(i)
+        name = base[:31 - len(suffix)] + suffix
+        i += 1
+    used_names.add(name.lower())
+    return name
+
+
+# Yields the rows of df as plain python values. Empty cells (NaN, NaT, None) are returned as None so xlsxwriter
+# leaves them blank, and +-inf (e.g. ratios over a zero effective stress) as 'inf' and '-inf' like df.to_excel does.
+def excel_rows(df):
+    for row in df.itertuples(index=False, name=None):
+        values = []
+        for value in row:
+            if isinstance(value, str):
+                values.append(value)
+            elif pd.isna(value):
+                values.append(None)
+            elif isinstance(value, (float, np.floating)) and np.isinf(value):
+                values.append('inf' if value > 0 else '-inf')
+            elif isinstance(value, np.generic):
+                values.append(value.item())
+            else:
+                values.append(value)
+        yield values
+
+
+def write_sheet(workbook, worksheet, df):
+    worksheet.write_row(0, 0, [str(x) for x in df.columns], workbook.header_format)
+    for i, values in enumerate(excel_rows(df)):
+        worksheet.write_row(i + 1, 0, values)
+
+
+def open_workbook(path):
+    import xlsxwriter
+    # constant_memory flushes every row to disk as soon as the next one is started, so rows have to be written in
+    # order. That is what write_sheet does.
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'default_date_format': 'dd/mm/yyyy'})
+    workbook.header_format = workbook.add_format({'bold': True})
+    return workbook
+
+
+# Writes one dataframe as a single sheet workbook
+def write_xlsx(df, path, sheet='Sheet1'):
+    workbook = open_workbook(path)
+    write_sheet(workbook, workbook.add_worksheet(sheet), df)
+    workbook.close()
+
+
+# Columns that mix numbers and text (e.g. 'No Solution' in Dr I) can't be stored in a typed columnar file. Those are
+# written as text, everything else keeps its numeric or datetime type.
+def columnar_frame(df):
+    df = df.copy()
+    df.columns = [str(x) for x in df.columns]
+    for column in df.columns:
+        if df[column].dtype != object:
+            continue
+        values = df[column].dropna()
+        if values.map(lambda x: isinstance(x, pd.Timestamp)).all():
+            df[column] = pd.to_datetime(df[column])
+        elif values.map(lambda x: isinstance(x, (int, float, np.number)) and not isinstance(x, bool)).all():
+            df[column] = pd.to_numeric(df[column])
+        else:
+            df[column] = df[column].map(lambda x: x if pd.isna(x) else str(x)).astype('string')
+    return df
+
+
+def write_site(df, path, fmt='xlsx'):
+    if fmt == 'xlsx':
+        write_xlsx(df, path)
+    elif fmt == 'csv':
+        df.to_csv(path, index=False)
+    elif fmt == 'parquet':
+        columnar_frame(df).to_parquet(path, index=False)
+    elif fmt == 'feather':
+        columnar_frame(df).to_feather(path)
+    else:
+        raise ValueError('Unknown export format: ' + str(fmt))
+    return path
+
+
+def _export_one(args):
+    df, path, fmt, columns = args
+    if columns is not None:
+        df = df[columns]
+    return write_site(df, path, fmt)
+
+
+# Writes the sites as they are computed, so only the sites waiting to be written are in memory.
+# single_workbook=True writes every site as its own sheet of one workbook (xlsx only), otherwise one file per site is
+# written. With workers > 1 the per site files are written by parallel processes, with at most max_pending sites
+# waiting for them (4 per worker by default). close() waits for the last ones and returns the paths.
+class SiteWriter:
+    def __init__(self, export_folder_path, fmt='xlsx', columns=None, single_workbook=False,
+                 workbook_name='sites.xlsx', workers=1, max_pending=None):
+        file_extension(fmt)
+        self.folder = export_folder_path
+        self.fmt = fmt
+        self.columns = columns
+        self.paths = []
+        self.workbook = None
+        self.executor = None
+        if single_workbook:
+            if fmt != 'xlsx':
+                raise ValueError('single_workbook is only available for the xlsx format')
+            self.paths.append(os.path.join(export_folder_path, workbook_name))
+            self.workbook = open_workbook(self.paths[0])
+            self.used_names = set()
+        elif workers is None or workers > 1:
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+            self.pending = deque()
+            self.max_pending = max_pending or 4 * (workers or os.cpu_count() or 1)
+
+    def write(self, site, df):
+        if self.workbook is not None:
+            if self.columns is not None:
+                df = df[self.columns]
+            write_sheet(self.workbook, self.workbook.add_worksheet(sheet_name(site, self.used_names)), df)
+            return
+        job = (df, os.path.join(self.folder, str(site) + file_extension(self.fmt)), self.fmt, self.columns)
+        if self.executor is None:
+            self.paths.append(_export_one(job))
+            return
+        self.pending.append(self.executor.submit(_export_one, job))
+        while len(self.pending) > self.max_pending:
+            self.paths.append(self.pending.popleft().result())
+
+    def close(self):
+        if self.workbook is not None:
+            self.workbook.close()
+        if self.executor is not None:
+            while self.pending:
+                self.paths.append(self.pending.popleft().result())
+            self.executor.shutdown()
+        return self.paths
+
+
+# Exports the computed sites. frames is a dictionary {site: DataFrame} or a list of (site, DataFrame) pairs; see
+# SiteWriter for the options.
+def export_sites(frames, export_folder_path, fmt='xlsx', columns=None, single_workbook=False,
+                 workbook_name='sites.xlsx', workers=1):
+    writer = SiteWriter(export_folder_path, fmt, columns, single_workbook, workbook_name, workers)
+    for site, df in (frames.items() if isinstance(frames, dict) else frames):
+        writer.write(site, df)
+    return writer.close()
+
+
+# Writes the lists of sites that need to be checked by hand. checks is a dictionary {column name: list of sites}.
+def export_sites_to_check(checks, export_folder_path, fmt='xlsx'):
+    sites_to_check = pd.concat([pd.DataFrame({name: sites}) for name, sites in checks.items()], axis=1)
+    path = os.path.join(export_folder_path, 'sites_to_check' + file_extension(fmt))
+    write_site(sites_to_check, path, fmt)
+    return path
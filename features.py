@@ -0,0 +1,142 @@
+import io
+import os
+import json
+import numpy as np
+import pandas as pd
+from resample import depth_bins
+
+# Export of the processed sites for the ML model. Every site becomes a fixed size block of a float32 tensor
+# (sites x depth bins x features) stored as a .npy file, so training jobs can memory map it and read mini-batches
+# straight from disk. Site level labels go in a second (sites x labels) array and a JSON manifest describes both.
+# Depth bins with no readings are NaN. FS = 9999 is the placeholder above the GWT and is left out of the FS features, so
+# a bin across the GWT averages only the real FS values.
+
+FEATURES_FILE = 'features.npy'
+LABELS_FILE = 'labels.npy'
+MANIFEST_FILE = 'manifest.json'
+FS_PLACEHOLDER = 9999
+
+
+def default_features(date):
+    return ['Ic', 'qc1ncs', 'FS_' + date, 'Effective Stress (kPa)']
+
+
+def default_labels(date1, date2):
+    return ['Liquefaction', 'LPI_' + date1, 'LPI_' + date2, 'LSN_' + date1, 'LSN_' + date2]
+
+
+# Averages the feature columns of one site in each depth bin (bin k covers ((k - 1) * dz, k * dz])
+def bin_site(df, features, dz, n_bins, depth_column_name='Depth (m)'):
+    depth = pd.to_numeric(df[depth_column_name], errors='coerce').to_numpy(dtype=float)
+    keep = ~np.isnan(depth)
+    bins = depth_bins(depth[keep], dz) - 1
+    inside = bins < n_bins
+    bins = bins[inside]
+    block = np.full((n_bins, len(features)), np.nan, dtype=np.float32)
+    for j, feature in enumerate(features):
+        values = pd.to_numeric(df[feature], errors='coerce').to_numpy(dtype=float)[keep][inside]
+        if feature.startswith('FS'):
+            values = np.where(values >= FS_PLACEHOLDER, np.nan, values)
+        use = ~np.isnan(values)
+        total = np.bincount(bins[use], weights=values[use], minlength=n_bins)
+        number = np.bincount(bins[use], minlength=n_bins)
+        with np.errstate(invalid='ignore'):
+            block[:, j] = total / number
+    return block
+
+
+def site_labels(df, labels):
+    return np.array([pd.to_numeric(df.loc[0][label], errors='coerce') if label in df else np.nan
+                     for label in labels], dtype=np.float32)
+
+
+# .npy header of a float32 array. numpy leaves room in the header for the first axis to grow, so the header written
+# with the final number of sites has the same length as the one written when the file was opened.
+def npy_header(shape):
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {'descr': np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                                                  'fortran_order': False, 'shape': tuple(shape)})
+    return header.getvalue()
+
+
+# Writes the feature tensor while the sites are computed, so the number of sites doesn't have to be known up front and
+# no site is kept in memory. Every site is appended to the .npy files as it comes, and close() writes the final shape
+# in their headers.
+class FeatureTensorWriter:
+    def __init__(self, folder, features, labels, dz=0.1, max_depth=20.0, depth_column_name='Depth (m)'):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.features = list(features)
+        self.labels = list(labels)
+        self.dz = dz
+        self.n_bins = int(round(max_depth / dz))
+        self.depth_column_name = depth_column_name
+        self.sites = []
+        self.X = open(os.path.join(folder, FEATURES_FILE), 'wb')
+        self.X.write(npy_header(self.shape_X(0)))
+        self.y = open(os.path.join(folder, LABELS_FILE), 'wb')
+        self.y.write(npy_header(self.shape_y(0)))
+
+    def shape_X(self, n_sites):
+        return n_sites, self.n_bins, len(self.features)
+
+    def shape_y(self, n_sites):
+        return n_sites, len(self.labels)
+
+    def add(self, site, df):
+        self.X.write(bin_site(df, self.features, self.dz, self.n_bins, self.depth_column_name).tobytes())
+        self.y.write(site_labels(df, self.labels).tobytes())
+        self.sites.append(str(site))
+
+    def close(self):
+        for f, shape in [(self.X, self.shape_X(len(self.sites))), (self.y, self.shape_y(len(self.sites)))]:
+            header = npy_header(shape)
+            if len(header) != len(npy_header((0,) + shape[1:])):
+                raise ValueError('The .npy header of ' + f.name + ' has no room for ' + str(shape[0]) + ' sites')
+            f.seek(0)
+            f.write(header)
+            f.close()
+
+        manifest = {'features_file': FEATURES_FILE,
+                    'labels_file': LABELS_FILE,
+                    'dtype': 'float32',
+                    'shape': list(self.shape_X(len(self.sites))),
+                    'features': self.features,
+                    'labels': self.labels,
+                    'sites': self.sites,
+                    'dz': self.dz,
+                    'depth_bins': [round((k + 1) * self.dz, 6) for k in range(self.n_bins)]}
+        with open(os.path.join(self.folder, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=1)
+        return manifest
+
+
+# Writes the feature tensor of the processed sites. frames is a dictionary {site: DataFrame} (the results of main.py)
+# or a list of (site, DataFrame) pairs. The sites are written one at a time, so only one of them is in memory.
+def export_feature_tensor(frames, folder, features, labels, dz=0.1, max_depth=20.0,
+                          depth_column_name='Depth (m)'):
+    writer = FeatureTensorWriter(folder, features, labels, dz, max_depth, depth_column_name)
+    for site, df in (frames.items() if isinstance(frames, dict) else frames):
+        writer.add(site, df)
+    return writer.close()
+
+
+# Opens an exported tensor without loading it. Returns the manifest and the memory mapped features and labels.
+def load_feature_tensor(folder):
+    with open(os.path.join(folder, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    X = np.load(os.path.join(folder, manifest['features_file']), mmap_mode='r')
+    y = np.load(os.path.join(folder, manifest['labels_file']), mmap_mode='r')
+    return manifest, X, y
+
+
+# Yields (features, labels) mini-batches read from disk. Indices inside a batch are sorted so the reads stay as
+# contiguous as possible.
+def iter_minibatches(folder, batch_size=64, shuffle=True, seed=None):
+    manifest, X, y = load_feature_tensor(folder)
+    order = np.arange(X.shape[0])
+    if shuffle:
+        np.random.default_rng(seed).shuffle(order)
+    for start in range(0, len(order), batch_size):
+        index = np.sort(order[start:start + batch_size])
+        yield np.asarray(X[index]), np.asarray(y[index])
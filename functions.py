@@ -2,8 +2,10 @@ import pandas as pd
 import numpy as np
 import warnings
 import scipy.integrate as integrate
+from thin_layer import thin_layer_correction
 
-def soil_parameters(df):
+# thin_layer=True corrects qc and qt for thin layer effects before the Ic and Dr iterations (see thin_layer.py)
+def soil_parameters(df, thin_layer=False):
     Pa = 101.325  # Atmospheric pressure in kPa
 
     # /////////////////////////////////////////////// COLUMNS \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
@@ -31,6 +33,13 @@ def soil_parameters(df):
         if row['qt calc'] <= 0:
             df.at[i, 'qt calc'] = float('NaN')
 
+    # Thin layer correction. qc is scaled by the same ratio as qt
+    if thin_layer:
+        qt_corrected = thin_layer_correction(df['Depth (m)'], df['qt calc'], [0, len(df.index)])
+        ratio = np.nan_to_num(qt_corrected / df['qt calc'].to_numpy(dtype=float), nan=1.0)
+        df['qc calc'] = df['qc calc'] * ratio
+        df['qt calc'] = qt_corrected
+
     # Rf calc
     def calcRf(fs, qt_calc):
         if fs < 0.00001:
@@ -161,6 +170,9 @@ def soil_parameters(df):
         # Check to see if every row meets our error tolerance. If not, repeat the process.
         # If there have been more than 100 iterations, set the value to "No Solution"
         counter1 = True
+        if it_counter == 100:
+            # 'No Solution' is text, the column can't stay float
+            df['Dr I'] = df['Dr I'].astype(object)
         for i in range(len(df.index)):
             row = df.loc[i]
             if it_counter == 100:
@@ -381,6 +393,7 @@ def FS_liq(df, Magnitude1, Magnitude2, date1, date2): # FS equation from Idriss
     df = pd.concat([df, df_new_columns], axis=1)
 
     if df.loc[0]["GWT [m]"] < df.loc[0]['preforo [m]']:
+        df['preforo [m]'] = df['preforo [m]'].astype(object)
         df.at[1, 'preforo [m]'] = 'preforo is below GWT'
 
     # FSliq part
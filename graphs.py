@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import math
@@ -84,7 +85,36 @@ def plotGridlines(max, min):
             lower_bound + difference + difference / 2, lower_bound + difference * 2, upper_bound]
 
 
-def makePlots(depth_column, dependent_variables_list, counter=1):
+# Min-max decimation of a depth profile before plotting. The depths are split into n_rows runs of equal depth (one per
+# pixel row of the plot) and only the first, last, smallest and largest value of every run are kept, in depth order,
+# so the plotted line looks the same as the full one (spikes such as qc peaks included) with at most 4 points per
+# pixel row. The first NaN of a run is kept too so the gaps in the line stay.
+def decimate(depth, values, n_rows):
+    depth = np.asarray(depth, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if len(values) <= 4 * n_rows or np.isnan(depth).all():
+        return depth, values
+    top, bottom = np.nanmin(depth), np.nanmax(depth)
+    row = np.clip(((depth - top) / max(bottom - top, 1e-12) * n_rows).astype(int), 0, n_rows - 1)
+    row[np.isnan(depth)] = -1
+
+    new_run = np.r_[True, row[1:] != row[:-1]]
+    run = np.cumsum(new_run) - 1
+    keep = new_run | np.r_[new_run[1:], True]
+    nan = np.isnan(values)
+    smallest = np.lexsort((np.where(nan, np.inf, values), run))
+    largest = np.lexsort((np.where(nan, np.inf, -values), run))
+    first_of_run = np.r_[True, run[smallest][1:] != run[smallest][:-1]]
+    keep[smallest[first_of_run]] = True
+    keep[largest[first_of_run]] = True
+    nan_rows = np.nonzero(nan)[0]
+    keep[nan_rows[np.r_[True, run[nan_rows][1:] != run[nan_rows][:-1]]]] = True
+    keep &= row >= 0
+    return depth[keep], values[keep]
+
+
+# fmt is 'png' or a vector format ('svg', 'pdf'), which the decimation keeps small
+def makePlots(depth_column, dependent_variables_list, counter=1, fmt='png', dpi=300):
     plot_name = os.path.basename(filename)
 
     columns = dependent_variables_list
@@ -92,13 +122,12 @@ def makePlots(depth_column, dependent_variables_list, counter=1):
 
     if len(plots) == 1:
         fig, ax = plt.subplots()
-        y = depth_column
-        x = dependent_variables_list[0]
+        fig.set_figheight(6.9)
+        y, x = decimate(depth_column, dependent_variables_list[0], int(fig.get_figheight() * dpi))
         plt.plot(x, y)
         plt.xlabel(dependent_variables_list[0].name)
         plt.ylabel(depth_column.name)
         plt.title(plot_name)
-        fig.set_figheight(6.9)
         fig.set_figwidth(2.4)
         min = dependent_variables_list[0].min()
         if min == -9999:
@@ -111,7 +140,8 @@ def makePlots(depth_column, dependent_variables_list, counter=1):
         ax.invert_yaxis()  # inverts y axis
         ax.tick_params(axis='x', rotation=90)
         fig.set_tight_layout(True)
-        fig.savefig(filename + "\\" + plot_name + "_" + str(counter), bbox_inches='tight', dpi=300)
+        fig.savefig(filename + "\\" + plot_name + "_" + str(counter) + "." + fmt, bbox_inches='tight', dpi=dpi,
+                    format=fmt)
         plt.close(fig)
 
     else:
@@ -123,7 +153,8 @@ def makePlots(depth_column, dependent_variables_list, counter=1):
 
         for column, num_plot in zip(columns, plots):
 
-            num_plot.plot(column, depth_column)
+            y, x = decimate(depth_column, column, int(fig1.get_figheight() * dpi))
+            num_plot.plot(x, y)
 
             min = column.min()
             if min == -9999:
@@ -142,11 +173,14 @@ def makePlots(depth_column, dependent_variables_list, counter=1):
         plots[0].invert_yaxis()  # inverts y axis
         figure1 = fig1
 
-        figure1.savefig(filename + "\\" + plot_name + "_" + str(counter), bbox_inches='tight', dpi=300)
+        figure1.savefig(filename + "\\" + plot_name + "_" + str(counter) + "." + fmt, bbox_inches='tight', dpi=dpi,
+                        format=fmt)
         plt.close(figure1)
 
 
 folder_path = r"C:\Users\jdundas2\Documents\paper tests"
+plot_format = 'png' # 'png', or 'svg' / 'pdf' for vector plots
+plot_dpi = 300
 for filename in glob.glob(os.path.join(folder_path, "*.xls*")):
     print(filename)
     df = pd.read_excel(filename)
@@ -193,4 +227,4 @@ for filename in glob.glob(os.path.join(folder_path, "*.xls*")):
 
     for i in range(num_of_figures):
         counter = i + 1
-        makePlots(df['Depth (m)'], inputs[i], counter)
+        makePlots(df['Depth (m)'], inputs[i], counter, plot_format, plot_dpi)
@@ -1,32 +1,64 @@
 from functions import *
+from export import output_columns, SiteWriter, export_sites_to_check, write_site, file_extension
+from batch import build_batch, frame_to_sounding, batch_PGA_insertion, batch_pipeline, unbatch, take_sites
+from resample import resample_batch, resample_frame, resampling_drift, drift_report, drift_indexes
+from threshold import threshold_PGA
+from sharded import create_queue, run_sharded, merge_sites_to_check, site_summaries
+from readers import input_files, read_soundings, read_headers, sounding_to_frame, site_name
+from prescan import scan_headers, check_headers
+from features import FeatureTensorWriter, default_features, default_labels
+from spatial import export_maps, map_columns
+from regional import DepthStatistics, default_quantities, site_groups
+from sensitivity import sensitivity_report
 import pandas as pd
 import numpy as np
-import glob, os
+import os
 from datetime import datetime
 from tqdm import tqdm
 
-missing_pga = []
-preforo_below_GWT = []
-nan_preforo = []
+sites_to_check = {'Missing PGA sites': [], 'Preforo is below GWT': [], 'nan preforo': []}
 
 ################ USER INPUTS ############################
 american_date = True # True or False
 input_folder_path = r"C:\Users\hf233\Documents\Italy\5. CPTU standard\Files from drive"
+input_formats = ['xls'] # formats read from input_folder_path: 'xls', 'gef', 'ags' and/or 'csv' (.csv and .txt files)
 export_folder_path = r"C:\Users\hf233\Documents\Italy\5. CPTU standard\Files from drive\ran tests"
 vals_pga_and_liq = r"C:\Users\hf233\Documents\Italy\pga.xlsx"
 date_column_name = 'Date of CPT [gg/mm/aa]'
 depth_column_name = "Depth (m)"
 date1 = "20may"
 date2 = "29may"
+gef_gwt_var = None # #MEASUREMENTVAR number your supplier uses for the GWT in GEF files (GEF has no standard one)
+export_format = 'xlsx' # 'xlsx', 'csv', 'parquet' or 'feather'
+export_single_workbook = False # True writes every site as a sheet of one workbook (xlsx only)
+export_workers = 1 # processes writing the site files, 1 writes them in this process
+batch_engine = False # True runs every site at once with the array version of the calculations (batch.py)
+feature_tensor_folder = None # folder for the ML feature tensor (features.py), None to skip it
+threshold_report = False # True writes the threshold PGA of every site (threshold.py), batch_engine only
+sensitivity_analysis = False # True writes the LPI, LSN, h1 and h2 sensitivities (sensitivity.py), batch_engine only
+sensitivity_step = 0.05 # relative change of the inputs in the sensitivity analysis
+sensitivity_GWT_step = 0.25 # change of the GWT in m in the sensitivity analysis
+sharded_queue = None # path of a work queue database (sharded.py) to run resumable sharded batches, None to skip
+shard_unit_size = 50 # files per work unit of the sharded runs
+shard_workers = 4 # worker processes started on this machine for the sharded runs
+thin_layer = False # True corrects qc and qt for thin layer effects (thin_layer.py)
+resample_dz = None # e.g. 0.05 resamples the soundings to a uniform depth step in m before the calculations
+                   # (resample.py) and writes the LPI/LSN drift against the full resolution (not in the sharded runs)
+server_port = 8765 # port of the local computation server (python server.py)
+map_folder = None # folder for the LPI/LSN/h1/h2 rasters (spatial.py), needs x [m] and y [m] columns in the PGA workbook
+map_cell_size = 100 # raster cell size in m
+map_method = 'idw' # 'idw' or 'kriging'
+prescan = False # True checks the first row of every sounding (prescan.py) and only computes the sites that pass
+prescan_workers = 4 # number of processes reading the sounding headers
+regional_statistics = None # path of the .npz file with the depth binned regional statistics (regional.py), None to skip
+regional_group_column = 'Liquefaction' # column of the PGA workbook that groups the sites of the regional statistics
 #########################################################
 
 FS1 = "FS_" + date1
 FS2 = "FS_" + date2
 
-for filename in tqdm(glob.glob(os.path.join(input_folder_path, "*.xls*"))):
-    site = os.path.basename(filename).rstrip(".xls")
-    # print(site)
 
+def read_site(filename):
     df = pd.read_excel(filename)
 
     date = df.loc[0][date_column_name]
@@ -34,23 +66,58 @@ for filename in tqdm(glob.glob(os.path.join(input_folder_path, "*.xls*"))):
         if isinstance(date,pd.Timestamp):
             date = date.strftime('%m') + '/' + date.strftime('%d') + '/' + date.strftime('%Y')
     df.at[0, date_column_name] = pd.to_datetime(date, dayfirst=True)
+    return site_name(filename), df
+
+
+# Spreadsheets go through read_site, the native formats (GEF, AGS, CSV) through readers.py. A file can hold more than
+# one sounding (AGS).
+def read_sites(filename):
+    if os.path.splitext(filename)[1].lower().startswith('.xls'):
+        return [read_site(filename)]
+    return [(sounding['site'], sounding_to_frame(sounding)) for sounding in read_soundings(filename, gef_gwt_var)]
+
+
+def read_soundings_of(filename):
+    if os.path.splitext(filename)[1].lower().startswith('.xls'):
+        site, df = read_site(filename)
+        return [frame_to_sounding(df, site)]
+    return read_soundings(filename, gef_gwt_var)
+
+
+# Site names of a file without reading its data (AGS files can hold several soundings, so those are read)
+def site_names_of(filename):
+    if os.path.splitext(filename)[1].lower() == '.ags':
+        return [header['site'] for header in read_headers(filename)]
+    return [site_name(filename)]
+
 
-    export_folder_path_df = os.path.join(export_folder_path,site + '.xlsx')
+# Site names and first row values of a file (see prescan.py)
+def read_headers_of(filename):
+    return read_headers(filename, gef_gwt_var)
 
-    df = soil_parameters(df)
+
+# Runs the calculations for one site. Returns the site, its DataFrame (None if it can't be computed) and the
+# sites_to_check column the site belongs to (None if there's nothing to check). resample=False computes the site at
+# full resolution also when resample_dz is set.
+def process_site(site, df, resample=True):
+    # print(site)
+    if resample and resample_dz:
+        df = resample_frame(df, resample_dz, site=site)
+
+    df = soil_parameters(df, thin_layer)
 
     try:
         df = PGA_insertion(df,vals_pga_and_liq, site)
     except KeyError:
         # print("This site is missing its PGA: " + site)
-        missing_pga.append(site)
-        continue
+        return site, None, 'Missing PGA sites'
 
+    site_check = None
     preforo_checker = preforo_check(df, "GWT [m]", "preforo [m]")
     if preforo_checker == "GWT is above preforo":
-        preforo_below_GWT.append(site)
+        site_check = 'Preforo is below GWT'
     elif preforo_checker == "Nan preforo":
-        nan_preforo.append(site)
+        site_check = 'nan preforo'
 
     df = FS_liq(df, 6.1, 5.9, date1, date2)
 
@@ -71,20 +138,147 @@ for filename in tqdm(glob.glob(os.path.join(input_folder_path, "*.xls*"))):
     df = LSN(df, depth_column_name, "qc1ncs", FS2, date2)
 
     # Reorder the columns
-    df = df[[depth_column_name, 'qc (MPa)', 'fs (kPa)', 'u (kPa)', 'qt (MPa)', "Rf (%)",
-             "Gamma (kN/m^3)", "Total Stress (kPa)", "Effective Stress (kPa)", "Fr (%)", "Ic",
-             'OCR R', 'OCR K', 'cu_bq', 'cu_14', "M", "k0_1", 'k0_2', "Vs R", 'Vs M', "k (m/s)", 'ψ', "φ' R",
-             "φ' K", "φ' J", "φ' M", "φ' U", 'Dr B', 'Dr K', 'Dr J', 'Dr I', 'qc1n',"u calc","qc1ncs",'Kσ', 'rd_20may', 'rd_29may', "CSR_"+date1,
-             "CRR_"+date1, 'CSR_'+date2, 'CRR_'+date2, "FS_"+date1, "FS_"+date2,'h1_basic_'+date1,'h2_basic_'+date1,'h1_basic_'+date2,'h2_basic_'+date2,
-             'h1_cumulative_'+date1,'h2_cumulative_'+date1,'h1_cumulative_'+date2,'h2_cumulative_'+date2, "LPI_"+date1,"LPI_"+date2,"LPIish_"+date1,"LPIish_"+date2,
-             'LSN_'+date1, 'LSN_'+date2,
-             "Unnamed: 5", 'GWT [m]', 'Date of CPT [gg/mm/aa]', 'u [si/no]', 'preforo [m]', 'PGA_'+date1, 'PGA_'+date2,'Liquefaction']] #TODO: should we move date to the end so that it's easy to take out for the ML model code?
-
-    df.to_excel(export_folder_path_df, index=False)
-
-pga_df = pd.DataFrame({'Missing PGA sites':missing_pga})
-preforo_df = pd.DataFrame({'Preforo is below GWT':preforo_below_GWT})
-nan_preforo_df = pd.DataFrame({'nan preforo' : nan_preforo})
-sites_to_check = pd.concat([pga_df, preforo_df,nan_preforo_df], axis=1)
-export_folder_path_check_df = os.path.join(export_folder_path,'sites_to_check.xlsx')
-sites_to_check.to_excel(export_folder_path_check_df, index=False)
\ No newline at end of file
+    df = df.reindex(columns=output_columns(depth_column_name, date1, date2))
+    return site, df, site_check
+
+
+def process_file(filename):
+    return [process_site(site, df) for site, df in read_sites(filename)]
+
+
+# LPI and LSN drift of the resampling (resample.py) of a site computed by process_site, from the DataFrame read from
+# its file. The full resolution site is computed by process_site too, so both sides come from the same calculations.
+def site_drift(site, df, resampled):
+    full = process_site(site, df, resample=False)[1]
+    indexes = drift_indexes(date1, date2)
+    return drift_report([site], [len(full)], [len(resampled)], {index: [full.at[0, index]] for index in indexes},
+                        {index: [resampled.at[0, index]] for index in indexes}, indexes)
+
+
+# LPI and LSN drift of the resampling (resample.py) for the sites of a batch that are in the PGA workbook
+def resampling_drift_of(batch):
+    batch, missing = batch_PGA_insertion(batch, vals_pga_and_liq, date1, date2)
+    batch = take_sites(batch, [k for k, site in enumerate(batch['site']) if site not in missing])
+    return resampling_drift(batch, resample_dz, 6.1, 5.9, date1, date2, thin_layer=thin_layer)
+
+
+# Columns of a site that the feature tensor, the maps and the regional statistics read
+def summary_columns():
+    columns = [depth_column_name]
+    if feature_tensor_folder:
+        columns += default_features(date1) + ['FS_' + date2] + default_labels(date1, date2)
+    if map_folder:
+        columns += map_columns(date1, date2)
+    if regional_statistics:
+        columns += default_quantities(date1, date2)
+    return list(dict.fromkeys(columns))
+
+
+# Those columns of a computed site, kept in the work queue by the sharded workers
+def site_summary(site, df):
+    return df.reindex(columns=summary_columns()).apply(pd.to_numeric, errors='coerce')
+
+
+# The guard keeps the export worker processes from re-running the whole script when they import this file
+if __name__ == "__main__":
+    filenames = input_files(input_folder_path, input_formats)
+
+    if prescan:
+        # Site checks up front, only the files with sites to compute go on. sites_to_check is written with the others
+        # at the end.
+        sites_to_check, filenames = check_headers(scan_headers(filenames, read_headers_of, prescan_workers),
+                                                  vals_pga_and_liq, date_column_name)
+
+    # Filled in while the sites are computed (from the site summaries of the workers in the sharded runs)
+    statistics = DepthStatistics(default_quantities(date1, date2)) if regional_statistics else None
+    groups = site_groups(vals_pga_and_liq, regional_group_column) if regional_statistics else {}
+    # LPI/LSN drift of the resampled sites against the full resolution ones
+    drift = []
+    # Every site is written as soon as it is computed, also to the feature tensor. Only the first row of each site is
+    # kept, for the maps.
+    writer = None if sharded_queue else SiteWriter(export_folder_path, export_format,
+                                                   single_workbook=export_single_workbook, workers=export_workers)
+    tensor = FeatureTensorWriter(feature_tensor_folder, default_features(date1) + ['FS_' + date2],
+                                 default_labels(date1, date2)) if feature_tensor_folder else None
+    map_sites = {}
+
+    def keep_site(site, df):
+        if writer:
+            writer.write(site, df)
+        if tensor:
+            tensor.add(site, df)
+        if map_folder:
+            map_sites[site] = df.iloc[:1]
+
+    if sharded_queue:
+        # Other machines can join the run with sharded.run_worker on the same queue
+        create_queue(sharded_queue, filenames, shard_unit_size)
+        run_sharded(sharded_queue, process_file, export_folder_path, export_format, shard_workers,
+                    summarize=site_summary if tensor or map_folder or statistics else None)
+        merge_sites_to_check(sharded_queue, export_folder_path, export_format, list(sites_to_check),
+                             sites_to_check if prescan else None)
+        if tensor or map_folder or statistics:
+            for site, df in site_summaries(sharded_queue):
+                keep_site(site, df)
+                if statistics:
+                    statistics.add_frame(df, groups.get(site, 'all'), depth_column_name)
+        filenames = []
+
+    elif batch_engine:
+        # Every site goes through the calculations at once, see batch.py
+        batch = build_batch([sounding for filename in tqdm(filenames) for sounding in read_soundings_of(filename)])
+        if resample_dz:
+            drift.append(resampling_drift_of(batch))
+            batch = resample_batch(batch, resample_dz)
+        batch, missing = batch_PGA_insertion(batch, vals_pga_and_liq, date1, date2)
+        batch = batch_pipeline(batch, 6.1, 5.9, date1, date2, depth_column_name, thin_layer)
+        if threshold_report:
+            write_site(threshold_PGA(batch, [6.1, 5.9]), os.path.join(export_folder_path, 'threshold_PGA' +
+                                                                      file_extension(export_format)), export_format)
+        if sensitivity_analysis:
+            write_site(sensitivity_report(batch, {date1: 6.1, date2: 5.9}, sensitivity_step,
+                                          depth_column_name=depth_column_name, thin_layer=thin_layer,
+                                          GWT_step=sensitivity_GWT_step),
+                       os.path.join(export_folder_path, 'sensitivity' + file_extension(export_format)), export_format)
+        if not prescan:
+            sites_to_check['Missing PGA sites'] = missing
+        if statistics:
+            statistics.add_batch(batch, [None if site in missing else groups.get(site, 'all')
+                                         for site in batch['site']], depth_column_name)
+        for site, df in unbatch(batch).items():
+            if site in missing:
+                continue
+            preforo_checker = preforo_check(df, "GWT [m]", "preforo [m]")
+            if not prescan and preforo_checker == "GWT is above preforo":
+                sites_to_check['Preforo is below GWT'].append(site)
+            elif not prescan and preforo_checker == "Nan preforo":
+                sites_to_check['nan preforo'].append(site)
+            keep_site(site, df.reindex(columns=output_columns(depth_column_name, date1, date2)))
+        filenames = []
+
+    for filename in tqdm(filenames):
+        for site, raw in read_sites(filename):
+            site, df, site_check = process_site(site, raw)
+            if site_check and not prescan:
+                sites_to_check[site_check].append(site)
+            if df is not None:
+                keep_site(site, df)
+                if statistics:
+                    statistics.add_frame(df, groups.get(site, 'all'), depth_column_name)
+                if resample_dz:
+                    drift.append(site_drift(site, raw, df))
+
+    if writer:
+        writer.close()
+        export_sites_to_check(sites_to_check, export_folder_path, export_format)
+    if tensor:
+        tensor.close()
+    if map_folder:
+        export_maps(map_sites, vals_pga_and_liq, map_folder, map_columns(date1, date2), map_cell_size, map_method)
+    if statistics:
+        statistics.save(regional_statistics)
+        write_site(statistics.profiles(), os.path.join(export_folder_path, 'regional_profiles' +
+                                                       file_extension(export_format)), export_format)
+    if drift:
+        write_site(pd.concat(drift, ignore_index=True), os.path.join(export_folder_path, 'resampling_drift' +
+                                                                     file_extension(export_format)), export_format)
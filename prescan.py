@@ -0,0 +1,84 @@
+from functools import partial
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from readers import META_COLUMNS
+
+# Pre-scan of the input files before the calculations. Only the first row values of every sounding (GWT, preforo,
+# date, u flag) and its site name are read, in parallel, and the checks that main.py does site by site after
+# soil_parameters are done for every site at once:
+#   - Missing PGA sites    site not in the PGA workbook (not computed, like main.py)
+#   - Preforo is below GWT / nan preforo    preforo_check (computed, only reported)
+#   - GWT is 0 or missing  no GWT > 0, so the stresses and everything after them are NaN (computed, only reported)
+#   - Malformed date       date that read_site can't parse, which would stop the run (not computed)
+#   - Unreadable files     files that fail to open (not computed)
+# so the problems are known before the expensive pass, which only gets the files with sites to compute.
+
+CHECK_COLUMNS = ['Missing PGA sites', 'Preforo is below GWT', 'nan preforo', 'GWT is 0 or missing', 'Malformed date',
+                 'Unreadable files']
+
+
+# Headers of one file as (filename, site, meta) rows, or the error if it can't be read
+def scan_file(read_headers, filename):
+    try:
+        return [(filename, header['site'], header['meta']) for header in read_headers(filename)], None
+    except Exception as e:
+        return [], repr(e)
+
+
+# One row per sounding with the file, the site and the first row values. read_headers(filename) returns the
+# {'site', 'meta'} headers of a file (readers.read_headers, or main.read_headers_of with the GEF GWT variable).
+# Files that can't be read are listed in headers.attrs['unreadable'].
+def scan_headers(filenames, read_headers, workers=4):
+    scan = partial(scan_file, read_headers)
+    if workers > 1 and len(filenames) > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            scanned = list(pool.map(scan, filenames, chunksize=max(1, len(filenames) // (4 * workers))))
+    else:
+        scanned = [scan(filename) for filename in filenames]
+
+    records = [dict(meta, filename=filename, site=site) for headers, _ in scanned for filename, site, meta in headers]
+    columns = ['filename', 'site'] + META_COLUMNS + [column for record in records for column in record]
+    headers = pd.DataFrame(records, columns=list(dict.fromkeys(columns)))
+    headers.attrs['unreadable'] = [filename for filename, (_, error) in zip(filenames, scanned) if error]
+    return headers
+
+
+def valid_date(value):
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return True
+    try:
+        pd.to_datetime(value, dayfirst=True)
+        return True
+    except (ValueError, TypeError, OverflowError):
+        return False
+
+
+# Runs the checks on the scanned headers. Returns sites_to_check and the files that still have sites to compute.
+def check_headers(headers, PGA_filepath, date_column_name='Date of CPT [gg/mm/aa]'):
+    pga = pd.read_excel(PGA_filepath)
+    sites = headers['site']
+    GWT = pd.to_numeric(headers['GWT [m]'], errors='coerce').to_numpy(dtype=float)
+    preforo = pd.to_numeric(headers['preforo [m]'], errors='coerce').to_numpy(dtype=float)
+    dates = headers[date_column_name] if date_column_name in headers else pd.Series(np.nan, index=headers.index)
+
+    missing_PGA = ~sites.isin(pga['site']).to_numpy()
+    malformed_date = ~missing_PGA & ~dates.map(valid_date).to_numpy(dtype=bool)
+    computed = ~missing_PGA & ~malformed_date
+
+    # Same outcomes as functions.preforo_check
+    with np.errstate(invalid='ignore'):
+        preforo_ok = GWT >= preforo
+        no_GWT = ~(GWT > 0)
+    nan_preforo = ~preforo_ok & np.isnan(preforo)
+
+    checks = {'Missing PGA sites': missing_PGA,
+              'Preforo is below GWT': computed & ~preforo_ok & ~nan_preforo,
+              'nan preforo': computed & nan_preforo,
+              'GWT is 0 or missing': computed & no_GWT,
+              'Malformed date': malformed_date}
+    sites_to_check = {column: list(sites[checks[column]]) for column in CHECK_COLUMNS if column in checks}
+    sites_to_check['Unreadable files'] = list(headers.attrs.get('unreadable', []))
+    filenames = list(dict.fromkeys(headers['filename'][computed]))
+    return sites_to_check, filenames
@@ -0,0 +1,353 @@
+import os
+import csv
+import glob
+from array import array
+import numpy as np
+import pandas as pd
+from batch import ROW_COLUMNS, frame_to_sounding
+
+# Readers for the native CPT formats (GEF, AGS4 and plain CSV/ASCII exports). The files are read line by line and the
+# values go straight into typed arrays, without building a DataFrame. Every reader returns soundings in the layout
+# used by batch.py:
+#   {'site': name,
+#    'rows': {'Depth (m)', 'qc (MPa)', 'fs (kPa)', 'u (kPa)', 'qt (MPa)'} -> float arrays,
+#    'meta': {'GWT [m]', 'preforo [m]', 'Date of CPT [gg/mm/aa]', 'u [si/no]'} -> values of the first row}
+# sounding_to_frame turns one of them into the same DataFrame layout as the input spreadsheets.
+# Every format is named after the file, without its extension (site_name), also the spreadsheets read by main.py.
+
+# File patterns of each format. Only the formats asked for are read from the input folder, so that stray .csv/.txt
+# files next to the spreadsheets aren't taken for soundings.
+INPUT_PATTERNS = {'xls': ['*.xls*'], 'gef': ['*.gef', '*.GEF'], 'ags': ['*.ags', '*.AGS'], 'csv': ['*.csv', '*.txt']}
+
+META_COLUMNS = ['GWT [m]', 'Date of CPT [gg/mm/aa]', 'u [si/no]', 'preforo [m]']
+
+# Units in MPa. The values are converted to the units of the spreadsheets (MPa for qc/qt, kPa for fs/u).
+UNITS = {'mpa': 1.0, 'mn/m2': 1.0, 'n/mm2': 1.0, 'kpa': 0.001, 'kn/m2': 0.001, 'pa': 1e-6, 'bar': 0.1,
+         'kg/cm2': 0.0980665, 'kgf/cm2': 0.0980665, 'tsf': 0.0957605}
+SPREADSHEET_UNITS = {'qc (MPa)': 'mpa', 'qt (MPa)': 'mpa', 'fs (kPa)': 'kpa', 'u (kPa)': 'kpa'}
+
+
+# formats are keys of INPUT_PATTERNS
+def input_files(folder_path, formats=('xls',)):
+    files = set()
+    for input_format in formats:
+        for pattern in INPUT_PATTERNS[input_format]:
+            files.update(glob.glob(os.path.join(folder_path, pattern)))
+    return sorted(files)
+
+
+# Factor from unit to the spreadsheet unit of column. A column without a unit is in the standard unit of its format
+# (default). A unit that isn't known raises a ValueError rather than guessing, so the file is reported as unreadable.
+def unit_scale(unit, column, default, filename):
+    unit = unit.strip().lower().replace(' ', '') or default
+    if unit not in UNITS:
+        raise ValueError('Unknown unit ' + repr(unit) + ' of ' + column + ' in ' + filename)
+    return UNITS[unit] / UNITS[SPREADSHEET_UNITS[column]]
+
+
+def site_name(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def to_number(text, decimal_comma=False):
+    text = text.strip().strip('"')
+    if decimal_comma:
+        text = text.replace(',', '.')
+    try:
+        return float(text)
+    except ValueError:
+        return float('NaN')
+
+
+def new_rows():
+    return {column: array('d') for column in ROW_COLUMNS}
+
+
+# Arrays of the sounding. qt is filled in from qc and u when the file doesn't have it (qt = qc + u * (1 - a)).
+def finish_rows(rows, area_ratio=0.8):
+    rows = {column: np.frombuffer(values, dtype=float).copy() if len(values) else np.zeros(0)
+            for column, values in rows.items()}
+    n = max(len(values) for values in rows.values())
+    for column in ROW_COLUMNS:
+        if len(rows[column]) != n:
+            rows[column] = np.full(n, np.nan)
+    missing_qt = np.isnan(rows['qt (MPa)'])
+    u = np.where(np.isnan(rows['u (kPa)']), 0.0, rows['u (kPa)'])
+    rows['qt (MPa)'][missing_qt] = rows['qc (MPa)'][missing_qt] + u[missing_qt] / 1000 * (1 - area_ratio)
+    return rows
+
+
+def new_meta():
+    return {'GWT [m]': float('NaN'), 'Date of CPT [gg/mm/aa]': pd.NaT, 'u [si/no]': 'no', 'preforo [m]': float('NaN')}
+
+
+# ///////////////////////////////////////////////////// GEF \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+# GEF-CPT quantity numbers of the columns we use
+# (1 is the penetration length and 11 the corrected depth, used for the depth)
+GEF_QUANTITIES = {2: 'qc (MPa)', 3: 'fs (kPa)', 6: 'u (kPa)', 13: 'qt (MPa)'}
+GEF_PREDRILL_VAR = 13  # #MEASUREMENTVAR 13 is the pre-excavated depth
+GEF_AREA_RATIO_VAR = 3  # #MEASUREMENTVAR 3 is the cone net area ratio
+GEF_UNIT = 'mpa'  # GEF-CPT standard unit of qc, fs, u and qt
+
+
+# GEF has no standard keyword for the groundwater table. gwt_var is the #MEASUREMENTVAR number a data supplier uses for
+# it, if any. header_only=True stops at the end of the header and returns the soundings without their rows.
+def read_gef(filename, gwt_var=None, header_only=False):
+    columns = {}
+    units = {}
+    voids = {}
+    separator = None
+    record_separator = None
+    meta = new_meta()
+    area_ratio = 0.8
+    rows = new_rows()
+
+    with open(filename, errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith('#'):
+                break
+            keyword, _, value = line[1:].partition('=')
+            keyword = keyword.strip().upper()
+            fields = [x.strip() for x in value.split(',')]
+            if keyword == 'COLUMNINFO':
+                number = int(fields[0]) - 1
+                columns[int(fields[3])] = number
+                units[number] = fields[1].lower()
+            elif keyword == 'COLUMNVOID':
+                voids[int(fields[0]) - 1] = float(fields[1])
+            elif keyword == 'COLUMNSEPARATOR':
+                separator = value.strip() or None
+            elif keyword == 'RECORDSEPARATOR':
+                record_separator = value.strip() or None
+            elif keyword == 'STARTDATE':
+                meta['Date of CPT [gg/mm/aa]'] = pd.Timestamp(int(fields[0]), int(fields[1]), int(fields[2]))
+            elif keyword == 'MEASUREMENTVAR':
+                number = int(fields[0])
+                if number == GEF_PREDRILL_VAR:
+                    meta['preforo [m]'] = to_number(fields[1])
+                elif number == GEF_AREA_RATIO_VAR:
+                    area_ratio = to_number(fields[1])
+                elif number == gwt_var:
+                    meta['GWT [m]'] = to_number(fields[1])
+            if keyword == 'EOH':
+                break
+
+        # Depth from the corrected depth if there is one, otherwise from the penetration length
+        depth_quantity = 11 if 11 in columns else 1
+        wanted = [(columns[depth_quantity], 'Depth (m)')] if depth_quantity in columns else []
+        wanted += [(columns[q], name) for q, name in GEF_QUANTITIES.items() if q in columns]
+        scale = {number: unit_scale(units[number], name, GEF_UNIT, filename) if name in SPREADSHEET_UNITS else 1.0
+                 for number, name in wanted}
+        meta['u [si/no]'] = 'si' if 6 in columns else 'no'
+        if header_only:
+            return [{'site': site_name(filename), 'meta': meta}]
+
+        for line in f:
+            if record_separator:
+                line = line.rstrip().rstrip(record_separator)
+            values = line.split(separator) if separator else line.split()
+            if not values or not line.strip():
+                continue
+            for number, name in wanted:
+                value = to_number(values[number]) if number < len(values) else float('NaN')
+                if number in voids and value == voids[number]:
+                    value = float('NaN')
+                rows[name].append(value * scale[number])
+
+    return [{'site': site_name(filename), 'rows': finish_rows(rows, area_ratio), 'meta': meta}]
+# /////////////////////////////////////////////////// end GEF \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+
+
+# ///////////////////////////////////////////////////// AGS4 \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+# AGS4 headings of the data we use. The SCPG headings for the water level, pre-drill depth and test date vary between
+# data suppliers, so they can be changed here.
+AGS_ROWS = {'SCPT_DPTH': 'Depth (m)', 'SCPT_RES': 'qc (MPa)', 'SCPT_FRES': 'fs (kPa)', 'SCPT_PWP2': 'u (kPa)',
+            'SCPT_QT': 'qt (MPa)'}
+AGS_META = {'SCPG_WAT': 'GWT [m]', 'SCPG_PDEP': 'preforo [m]', 'SCPG_DATE': 'Date of CPT [gg/mm/aa]'}
+# AGS4 standard units of the SCPT headings
+AGS_UNITS = {'SCPT_RES': 'mpa', 'SCPT_FRES': 'kpa', 'SCPT_PWP2': 'kpa', 'SCPT_QT': 'mpa'}
+
+
+# Reads every CPT of an AGS4 file. Each LOCA_ID / SCPG_TESN pair is one sounding, named after the LOCA_ID (plus the
+# test number when a location has more than one test). With header_only=True the SCPT readings are only counted.
+def read_ags(filename, header_only=False):
+    soundings = {}
+    group = None
+    headings = []
+    units = []
+
+    def sounding(values):
+        key = (values.get('LOCA_ID', ''), values.get('SCPG_TESN', ''))
+        if key not in soundings:
+            soundings[key] = {'rows': new_rows(), 'meta': new_meta(), 'readings': 0, 'u': False}
+        return soundings[key]
+
+    with open(filename, newline='', errors='replace') as f:
+        for record in csv.reader(f):
+            if not record:
+                continue
+            kind = record[0]
+            if kind == 'GROUP':
+                group = record[1]
+                headings, units = [], []
+            elif kind == 'HEADING':
+                headings = record[1:]
+            elif kind == 'UNIT':
+                units = [x.lower() for x in record[1:]]
+            elif kind == 'DATA' and group in ['SCPT', 'SCPG']:
+                values = dict(zip(headings, record[1:]))
+                s = sounding(values)
+                if group == 'SCPT':
+                    s['readings'] += 1
+                    s['u'] = s['u'] or values.get('SCPT_PWP2', '') != ''
+                    if header_only:
+                        continue
+                    for i, heading in enumerate(headings):
+                        if heading in AGS_ROWS:
+                            name = AGS_ROWS[heading]
+                            value = to_number(record[i + 1])
+                            if name in SPREADSHEET_UNITS:
+                                value *= unit_scale(units[i] if i < len(units) else '', name, AGS_UNITS[heading],
+                                                    filename)
+                            s['rows'][name].append(value)
+                else:
+                    for heading, name in AGS_META.items():
+                        if values.get(heading, '') != '':
+                            if name == 'Date of CPT [gg/mm/aa]':
+                                s['meta'][name] = pd.to_datetime(values[heading], errors='coerce')
+                            else:
+                                s['meta'][name] = to_number(values[heading])
+
+    locations = [key[0] for key in soundings]
+    result = []
+    for (location, test), s in soundings.items():
+        if not s['readings']:
+            continue
+        name = location if locations.count(location) == 1 or not test else location + '_' + test
+        if header_only:
+            s['meta']['u [si/no]'] = 'si' if s['u'] else 'no'
+            result.append({'site': name, 'meta': s['meta']})
+            continue
+        rows = finish_rows(s['rows'])
+        s['meta']['u [si/no]'] = 'si' if not np.isnan(rows['u (kPa)']).all() else 'no'
+        result.append({'site': name, 'rows': rows, 'meta': s['meta']})
+    return result
+# /////////////////////////////////////////////////// end AGS4 \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+
+
+# ///////////////////////////////////////////////////// CSV \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+# Plain CSV/ASCII exports. The header row has to name the columns, either with the spreadsheet names ('Depth (m)',
+# 'qc (MPa)', ...) or with the short names below. The first row values (GWT, preforo, date) can be given as columns
+# like in the spreadsheets, or as '# GWT [m] = 1.5' comment lines before the header. The values are in the units of the
+# spreadsheets, with a decimal point or a decimal comma (see csv_decimal_comma).
+CSV_ALIASES = {'depth': 'Depth (m)', 'z': 'Depth (m)', 'qc': 'qc (MPa)', 'fs': 'fs (kPa)', 'u': 'u (kPa)',
+               'u2': 'u (kPa)', 'qt': 'qt (MPa)', 'gwt': 'GWT [m]', 'preforo': 'preforo [m]',
+               'predrill': 'preforo [m]', 'date': 'Date of CPT [gg/mm/aa]'}
+
+
+def csv_column(name):
+    name = name.strip().strip('"')
+    if name in ROW_COLUMNS or name in META_COLUMNS:
+        return name
+    return CSV_ALIASES.get(name.lower().split(' ')[0].split('[')[0].split('(')[0])
+
+
+# The readings of the first data row tell the decimal separator: a decimal comma when they have commas and no points.
+# Otherwise the commas in the readings are thousands separators (the columns can't be comma separated then).
+def csv_decimal_comma(header, values):
+    readings = [text for name, text in zip(header, values) if name in ROW_COLUMNS]
+    return any(',' in text for text in readings) and not any('.' in text for text in readings)
+
+
+def csv_reading(text, decimal_comma):
+    return to_number(text, True) if decimal_comma else to_number(text.replace(',', ''))
+
+
+def csv_meta_value(name, text, decimal_comma):
+    if name == 'Date of CPT [gg/mm/aa]':
+        return pd.to_datetime(text.strip().strip('"'), dayfirst=True, errors='coerce')
+    if name == 'u [si/no]':
+        return text.strip().strip('"')
+    return to_number(text, decimal_comma)
+
+
+# header_only=True stops after the first row and returns the sounding without its rows
+def read_csv_cpt(filename, header_only=False):
+    meta = new_meta()
+    meta_set = set()
+    rows = new_rows()
+    with open(filename, newline='', errors='replace') as f:
+        # Comment lines before the header
+        line = f.readline()
+        while line.startswith('#'):
+            name, _, value = line[1:].partition('=')
+            name = csv_column(name)
+            if name in META_COLUMNS:
+                meta[name] = csv_meta_value(name, value, ',' in value and '.' not in value)
+                meta_set.add(name)
+            line = f.readline()
+
+        delimiter = max([';', '\t', ','], key=line.count) if any(d in line for d in ';\t,') else None
+        decimal_comma = None
+        header = [csv_column(x) for x in (line.split(delimiter) if delimiter else line.split())]
+        first = True
+        for line in f:
+            if not line.strip():
+                continue
+            values = line.rstrip('\r\n').split(delimiter) if delimiter else line.split()
+            if decimal_comma is None:
+                decimal_comma = csv_decimal_comma(header, values)
+            for name, text in zip(header, values):
+                if name in ROW_COLUMNS:
+                    rows[name].append(csv_reading(text, decimal_comma))
+                elif first and name in META_COLUMNS and text.strip() and name not in meta_set:
+                    meta[name] = csv_meta_value(name, text, decimal_comma)
+            first = False
+            if header_only:
+                break
+
+    if header_only:
+        if 'u [si/no]' not in meta_set and 'u [si/no]' not in header:
+            meta['u [si/no]'] = 'si' if 'u (kPa)' in header else 'no'
+        return [{'site': site_name(filename), 'meta': meta}]
+    rows = finish_rows(rows)
+    if 'u [si/no]' not in meta_set and 'u [si/no]' not in header:
+        meta['u [si/no]'] = 'si' if not np.isnan(rows['u (kPa)']).all() else 'no'
+    return [{'site': site_name(filename), 'rows': rows, 'meta': meta}]
+# /////////////////////////////////////////////////// end CSV \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+
+
+# Reads any of the supported files. Spreadsheets still go through pandas. gef_gwt_var is the #MEASUREMENTVAR number of
+# the GWT in the GEF files (see read_gef).
+def read_soundings(filename, gef_gwt_var=None):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.gef':
+        return read_gef(filename, gef_gwt_var)
+    if extension == '.ags':
+        return read_ags(filename)
+    if extension in ['.csv', '.txt']:
+        return read_csv_cpt(filename)
+    return [frame_to_sounding(pd.read_excel(filename), site_name(filename))]
+
+
+# Site and first row values of the soundings of a file, without reading the depth series where the format allows it
+def read_headers(filename, gef_gwt_var=None):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.gef':
+        return read_gef(filename, gef_gwt_var, header_only=True)
+    if extension == '.ags':
+        return read_ags(filename, header_only=True)
+    if extension in ['.csv', '.txt']:
+        return read_csv_cpt(filename, header_only=True)
+    df = pd.read_excel(filename, nrows=1)
+    return [{'site': site_name(filename), 'meta': {column: df.loc[0][column] for column in df.columns
+                                                   if column not in ROW_COLUMNS}}]
+
+
+# DataFrame in the same layout as the input spreadsheets, with the first row values on row 0
+def sounding_to_frame(sounding):
+    df = pd.DataFrame(sounding['rows'])
+    for column, value in sounding['meta'].items():
+        df[column] = pd.Series([value], dtype=object)
+    return df
@@ -0,0 +1,186 @@
+import numpy as np
+from batch import build_batch, batch_soil_parameters, liq_event_terms, FS_from_terms, LPI_rows, LSN_strain
+from readers import new_rows, finish_rows, ROW_COLUMNS
+
+# Live FS, LPI, LSN, h1 and h2 while the cone is being pushed. IncrementalProfile takes the readings as they arrive
+# and only computes the new ones:
+#   - the total stress is carried over from the last reading (batch_soil_parameters with top)
+#   - Ic, Dr, FS, ... only depend on the reading itself and the stresses
+#   - LPI and LSN of a layer only need the depth of the reading above it, so they are running sums
+#   - h1 and h2 are the loops of h1_h2_basic_arrays / h1_h2_cumulative_arrays fed one reading at a time
+# The first reading is the only one that needs the next reading (the first layer is taken as thick as the second one),
+# so its LPI and h2 share is added when the results are asked for.
+# The Ic and Dr iterations of a site go on until every row of the site meets the tolerance, so the new readings iterate
+# as many times as the site has so far. A reading doesn't get cheaper when it converges quickly: once a site is at the
+# max_iterations (100) Dr iterations, which most sites reach within their first readings, every new reading runs all
+# 100 of them. That is a fixed cost per reading (a few ms), not one that grows with the depth of the sounding. When a
+# new reading makes the site iterate longer, Ic and Dr of the readings above change too and the whole sounding so far
+# is recomputed. That can happen at most max_iterations times for each of the two iterations, each costing the readings
+# so far, and in practice happens once or twice per sounding. The results are the same as batch_pipeline on the
+# readings so far, up to floating point rounding.
+# The thin layer correction needs the readings below, so it is not done live.
+
+
+# State of h1_h2_basic_arrays, fed one reading at a time
+class BasicH1H2:
+    def __init__(self):
+        self.last_liq_depth = None
+        self.start_liq_depth = None
+        self.h1 = None
+        self.result = None
+
+    # depth_before is the depth of the reading above (the reading itself for the first one)
+    def update(self, depth, FS, depth_before):
+        if self.result is not None:
+            return
+        if FS < 1 and (self.last_liq_depth is None or depth - self.last_liq_depth <= 0.3):
+            self.last_liq_depth = depth
+            if self.start_liq_depth is None:
+                self.start_liq_depth = depth
+                self.h1 = depth_before
+        elif self.last_liq_depth is not None and depth - self.last_liq_depth > 0.3:
+            self.result = self.h1, self.last_liq_depth - self.start_liq_depth
+
+    def value(self, last_depth):
+        return self.result if self.result is not None else (last_depth, 0)
+
+
+# State of the h1 loop of h1_h2_cumulative_arrays, fed one reading at a time (h2 is a running sum of the profile)
+class CumulativeH1:
+    def __init__(self):
+        self.current_depth = None
+        self.start_depth = None
+        self.h1_depth = None
+        self.h1 = 10
+        self.found = False
+
+    def update(self, depth, FS, depth_before):
+        if self.found:
+            return
+        if FS < 1 and (self.current_depth is None or depth - self.current_depth <= 0.3):
+            self.current_depth = depth
+            if self.start_depth is None:
+                self.start_depth = depth
+                self.h1_depth = depth_before
+        else:
+            if self.current_depth is not None and self.current_depth - self.start_depth > 0.3:
+                self.h1 = self.h1_depth
+                self.found = True
+                return
+            self.current_depth = None
+            self.start_depth = None
+
+
+class IncrementalProfile:
+    # events is {date: (Magnitude, PGA)}, like the PGA_<date> columns of the PGA workbook
+    def __init__(self, GWT, events, preforo=float('NaN'), site='live', area_ratio=0.8, max_iterations=100):
+        self.site = site
+        self.meta = {'GWT [m]': GWT, 'preforo [m]': preforo}
+        self.events = dict(events)
+        self.area_ratio = area_ratio
+        self.max_iterations = max_iterations
+        self.raw = new_rows()
+        self.iterations = (np.zeros(1), np.zeros(1))
+        self.reset()
+
+    # Clears everything computed from the readings
+    def reset(self):
+        self.rows = {}
+        self.last_depth = 0.0
+        self.last_total = 0.0
+        self.LPI = {date: 0.0 for date in self.events}
+        self.LSN = {date: 0.0 for date in self.events}
+        self.h2_cumulative = {date: 0.0 for date in self.events}
+        self.basic = {date: BasicH1H2() for date in self.events}
+        self.cumulative = {date: CumulativeH1() for date in self.events}
+
+    def __len__(self):
+        return len(self.raw['Depth (m)'])
+
+    def soil_parameters(self, rows, top, min_iterations=None):
+        batch = build_batch([{'site': self.site, 'rows': finish_rows(rows, self.area_ratio), 'meta': self.meta}])
+        return batch_soil_parameters(batch, self.max_iterations, top=(np.array([top[0]]), np.array([top[1]])),
+                                     min_iterations=min_iterations)
+
+    # Adds readings below the last one (numbers or arrays, qt is filled in from qc and u when missing). Returns the
+    # site results with the new readings.
+    def add(self, depth, qc, fs, u=float('NaN'), qt=float('NaN')):
+        depth = np.atleast_1d(np.asarray(depth, dtype=float))
+        values = {'Depth (m)': depth, 'qc (MPa)': qc, 'fs (kPa)': fs, 'u (kPa)': u, 'qt (MPa)': qt}
+        chunk = new_rows()
+        for column in ROW_COLUMNS:
+            chunk[column].extend(np.broadcast_to(np.asarray(values[column], dtype=float), depth.shape))
+            self.raw[column].extend(chunk[column])
+
+        batch = self.soil_parameters(chunk, (self.last_depth, self.last_total), self.iterations)
+        iterations = (batch['sites']['Ic iterations'], batch['sites']['Dr iterations'])
+        if self.rows and (iterations[0][0] > self.iterations[0][0] or iterations[1][0] > self.iterations[1][0]):
+            # The new readings make the site iterate longer, which changes Ic and Dr of the readings above them too
+            self.reset()
+            batch = self.soil_parameters(self.raw, (0.0, 0.0))
+            iterations = (batch['sites']['Ic iterations'], batch['sites']['Dr iterations'])
+        self.iterations = iterations
+        self.update(batch)
+        return self.results()
+
+    # Adds the readings of a batch that went through batch_soil_parameters to the running sums and h1/h2 states
+    def update(self, batch):
+        rows = batch['rows']
+        depth = rows['Depth (m)']
+        for date, (Magnitude, PGA) in self.events.items():
+            terms = liq_event_terms(batch, Magnitude)
+            rows['qc1ncs'] = terms['qc1ncs']
+            rows['CSR_' + date], rows['FS_' + date] = FS_from_terms(batch, terms, np.array([PGA]))
+
+        # Layers between each reading and the one above. The first reading of the sounding has no layer above yet.
+        above = np.r_[self.last_depth if self.rows else np.nan, depth[:-1]]
+        for date in self.events:
+            FS = rows['FS_' + date]
+            self.LPI[date] += np.nansum(LPI_rows(depth, above, FS))
+            with np.errstate(all='ignore'):
+                LSN = LSN_strain(rows['qc1ncs'], FS, depth) * 10 * np.log(depth / above)
+                liquefiable = (0 < FS) & (FS < 1) & (depth <= 10)
+            self.LSN[date] += np.nansum(LSN)
+            self.h2_cumulative[date] += np.nansum(np.where(liquefiable, depth - above, 0.0))
+            for k in range(len(depth)):
+                depth_before = depth[k] if np.isnan(above[k]) else above[k]
+                self.basic[date].update(depth[k], FS[k], depth_before)
+                self.cumulative[date].update(depth[k], FS[k], depth_before)
+
+        for column, values in rows.items():
+            self.rows.setdefault(column, []).extend(values.tolist())
+        self.last_depth = depth[-1]
+        self.last_total = rows['Total Stress (kPa)'][-1]
+
+    # Site results so far, with the column names of batch_pipeline
+    def results(self):
+        results = {}
+        if not len(self):
+            return results
+        depth = self.rows['Depth (m)']
+        for date in self.events:
+            FS = self.rows['FS_' + date]
+            LPI = self.LPI[date]
+            h2_cumulative = self.h2_cumulative[date]
+            # Share of the first reading, the first layer is as thick as the second one
+            first_thickness = depth[0]
+            if len(depth) > 1:
+                LPI += np.nan_to_num(LPI_rows(np.array(depth[:1]), np.array([2 * depth[0] - depth[1]]),
+                                              np.array(FS[:1]))[0])
+                if depth[0] > 0.05:
+                    first_thickness = depth[1] - depth[0]
+            if 0 < FS[0] < 1 and depth[0] <= 10:
+                h2_cumulative += first_thickness
+
+            h1_basic, h2_basic = self.basic[date].value(depth[-1])
+            results.update({'LPI_' + date: LPI, 'LSN_' + date: self.LSN[date],
+                            'h1_basic_' + date: h1_basic, 'h2_basic_' + date: h2_basic,
+                            'h1_cumulative_' + date: self.cumulative[date].h1,
+                            'h2_cumulative_' + date: h2_cumulative})
+        return results
+
+    # The readings so far as a batch (with PGA_<date> site columns) for batch_pipeline
+    def to_batch(self):
+        meta = dict(self.meta)
+        meta.update({'PGA_' + date: PGA for date, (_, PGA) in self.events.items()})
+        return build_batch([{'site': self.site, 'rows': finish_rows(self.raw, self.area_ratio), 'meta': meta}])
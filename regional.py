@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+from resample import depth_bins
+
+# Depth binned regional statistics, built in one pass while the sites are computed. Each depth bin (bin k covers
+# ((k - 1) * dz, k * dz] like features.py) keeps, for every quantity, the count, sum, sum of squares, min, max and a
+# histogram over fixed edges, plus the number of sites with readings in the bin and the number of those with FS < 1.
+# All of them are sums (or min/max), so the memory doesn't grow with the number of sites and the statistics of
+# different worker processes are merged by adding them up. Percentiles come from the histograms, so they are exact to
+# within one histogram bin (min and max are exact).
+# The accumulators are kept per group (e.g. a region or the Liquefaction label, given when the sites are added), and
+# the regional profiles can be asked for any set of groups. They can't be asked for an arbitrary set of sites: once
+# added, the sites of a group are summed together. To get the profiles of a set of sites, give those sites their own
+# group when they are added (e.g. a column of the PGA workbook as regional_group_column in main.py).
+# FS = 9999 is the placeholder above the GWT and is left out of the FS statistics.
+
+FS_PLACEHOLDER = 9999
+
+
+def default_quantities(date1, date2):
+    return ['Ic', 'qc1ncs', 'FS_' + date1, 'FS_' + date2]
+
+
+# Group of every site of the PGA workbook, from one of its columns (e.g. Liquefaction, or a region column)
+def site_groups(PGA_filepath, column='Liquefaction'):
+    pga = pd.read_excel(PGA_filepath).drop_duplicates('site')
+    if column not in pga:
+        return {}
+    return {site: str(label) for site, label in zip(pga['site'], pga[column])}
+
+
+# Histogram edges of a quantity. Values outside the edges go to the first or last histogram bin.
+def default_edges(quantity):
+    if quantity.startswith('FS'):
+        return np.geomspace(0.01, 100, 401)
+    if quantity == 'Ic':
+        return np.linspace(0, 5, 501)
+    if quantity.startswith('qc1n'):
+        return np.geomspace(1, 1000, 401)
+    return np.linspace(0, 1000, 1001)
+
+
+class DepthStatistics:
+    def __init__(self, quantities, dz=0.5, max_depth=20.0, edges=None):
+        self.quantities = list(quantities)
+        self.dz = dz
+        self.n_bins = int(round(max_depth / dz))
+        self.edges = [np.asarray((edges or {}).get(q, default_edges(q)), dtype=float) for q in self.quantities]
+        self.FS_quantities = [j for j, q in enumerate(self.quantities) if q.startswith('FS')]
+        self.groups = {}
+
+    # Accumulators of one group
+    def new_group(self):
+        n_q, n_bins = len(self.quantities), self.n_bins
+        return {'count': np.zeros((n_q, n_bins)),
+                'sum': np.zeros((n_q, n_bins)),
+                'sum2': np.zeros((n_q, n_bins)),
+                'min': np.full((n_q, n_bins), np.inf),
+                'max': np.full((n_q, n_bins), -np.inf),
+                'hist': [np.zeros((n_bins, len(e) - 1)) for e in self.edges],
+                'sites': np.zeros(n_bins),
+                'liquefiable': np.zeros((len(self.FS_quantities), n_bins))}
+
+    # Adds the rows of sites numbered site (one number per row) to a group
+    def add_rows(self, group, depth, site, columns):
+        acc = self.groups.setdefault(group, self.new_group())
+        n_bins = self.n_bins
+        keep = ~np.isnan(depth)
+        bins = depth_bins(depth[keep], self.dz) - 1
+        inside = bins < n_bins
+        bins, site = bins[inside], site[keep][inside]
+        columns = [np.asarray(values, dtype=float)[keep][inside] for values in columns]
+
+        # Sites with readings in each bin
+        site_bins = np.unique(site * n_bins + bins)
+        acc['sites'] += np.bincount(site_bins % n_bins, minlength=n_bins)
+
+        for j, values in enumerate(columns):
+            if j in self.FS_quantities:
+                values = np.where(values >= FS_PLACEHOLDER, np.nan, values)
+                liquefiable = np.unique((site * n_bins + bins)[values < 1])
+                acc['liquefiable'][self.FS_quantities.index(j)] += np.bincount(liquefiable % n_bins,
+                                                                               minlength=n_bins)
+            ok = ~np.isnan(values)
+            b, v = bins[ok], values[ok]
+            acc['count'][j] += np.bincount(b, minlength=n_bins)
+            acc['sum'][j] += np.bincount(b, weights=v, minlength=n_bins)
+            acc['sum2'][j] += np.bincount(b, weights=v * v, minlength=n_bins)
+            np.minimum.at(acc['min'][j], b, v)
+            np.maximum.at(acc['max'][j], b, v)
+            n_hist = len(self.edges[j]) - 1
+            h = np.clip(np.searchsorted(self.edges[j], v, side='right') - 1, 0, n_hist - 1)
+            acc['hist'][j] += np.bincount(b * n_hist + h, minlength=n_bins * n_hist).reshape(n_bins, n_hist)
+
+    # Adds every site of a batch (after batch_pipeline). groups is one label per site, or one label for all of them;
+    # sites labelled None are skipped.
+    def add_batch(self, batch, groups='all', depth_column_name='Depth (m)'):
+        labels = [groups] * len(batch['site']) if groups is None or isinstance(groups, str) else list(groups)
+        seg = batch['seg']
+        for group in dict.fromkeys(labels):
+            if group is None:
+                continue
+            rows = np.nonzero(np.array([label == group for label in labels], dtype=bool)[seg])[0]
+            self.add_rows(group, batch['rows'][depth_column_name][rows], seg[rows],
+                          [batch['rows'][q][rows] for q in self.quantities])
+
+    # Adds one site DataFrame (as computed by main.py)
+    def add_frame(self, df, group='all', depth_column_name='Depth (m)'):
+        depth = pd.to_numeric(df[depth_column_name], errors='coerce').to_numpy(dtype=float)
+        columns = [pd.to_numeric(df[q], errors='coerce').to_numpy(dtype=float) if q in df
+                   else np.full(len(depth), np.nan) for q in self.quantities]
+        self.add_rows(group, depth, np.zeros(len(depth), dtype=np.int64), columns)
+
+    # Adds the statistics of another DepthStatistics with the same quantities and bins (e.g. from another worker)
+    def merge(self, other):
+        for group, theirs in other.groups.items():
+            acc = self.groups.setdefault(group, self.new_group())
+            for key in ['count', 'sum', 'sum2', 'sites', 'liquefiable']:
+                acc[key] += theirs[key]
+            acc['min'] = np.minimum(acc['min'], theirs['min'])
+            acc['max'] = np.maximum(acc['max'], theirs['max'])
+            acc['hist'] = [mine + their for mine, their in zip(acc['hist'], theirs['hist'])]
+        return self
+
+    def save(self, path):
+        arrays = {'quantities': np.array(self.quantities), 'dz': self.dz, 'n_bins': self.n_bins,
+                  'groups': np.array([str(group) for group in self.groups])}
+        for j, e in enumerate(self.edges):
+            arrays['edges_%d' % j] = e
+        for g, acc in enumerate(self.groups.values()):
+            for key in ['count', 'sum', 'sum2', 'min', 'max', 'sites', 'liquefiable']:
+                arrays['%d_%s' % (g, key)] = acc[key]
+            for j, h in enumerate(acc['hist']):
+                arrays['%d_hist_%d' % (g, j)] = h
+        np.savez_compressed(path, **arrays)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            quantities = [str(q) for q in f['quantities']]
+            statistics = cls(quantities, float(f['dz']), float(f['dz']) * int(f['n_bins']),
+                             {q: f['edges_%d' % j] for j, q in enumerate(quantities)})
+            for g, group in enumerate(f['groups']):
+                acc = {key: f['%d_%s' % (g, key)] for key in ['count', 'sum', 'sum2', 'min', 'max', 'sites',
+                                                                'liquefiable']}
+                acc['hist'] = [f['%d_hist_%d' % (g, j)] for j in range(len(quantities))]
+                statistics.groups[str(group)] = acc
+        return statistics
+
+    # Percentiles of every bin from the merged histograms, interpolated inside the histogram bins
+    def percentile(self, hist, edges, low, high, q):
+        cumulative = np.cumsum(hist, axis=1)
+        total = cumulative[:, -1]
+        target = q * total
+        k = np.minimum((cumulative < target[:, None]).sum(axis=1), hist.shape[1] - 1)
+        before = np.where(k > 0, cumulative[np.arange(len(k)), k - 1], 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = np.clip((target - before) / hist[np.arange(len(k)), k], 0, 1)
+        value = edges[k] + fraction * (edges[k + 1] - edges[k])
+        return np.where(total > 0, np.clip(value, low, high), np.nan)
+
+    # Regional depth profiles of the groups (all of them by default), one row per depth bin
+    def profiles(self, groups=None, percentiles=(10, 50, 90)):
+        acc = self.subset(list(self.groups) if groups is None else groups).groups.get('all', self.new_group())
+
+        table = {'Depth from (m)': np.arange(self.n_bins) * self.dz,
+                 'Depth to (m)': (np.arange(self.n_bins) + 1) * self.dz,
+                 'Sites': acc['sites']}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for j, q in enumerate(self.quantities):
+                count = acc['count'][j]
+                mean = acc['sum'][j] / count
+                low = np.where(count > 0, acc['min'][j], np.nan)
+                high = np.where(count > 0, acc['max'][j], np.nan)
+                table[q + ' count'] = count
+                table[q + ' mean'] = mean
+                table[q + ' std'] = np.sqrt(np.maximum(acc['sum2'][j] / count - mean ** 2, 0))
+                table[q + ' min'] = low
+                for p in percentiles:
+                    table[q + ' p' + str(p)] = self.percentile(acc['hist'][j], self.edges[j], low, high, p / 100)
+                table[q + ' max'] = high
+            for i, j in enumerate(self.FS_quantities):
+                table['Liquefiable fraction ' + self.quantities[j]] = acc['liquefiable'][i] / acc['sites']
+        return pd.DataFrame(table)
+
+    # DepthStatistics with only the given groups, all under the 'all' label. groups are group labels, not sites.
+    def subset(self, groups):
+        unknown = [group for group in groups if group not in self.groups]
+        if unknown:
+            raise KeyError('Unknown groups ' + str(unknown) + ', the groups are ' + str(list(self.groups)))
+        subset = self.empty()
+        for group in groups:
+            other = self.empty()
+            other.groups['all'] = self.groups[group]
+            subset.merge(other)
+        return subset
+
+    # DepthStatistics with the same quantities and bins and nothing added
+    def empty(self):
+        return DepthStatistics(self.quantities, self.dz, self.dz * self.n_bins, dict(zip(self.quantities, self.edges)))
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+from batch import ROW_COLUMNS, build_batch, frame_to_sounding, copy_batch, unbatch, batch_pipeline
+
+# Resampling of dense soundings onto a uniform depth grid. A reading at depth z goes in the bin (z - dz, z] of the
+# grid, so every resampled row stands for the layer above it like the original rows do in LPI and LSN.
+# Readings with qc <= 0 are bad data (see soil_parameters) and are left out of the bin averages.
+
+
+# Grid bin of every depth. Depth 0 goes in the first bin.
+def depth_bins(depth, dz):
+    return np.maximum(np.ceil(np.round(depth / dz, 9)), 1).astype(np.int64)
+
+
+# Row of each bin that is first/last when the rows are sorted by key inside their bin
+def bin_extremes(bins, key):
+    order = np.lexsort((key, bins))
+    sorted_bins = bins[order]
+    starts = np.r_[True, sorted_bins[1:] != sorted_bins[:-1]]
+    ends = np.r_[sorted_bins[1:] != sorted_bins[:-1], True]
+    return order[starts], order[ends]
+
+
+# Nearest bin above and below every bin (itself included) where filled is True, inside the same site (-1 if none)
+def nearest_bins(filled, seg):
+    position = np.arange(len(filled))
+    above = np.maximum.accumulate(np.where(filled, position, -1))
+    below = np.minimum.accumulate(np.where(filled, position, len(filled))[::-1])[::-1]
+    above = np.where((above >= 0) & (seg[np.maximum(above, 0)] == seg), above, -1)
+    below = np.where((below < len(filled)) & (seg[np.minimum(below, len(filled) - 1)] == seg), below, -1)
+    return above, below
+
+
+# Linear interpolation of every bin between the nearest good bins of its own site. Bins with a good bin on one side
+# only take its value, bins of sites without good bins stay NaN.
+def interpolate_gaps(values, good, seg):
+    above, below = nearest_bins(good, seg)
+    low, high = values[np.maximum(above, 0)], values[np.maximum(below, 0)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.where(below > above, (np.arange(len(values)) - above) / (below - above), 0.0)
+        result = low + weight * (high - low)
+    result = np.where(above < 0, high, result)
+    return np.where((above < 0) & (below < 0), np.nan, result)
+
+
+# Resamples every site of a batch (before soil_parameters) to a uniform dz.
+# A bin normally gets the average of its qc, fs, u and qt readings. When the bin holds a thin layer, i.e. its largest
+# qc is thin_layer_ratio times its smallest, averaging would smear a thin sand layer into the clay around it, so the
+# bin keeps the reading with the largest qc instead (with its own fs, u and qt so Rf and Ic stay consistent).
+# That biases qc upward: the softer readings of those bins are dropped, so the resampled qc is above the bin average.
+# Where the layers only differ in qc that raises FS and lowers LPI and LSN (unconservative). The peak reading brings its
+# own fs too, which moves Ic, so on real profiles the drift can go either way. resampling_drift measures it on a set of
+# sites. thin_layer_ratio=None averages every bin.
+# Empty bins (gaps in the record) are linearly interpolated between the bins of the same site. Bins with only qc <= 0
+# readings (the pre-drill hole), and gaps next to them, keep qc = 0. max_depth cuts the profiles at that depth.
+def resample_batch(batch, dz=0.05, thin_layer_ratio=2.0, max_depth=None):
+    rows = batch['rows']
+    seg = batch['seg']
+    n_sites = len(batch['site'])
+    depth = rows['Depth (m)']
+    keep = ~np.isnan(depth)
+    if max_depth is not None:
+        keep &= depth <= max_depth
+
+    local = depth_bins(np.where(keep, depth, dz), dz)
+    first_bin = np.full(n_sites, np.iinfo(np.int64).max)
+    last_bin = np.full(n_sites, 0)
+    np.minimum.at(first_bin, seg[keep], local[keep])
+    np.maximum.at(last_bin, seg[keep], local[keep])
+    lengths = np.where(last_bin > 0, last_bin - first_bin + 1, 0)
+    first_bin[lengths == 0] = 0
+    offsets = np.zeros(n_sites + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    n_bins = offsets[-1]
+
+    # Bin of every row across the whole batch
+    bins = offsets[seg] + local - first_bin[seg]
+    bins, index = bins[keep], np.nonzero(keep)[0]
+
+    qc = rows['qc (MPa)'][index]
+    valid = qc > 0
+    counts = np.bincount(bins[valid], minlength=n_bins)
+    # Bins with readings that are all qc <= 0 (pre-drill hole) stay qc = 0 so soil_parameters skips them too
+    prehole = (np.bincount(bins, minlength=n_bins) > 0) & (counts == 0)
+    new_rows = {}
+    for column in ROW_COLUMNS[1:]:
+        values = rows[column][index]
+        use = (valid | prehole[bins]) & ~np.isnan(values)
+        total = np.bincount(bins[use], weights=values[use], minlength=n_bins)
+        number = np.bincount(bins[use], minlength=n_bins)
+        with np.errstate(invalid='ignore'):
+            new_rows[column] = total / number
+    new_rows['qc (MPa)'][prehole] = 0.0
+
+    # Thin layers keep their peak qc reading
+    if thin_layer_ratio is not None:
+        smallest, largest = bin_extremes(bins[valid], qc[valid])
+        thin = qc[valid][largest] >= thin_layer_ratio * qc[valid][smallest]
+        peak_bins, peak_rows = bins[valid][largest[thin]], index[valid][largest[thin]]
+        for column in ROW_COLUMNS[1:]:
+            new_rows[column][peak_bins] = rows[column][peak_rows]
+
+    # Fill the gaps in the record from the bins of the same site. Gaps next to a pre-drill hole bin are part of it.
+    new_seg = np.repeat(np.arange(n_sites), lengths)
+    empty = (counts == 0) & ~prehole
+    if empty.any():
+        above, below = nearest_bins(~empty, new_seg)
+        in_hole = empty & ((above < 0) | prehole[np.maximum(above, 0)] | (below < 0) |
+                           prehole[np.minimum(below, n_bins - 1)])
+        new_rows['qc (MPa)'][in_hole] = 0.0
+        gaps = empty & ~in_hole
+        for column in ROW_COLUMNS[1:]:
+            values = new_rows[column]
+            values[gaps] = interpolate_gaps(values, (counts > 0) & ~np.isnan(values), new_seg)[gaps]
+
+    new_rows['Depth (m)'] = np.round((first_bin[new_seg] + np.arange(n_bins) - offsets[new_seg]) * dz, 6)
+
+    return {'site': list(batch['site']),
+            'meta': [dict(meta) for meta in batch['meta']],
+            'offsets': offsets,
+            'seg': new_seg,
+            'rows': {column: new_rows[column] for column in ROW_COLUMNS},
+            'sites': {column: values.copy() for column, values in batch['sites'].items()}}
+
+
+# Same as resample_batch for a single site DataFrame. The first row values (GWT, date, ...) are kept on row 0.
+def resample_frame(df, dz=0.05, thin_layer_ratio=2.0, max_depth=None, site='site'):
+    batch = resample_batch(build_batch([frame_to_sounding(df, site)]), dz, thin_layer_ratio, max_depth)
+    return unbatch(batch)[site]
+
+
+# Runs the full resolution batch and its resampled version through the calculations and reports how far the LPI and
+# LSN of every site move. The batch needs the PGA_<date> site columns (see batch_PGA_insertion).
+def resampling_drift(batch, dz, Magnitude1, Magnitude2, date1, date2, thin_layer_ratio=2.0, thin_layer=False):
+    full = batch_pipeline(copy_batch(batch), Magnitude1, Magnitude2, date1, date2, thin_layer=thin_layer)
+    resampled = batch_pipeline(resample_batch(batch, dz, thin_layer_ratio), Magnitude1, Magnitude2, date1, date2,
+                               thin_layer=thin_layer)
+
+    return drift_report(batch['site'], np.diff(full['offsets']), np.diff(resampled['offsets']), full['sites'],
+                        resampled['sites'], drift_indexes(date1, date2))
+
+
+def drift_indexes(date1, date2):
+    return ['LPI_' + date1, 'LPI_' + date2, 'LSN_' + date1, 'LSN_' + date2]
+
+
+# One row per site with its number of rows and the indexes at full resolution and resampled. full and resampled are
+# {index: value of every site}.
+def drift_report(sites, rows, resampled_rows, full, resampled, indexes):
+    report = pd.DataFrame({'site': sites, 'rows': rows, 'resampled rows': resampled_rows})
+    for index in indexes:
+        full_values = np.asarray(full[index], dtype=float)
+        report[index] = full_values
+        report[index + ' resampled'] = np.asarray(resampled[index], dtype=float)
+        report[index + ' drift'] = report[index + ' resampled'] - full_values
+        with np.errstate(all='ignore'):
+            report[index + ' drift (%)'] = np.where(full_values != 0, report[index + ' drift'] / full_values * 100,
+                                                    np.nan)
+    return report
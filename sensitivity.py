@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+from batch import (concat_batches, take_sites, batch_soil_parameters, liq_event_terms, FS_from_terms, batch_LPI,
+                   batch_LSN, batch_h1_h2, segment_any)
+from readers import ROW_COLUMNS
+
+# Sensitivity of the site results (LPI, LSN, h1 and h2) to the event and model inputs, by central finite differences.
+# Every input is moved step (5% by default) down and up from its value, one at a time:
+#   - PGA        PGA_<date> of the site (CSR)
+#   - Magnitude  magnitude of the event (MSF and rd)
+#   - GWT        GWT of the site (stresses, so soil_parameters is run again). The GWT is moved by GWT_step in m
+#                instead, a percentage of a shallow GWT would hardly move it. A site without a GWT > 0 gets no
+#                stresses (see soil_parameters), so when GWT - GWT_step isn't > 0 the low case is the base case
+#                (a forward difference).
+#   - FC_coeff / FC_exp  constants of the FC = FC_coeff * Ic ** FC_exp correlation (qc1ncs)
+# The base case and all the moved cases are stacked into one batch, one copy of the sites per case, and go through
+# FS_liq, LPI and LSN together. Only the two GWT cases need soil_parameters again, which is done in one more pass; the
+# other cases reuse the soil_parameters output of the batch. h1 and h2 only depend on where FS < 1, so they are only
+# recomputed for the site copies where that changes.
+# The normalized sensitivity coefficient is (Y+ - Y-) / Y0 / (X+ - X-) * X0, i.e. the % change of the output for a 1%
+# change of the input. The low and high outputs are the bars of a tornado chart (Rank 1 is the widest bar).
+# The Note column flags the rows to read with care: the sites without a GWT > 0 (their outputs aren't computed, so their
+# coefficients are NaN), the forward differences of the GWT, and the NaN coefficients of NaN or 0 base outputs.
+
+PARAMETERS = ['PGA', 'Magnitude', 'GWT', 'FC_coeff', 'FC_exp']
+OUTPUTS = ['LPI', 'LSN', 'h1_basic', 'h2_basic', 'h1_cumulative', 'h2_cumulative']
+SCENARIO_COLUMNS = ['LPI_scenario', 'LSN_scenario', 'h1_basic_scenario', 'h2_basic_scenario',
+                    'h1_cumulative_scenario', 'h2_cumulative_scenario']
+FC_COEFF = 2 * 2.8
+FC_EXP = 2.6
+# Row columns of the soil_parameters output that FS_liq, LPI and LSN use
+LIQ_COLUMNS = ['Ic', 'Total Stress (kPa)', 'Effective Stress (kPa)', 'Dr I', 'Dr I No Solution']
+
+
+# The batch with only the given row columns (and every site column), with the GWT of the sites set to GWT if given
+def slim_batch(batch, columns, GWT=None):
+    return {'site': batch['site'],
+            'meta': batch['meta'],
+            'offsets': batch['offsets'],
+            'seg': batch['seg'],
+            'rows': {column: batch['rows'][column] for column in dict.fromkeys(columns)},
+            'sites': dict(batch['sites'], **{'GWT [m]': batch['sites']['GWT [m]'] if GWT is None else GWT})}
+
+
+# LPI, LSN, h1 and h2 of every site copy of a stacked batch, whose first n_sites copies are the base case. Every case
+# has the same rows in the same order, so h1 and h2 are only computed where FS < 1 differs from the base case. The
+# stacked batch itself is left as it is, so it can be used again for the next event.
+def stacked_results(stacked, Magnitude, PGA, FC_coeff, FC_exp, n_sites, depth_column_name):
+    stacked = dict(stacked, rows=dict(stacked['rows']), sites=dict(stacked['sites']))
+    terms = liq_event_terms(stacked, Magnitude, FC_coeff, FC_exp)
+    _, FS = FS_from_terms(stacked, terms, PGA)
+    stacked['rows']['qc1ncs'] = terms['qc1ncs']
+    stacked['rows']['FS_scenario'] = FS
+    stacked = batch_LPI(stacked, depth_column_name, 'FS_scenario', 'scenario')
+    stacked = batch_LSN(stacked, depth_column_name, 'qc1ncs', 'FS_scenario', 'scenario')
+
+    n_base_rows = stacked['offsets'][n_sites]
+    liquefied = FS < 1
+    changed = segment_any(liquefied != np.tile(liquefied[:n_base_rows], len(FS) // n_base_rows), stacked)
+    changed[:n_sites] = True
+    computed = batch_h1_h2(batch_h1_h2(take_sites(stacked, np.nonzero(changed)[0]), depth_column_name,
+                                       'FS_scenario', 'basic'), depth_column_name, 'FS_scenario', 'cumulative')
+    results = {column: stacked['sites'][column] for column in SCENARIO_COLUMNS[:2]}
+    for column in SCENARIO_COLUMNS[2:]:
+        values = np.full(len(changed), np.nan)
+        values[changed] = computed['sites'][column]
+        values = values.reshape(-1, n_sites)
+        results[column] = np.where(changed.reshape(-1, n_sites), values, values[0]).ravel()
+    return results
+
+
+# Sensitivity table of every site, event, output and input. The batch has to have gone through batch_soil_parameters
+# (with the same thin_layer) and have the PGA_<date> site columns. events is {date: Magnitude}.
+def sensitivity_report(batch, events, step=0.05, parameters=PARAMETERS, depth_column_name='Depth (m)',
+                       thin_layer=False, GWT_step=0.25):
+    n_sites = len(batch['site'])
+    cases = [(None, 0)] + [(parameter, sign) for parameter in parameters for sign in (-1, 1)]
+    columns = ['Depth (m)', depth_column_name] + LIQ_COLUMNS
+    copies = {(None, 0): slim_batch(batch, columns)}
+    GWT = batch['sites']['GWT [m]']
+    has_GWT = GWT > 0
+    with np.errstate(invalid='ignore'):
+        GWT_moved = (np.where(GWT - GWT_step > 0, GWT - GWT_step, GWT), GWT + GWT_step)
+
+    # The two GWT cases go through soil_parameters together
+    if 'GWT' in parameters:
+        GWT_batch = batch_soil_parameters(concat_batches([slim_batch(batch, ROW_COLUMNS, GWT_moved[0]),
+                                                          slim_batch(batch, ROW_COLUMNS, GWT_moved[1])]),
+                                          thin_layer=thin_layer)
+        copies[('GWT', -1)] = slim_batch(take_sites(GWT_batch, np.arange(n_sites)), columns)
+        copies[('GWT', 1)] = slim_batch(take_sites(GWT_batch, np.arange(n_sites, 2 * n_sites)), columns)
+    stacked = concat_batches([copies.get(case, copies[(None, 0)]) for case in cases])
+
+    tables = []
+    for date, Magnitude in events.items():
+        base = {'PGA': batch['sites']['PGA_' + date],
+                'Magnitude': np.full(n_sites, float(Magnitude)),
+                'GWT': GWT,
+                'FC_coeff': np.full(n_sites, FC_COEFF),
+                'FC_exp': np.full(n_sites, FC_EXP)}
+        moved = {name: GWT_moved if name == 'GWT' else (values * (1 - step), values * (1 + step))
+                 for name, values in base.items()}
+        inputs = {name: np.concatenate([moved[name][(sign + 1) // 2] if parameter == name else values
+                                        for parameter, sign in cases]) for name, values in base.items()}
+        results = stacked_results(stacked, inputs['Magnitude'], inputs['PGA'], inputs['FC_coeff'], inputs['FC_exp'],
+                                  n_sites, depth_column_name)
+
+        for output, column in zip(OUTPUTS, SCENARIO_COLUMNS):
+            values = results[column].reshape(len(cases), n_sites)
+            for k, parameter in enumerate(parameters):
+                low, high = values[1 + 2 * k], values[2 + 2 * k]
+                low_input, high_input = moved[parameter]
+                with np.errstate(all='ignore'):
+                    coefficient = (high - low) / values[0] / (high_input - low_input) * base[parameter]
+                note = np.select([~has_GWT, (parameter == 'GWT') & (low_input == GWT),
+                                  ~np.isfinite(coefficient) & (values[0] == 0), ~np.isfinite(coefficient)],
+                                 ['GWT is 0 or missing', 'Forward difference, GWT - GWT_step is above the ground',
+                                  'Base output is 0', 'NaN output'], '')
+                tables.append(pd.DataFrame({
+                    'site': batch['site'],
+                    'Event': date,
+                    'Output': output,
+                    'Parameter': parameter,
+                    'Base input': base[parameter],
+                    'Low input': low_input,
+                    'High input': high_input,
+                    'Base output': values[0],
+                    'Low output': low,
+                    'High output': high,
+                    'Swing': high - low,
+                    'Sensitivity': np.where(np.isfinite(coefficient) & has_GWT, coefficient, np.nan),
+                    'Note': note}))
+
+    report = pd.concat(tables, ignore_index=True)
+    report['Rank'] = (report['Swing'].abs().groupby([report['site'], report['Event'], report['Output']])
+                      .rank(method='first', ascending=False))
+    return report
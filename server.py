@@ -0,0 +1,313 @@
+import json
+import time
+import queue
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+import numpy as np
+import pandas as pd
+from batch import build_batch, concat_batches, take_sites, batch_soil_parameters, batch_scenario
+from resample import resample_batch
+
+# Local computation server for the GIS front end, so a query doesn't pay for the imports and the spreadsheet parsing
+# of a main.py run. The server keeps resident:
+#   - the PGA workbook, read once
+#   - the site profiles after soil_parameters (the expensive part), in an LRU cache
+#   - the LPI/LSN/h1/h2 results of every (site, magnitude, PGA) asked for, in a second LRU cache
+# Queries that arrive at the same time are put together by a micro-batcher and computed as one batch
+# (batch_scenario), so a burst of requests from the map costs one vectorized pass.
+#
+# Requests (JSON answers, NaN is null):
+#   GET  /health                              -> number of sites and cache sizes
+#   GET  /sites                               -> site names
+#   GET  /site/<name>                         -> results of the events of the PGA workbook (PGA_<date> columns)
+#   GET  /site/<name>?date=20may              -> results of one of those events
+#   GET  /site/<name>?magnitude=6.1&pga=0.25  -> results of a scenario
+#   POST /scenario {"sites": [...], "magnitude": 6.1, "pga": 0.25 or {site: pga}}  (or "date" instead of "pga")
+#        -> {"results": {site: results}}. Without "sites" every site is computed.
+# A site that can't be computed (e.g. its file can't be read) gets {"error": "Computation failed", ...} without failing
+# the other sites of its batch. A GET of such a site answers 500, bad queries answer 400.
+# Start it with python server.py, which takes the inputs of main.py. Bind it to localhost only.
+
+RESULT_COLUMNS = {'LPI': 'LPI_scenario', 'LSN': 'LSN_scenario',
+                  'h1_basic': 'h1_basic_scenario', 'h2_basic': 'h2_basic_scenario',
+                  'h1_cumulative': 'h1_cumulative_scenario', 'h2_cumulative': 'h2_cumulative_scenario'}
+FAILED = 'Computation failed'
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def __len__(self):
+        return len(self.items)
+
+
+# Collects the requests that arrive within window seconds of each other and hands them to compute(requests) as one
+# list. compute returns one result per request.
+class MicroBatcher:
+    def __init__(self, compute, window=0.002, max_requests=256):
+        self.compute = compute
+        self.window = window
+        self.max_requests = max_requests
+        self.requests = queue.Queue()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, request):
+        pending = {'request': request, 'done': threading.Event()}
+        self.requests.put(pending)
+        pending['done'].wait()
+        if 'error' in pending:
+            raise pending['error']
+        return pending['result']
+
+    def run(self):
+        while True:
+            pending = [self.requests.get()]
+            deadline = time.monotonic() + self.window
+            while len(pending) < self.max_requests:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                results = self.compute([p['request'] for p in pending])
+                for p, result in zip(pending, results):
+                    p['result'] = result
+            except Exception as e:
+                for p in pending:
+                    p['error'] = e
+            for p in pending:
+                p['done'].set()
+
+
+# PGA workbook as {site: {column: value}}
+def load_PGA_table(PGA_filepath):
+    pga = pd.read_excel(PGA_filepath).set_index('site')
+    pga = pga[~pga.index.duplicated()].apply(pd.to_numeric, errors='coerce')
+    return pga.to_dict('index')
+
+
+def to_json(value):
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+class SiteStore:
+    # filenames are the input files, read_soundings_of(filename) reads the soundings of a file and
+    # site_names_of(filename) lists its sites (see main.py). events is {date: magnitude} of the PGA_<date> columns.
+    def __init__(self, filenames, PGA_filepath, read_soundings_of, site_names_of, events, thin_layer=False,
+                 resample_dz=None, depth_column_name='Depth (m)', max_profiles=20000, max_results=200000,
+                 window=0.002):
+        self.read_soundings_of = read_soundings_of
+        self.events = dict(events)
+        self.thin_layer = thin_layer
+        self.resample_dz = resample_dz
+        self.depth_column_name = depth_column_name
+        self.files = {site: filename for filename in filenames for site in site_names_of(filename)}
+        self.PGA = load_PGA_table(PGA_filepath)
+        self.profiles = LRUCache(max_profiles)
+        self.results = LRUCache(max_results)
+        self.batcher = MicroBatcher(self.compute, window)
+
+    # Profiles after soil_parameters, one batch per site
+    def prepare(self, soundings):
+        batch = build_batch(soundings)
+        if self.resample_dz:
+            batch = resample_batch(batch, self.resample_dz)
+        batch = batch_soil_parameters(batch, thin_layer=self.thin_layer)
+        for k, site in enumerate(batch['site']):
+            self.profiles.put(site, take_sites(batch, [k]))
+
+    # Reads and prepares every site (up to the cache size) as one batch, so the first queries are already warm. Files
+    # that can't be read are left out, their queries answer the error.
+    def preload(self):
+        soundings = []
+        for filename in dict.fromkeys(self.files.values()):
+            try:
+                soundings += self.read_soundings_of(filename)
+            except Exception:
+                continue
+        self.prepare(soundings)
+
+    def profile(self, site):
+        profile = self.profiles.get(site)
+        if profile is None:
+            self.prepare(self.read_soundings_of(self.files[site]))
+            profile = self.profiles.get(site)
+        return profile
+
+    # Results of a list of (site, magnitude, PGA), computed as one batch. The sites that fail get an error instead, and
+    # if the batch itself fails its sites are computed one at a time, so one bad site doesn't fail the others.
+    def compute_items(self, items):
+        results = [None] * len(items)
+        profiles = {}
+        for k, (site, _, _) in enumerate(items):
+            try:
+                profiles[k] = self.profile(site)
+            except Exception as e:
+                results[k] = {'error': FAILED, 'detail': repr(e)}
+        try:
+            if profiles:
+                batch = batch_scenario(concat_batches(list(profiles.values())),
+                                       np.array([items[k][1] for k in profiles], dtype=float),
+                                       np.array([items[k][2] for k in profiles], dtype=float), self.depth_column_name)
+                for j, k in enumerate(profiles):
+                    results[k] = {name: to_json(batch['sites'][column][j]) for name, column in RESULT_COLUMNS.items()}
+        except Exception as e:
+            if len(profiles) == 1:
+                results[next(iter(profiles))] = {'error': FAILED, 'detail': repr(e)}
+            else:
+                for k in profiles:
+                    results[k] = self.compute_items([items[k]])[0]
+        return results
+
+    # requests are lists of (site, magnitude, PGA). Every request is one slice of a single batch.
+    def compute(self, requests):
+        results = iter(self.compute_items([item for request in requests for item in request]))
+        return [[next(results) for _ in request] for request in requests]
+
+    # Results of a scenario. PGA is a number, {site: PGA} or None to take the PGA_<date> column of the workbook.
+    def query(self, sites, magnitude=None, PGA=None, date=None):
+        if magnitude is None:
+            magnitude = self.events[date]
+        results = {}
+        site_PGAs = {}
+        todo = []
+        for site in sites:
+            if site not in self.files:
+                results[site] = {'error': 'Unknown site'}
+                continue
+            if isinstance(PGA, dict):
+                site_PGA = PGA.get(site)
+            elif PGA is not None:
+                site_PGA = PGA
+            else:
+                site_PGA = self.PGA.get(site, {}).get('PGA_' + date)
+            if site_PGA is None or np.isnan(float(site_PGA)):
+                results[site] = {'error': 'Missing PGA'}
+                continue
+            site_PGAs[site] = float(site_PGA)
+            key = (site, float(magnitude), float(site_PGA))
+            results[site] = self.results.get(key)
+            if results[site] is None:
+                todo.append(key)
+        if todo:
+            for key, result in zip(todo, self.batcher.submit(todo)):
+                if 'error' not in result:
+                    self.results.put(key, result)
+                results[key[0]] = result
+        for site, site_PGA in site_PGAs.items():
+            if 'error' in results[site]:
+                continue
+            liquefaction = self.PGA.get(site, {}).get('Liquefaction', np.nan)
+            results[site] = dict(results[site], magnitude=float(magnitude), PGA=site_PGA,
+                                 Liquefaction=to_json(liquefaction))
+        return results
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # bursts of map requests would overflow the default listen backlog of 5
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def answer(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        store = self.server.store
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == '/health':
+            return self.answer(200, {'sites': len(store.files), 'profiles': len(store.profiles),
+                                     'results': len(store.results)})
+        if url.path == '/sites':
+            return self.answer(200, sorted(store.files))
+        if not url.path.startswith('/site/'):
+            return self.answer(404, {'error': 'Not found'})
+
+        site = unquote(url.path[len('/site/'):])
+        if site not in store.files:
+            return self.answer(404, {'error': 'Unknown site'})
+        try:
+            if 'pga' in query:
+                magnitude = float(query['magnitude']) if 'magnitude' in query else None
+                date = query.get('date', next(iter(store.events)))
+                result = store.query([site], magnitude, float(query['pga']), date)[site]
+                return self.answer(500 if result.get('error') == FAILED else 200, result)
+            dates = [query['date']] if 'date' in query else list(store.events)
+            results = {date: store.query([site], float(query['magnitude']) if 'magnitude' in query else None, None,
+                                         date)[site] for date in dates}
+            failed = any(result.get('error') == FAILED for result in results.values())
+            return self.answer(500 if failed else 200, results)
+        except (KeyError, ValueError, TypeError) as e:
+            return self.answer(400, {'error': repr(e)})
+        except Exception as e:
+            return self.answer(500, {'error': repr(e)})
+
+    def do_POST(self):
+        store = self.server.store
+        if urlparse(self.path).path != '/scenario':
+            return self.answer(404, {'error': 'Not found'})
+        try:
+            content = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            sites = content.get('sites') or sorted(store.files)
+            date = content.get('date', next(iter(store.events)))
+            results = store.query(sites, content.get('magnitude'), content.get('pga'), date)
+        except (KeyError, ValueError, TypeError) as e:
+            return self.answer(400, {'error': repr(e)})
+        except Exception as e:
+            return self.answer(500, {'error': repr(e)})
+        return self.answer(200, {'results': results})
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Starts the server. With block=False it runs in a background thread and the server is returned (server.shutdown()
+# stops it), which is handy for tests against localhost. port=0 picks a free port (server.server_address).
+def serve(store, host='127.0.0.1', port=8765, block=True):
+    server = Server((host, port), RequestHandler)
+    server.store = store
+    if block:
+        server.serve_forever()
+    else:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    from main import (input_folder_path, input_formats, vals_pga_and_liq, date1, date2, depth_column_name, thin_layer,
+                      resample_dz, server_port, read_soundings_of, site_names_of)
+    from readers import input_files
+
+    store = SiteStore(input_files(input_folder_path, input_formats), vals_pga_and_liq, read_soundings_of, site_names_of,
+                      {date1: 6.1, date2: 5.9}, thin_layer, resample_dz, depth_column_name)
+    store.preload()
+    serve(store, port=server_port)
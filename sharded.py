@@ -0,0 +1,223 @@
+import os
+import time
+import pickle
+import socket
+import sqlite3
+import warnings
+from multiprocessing import Process
+from export import write_site, file_extension, export_sites_to_check
+
+# Resumable sharded runs. The input files are split into work units recorded in a SQLite database (the work queue).
+# Any number of worker processes, on this machine or on other machines that see the same folder, claim a unit, process
+# its sites and record every finished site, so a crashed or interrupted run picks up where it stopped. A unit that was
+# claimed but not finished within lease_seconds (worker died) is handed out again. A file that failed (e.g. a read
+# error on a network share) is tried again by the next run_sharded, up to max_attempts times. SQLite locking over
+# network filesystems depends on the filesystem, so the database is kept in the default rollback journal mode.
+#
+# process_file(filename) has to return a list of (site, DataFrame or None, check), one per sounding in the file, where
+# check is the sites_to_check column the site belongs to (or None). See main.process_file.
+# summarize(site, DataFrame), if given, returns a small picklable summary of every computed site, which is stored in
+# the queue with the site (in the same transaction as its file) and read back with site_summaries.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (unit_id INTEGER PRIMARY KEY, status TEXT NOT NULL DEFAULT 'pending',
+                                  worker TEXT, claimed_at REAL, attempts INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS files (filename TEXT PRIMARY KEY, unit_id INTEGER NOT NULL,
+                                  status TEXT NOT NULL DEFAULT 'pending', error TEXT,
+                                  attempts INTEGER NOT NULL DEFAULT 0);
+CREATE INDEX IF NOT EXISTS files_unit ON files (unit_id);
+CREATE TABLE IF NOT EXISTS sites (filename TEXT NOT NULL, site TEXT NOT NULL, site_check TEXT, output TEXT,
+                                  summary BLOB, PRIMARY KEY (filename, site));
+"""
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def worker_name():
+    return socket.gethostname() + ':' + str(os.getpid())
+
+
+def pid_alive(pid):
+    if os.name == 'nt':
+        # os.kill(pid, 0) would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # access denied, the process exists
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# True if worker (a worker_name) ran on this machine and its process is gone, e.g. after a crash
+def worker_dead(worker):
+    host, _, pid = (worker or '').rpartition(':')
+    return host == socket.gethostname() and pid.isdigit() and not pid_alive(int(pid))
+
+
+# Adds the files to the queue in units of unit_size files. Files already in the queue are left as they are, so running
+# it again on the same folder only adds the new files.
+def create_queue(db_path, filenames, unit_size=50):
+    conn = connect(db_path)
+    conn.execute('BEGIN IMMEDIATE')
+    known = {row[0] for row in conn.execute('SELECT filename FROM files')}
+    new = sorted(f for f in filenames if f not in known)
+    for start in range(0, len(new), unit_size):
+        unit_id = conn.execute('INSERT INTO units (status) VALUES (?)', ('pending',)).lastrowid
+        conn.executemany('INSERT INTO files (filename, unit_id) VALUES (?, ?)',
+                         [(f, unit_id) for f in new[start:start + unit_size]])
+    conn.execute('COMMIT')
+    conn.close()
+    return len(new)
+
+
+# Claims a pending unit, or a unit whose lease ran out or whose worker died on this machine (so a restart right after
+# a crash doesn't wait for the lease). Returns (unit_id, filenames still to do) or None.
+def claim_unit(conn, worker, lease_seconds=600):
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    row = conn.execute("SELECT unit_id FROM units WHERE status = 'pending' OR (status = 'claimed' AND claimed_at < ?) "
+                       "ORDER BY unit_id LIMIT 1", (now - lease_seconds,)).fetchone()
+    if row is None:
+        row = next((r for r in conn.execute("SELECT unit_id, worker FROM units WHERE status = 'claimed' "
+                                            "ORDER BY unit_id").fetchall() if worker_dead(r[1])), None)
+    if row is None:
+        conn.execute('COMMIT')
+        return None
+    unit_id = row[0]
+    conn.execute("UPDATE units SET status = 'claimed', worker = ?, claimed_at = ?, attempts = attempts + 1 "
+                 "WHERE unit_id = ?", (worker, now, unit_id))
+    conn.execute('COMMIT')
+    filenames = [r[0] for r in conn.execute("SELECT filename FROM files WHERE unit_id = ? AND status = 'pending' "
+                                            "ORDER BY filename", (unit_id,))]
+    return unit_id, filenames
+
+
+# Checkpoints one file (with the sites found in it) and renews the lease of its unit, if the worker still holds it.
+# sites is a list of (site, site_check, output, summary).
+def complete_file(conn, unit_id, worker, filename, status, sites=(), error=None):
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute('UPDATE files SET status = ?, error = ?, attempts = attempts + 1 WHERE filename = ?',
+                 (status, error, filename))
+    conn.executemany('INSERT OR REPLACE INTO sites (filename, site, site_check, output, summary) '
+                     'VALUES (?, ?, ?, ?, ?)', [(filename,) + tuple(site) for site in sites])
+    conn.execute('UPDATE units SET claimed_at = ? WHERE unit_id = ? AND worker = ?', (time.time(), unit_id, worker))
+    conn.execute('COMMIT')
+
+
+# A worker whose lease ran out (and was claimed by another worker) leaves the unit to the new one
+def complete_unit(conn, unit_id, worker):
+    conn.execute("UPDATE units SET status = 'done' WHERE unit_id = ? AND worker = ?", (unit_id, worker))
+
+
+# Failed files that haven't been tried max_attempts times go back to pending, with their units. Returns their number.
+def retry_failed(db_path, max_attempts=3):
+    conn = connect(db_path)
+    conn.execute('BEGIN IMMEDIATE')
+    n = conn.execute("UPDATE files SET status = 'pending' WHERE status = 'failed' AND attempts < ?",
+                     (max_attempts,)).rowcount
+    conn.execute("UPDATE units SET status = 'pending', worker = NULL WHERE status = 'done' AND unit_id IN "
+                 "(SELECT unit_id FROM files WHERE status = 'pending')")
+    conn.execute('COMMIT')
+    conn.close()
+    return n
+
+
+# Claims and processes units until the queue is empty
+def run_worker(db_path, process_file, export_folder_path, fmt='xlsx', lease_seconds=600, worker=None,
+               summarize=None):
+    worker = worker or worker_name()
+    conn = connect(db_path)
+    while True:
+        claimed = claim_unit(conn, worker, lease_seconds)
+        if claimed is None:
+            break
+        unit_id, filenames = claimed
+        for filename in filenames:
+            try:
+                sites = []
+                for site, df, site_check in process_file(filename):
+                    output = summary = None
+                    if df is not None:
+                        output = write_site(df, os.path.join(export_folder_path, site + file_extension(fmt)), fmt)
+                        if summarize:
+                            summary = pickle.dumps(summarize(site, df))
+                    sites.append((site, site_check, output, summary))
+            except Exception as e:
+                complete_file(conn, unit_id, worker, filename, 'failed', error=repr(e))
+                continue
+            complete_file(conn, unit_id, worker, filename, 'done', sites)
+        complete_unit(conn, unit_id, worker)
+    conn.close()
+
+
+# Local stand-in for a multi-node run: starts workers processes on this machine that share the queue, and starts them
+# again while failed files are left to retry. Returns the queue_progress, where files still 'pending' belong to units
+# claimed by live workers elsewhere.
+def run_sharded(db_path, process_file, export_folder_path, fmt='xlsx', workers=4, lease_seconds=600,
+                summarize=None, max_attempts=3):
+    retry_failed(db_path, max_attempts)
+    while True:
+        processes = [Process(target=run_worker, args=(db_path, process_file, export_folder_path, fmt, lease_seconds,
+                                                      None, summarize)) for _ in range(workers)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        if not retry_failed(db_path, max_attempts):
+            return queue_progress(db_path)
+
+
+# Number of files per status, e.g. {'done': 120, 'pending': 30}
+def queue_progress(db_path):
+    conn = connect(db_path)
+    progress = dict(conn.execute('SELECT status, COUNT(*) FROM files GROUP BY status').fetchall())
+    conn.close()
+    return progress
+
+
+# Yields (site, summary) for every site of the finished files that has a summary (see run_worker), one at a time
+def site_summaries(db_path):
+    conn = connect(db_path)
+    for site, summary in conn.execute("SELECT sites.site, sites.summary FROM sites JOIN files USING (filename) "
+                                      "WHERE files.status = 'done' AND sites.summary IS NOT NULL "
+                                      "ORDER BY sites.filename, sites.site"):
+        yield site, pickle.loads(summary)
+    conn.close()
+
+
+# Writes the sites_to_check report of every finished site in the queue, added to checks if given (e.g. the pre-scan
+# report of prescan.py). Files that failed or aren't finished yet are listed too.
+def merge_sites_to_check(db_path, export_folder_path, fmt='xlsx', check_columns=None, checks=None):
+    conn = connect(db_path)
+    rows = conn.execute("SELECT site_check, site FROM sites WHERE site_check IS NOT NULL "
+                        "ORDER BY filename, site").fetchall()
+    failed = [r[0] for r in conn.execute("SELECT filename FROM files WHERE status = 'failed' ORDER BY filename")]
+    unfinished = [r[0] for r in conn.execute("SELECT filename FROM files WHERE status = 'pending' ORDER BY filename")]
+    conn.close()
+    checks = {column: list(sites) for column, sites in (checks or {}).items()}
+    for column in check_columns or []:
+        checks.setdefault(column, [])
+    for site_check, site in rows:
+        if site not in checks.setdefault(site_check, []):
+            checks[site_check].append(site)
+    if failed:
+        checks['Failed files'] = failed
+    if unfinished:
+        checks['Unfinished files'] = unfinished
+        warnings.warn(str(len(unfinished)) + ' files of the queue are not finished (their unit is claimed by a worker '
+                      'that is still running or whose lease has not run out), run again to finish them')
+    return export_sites_to_check(checks, export_folder_path, fmt)
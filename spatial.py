@@ -0,0 +1,218 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import pdist
+from scipy.optimize import curve_fit
+
+# Site locations and maps of the site results. The coordinates are optional columns of the PGA workbook, in metres of
+# a projected system (UTM or the national grid), next to site / PGA_<date> / Liquefaction. Sites without them are left
+# out of the index. SpatialIndex answers radius and k nearest queries with a KD-tree, and the site values (LPI, LSN,
+# h1, h2, ...) are interpolated onto a raster by inverse distance weighting or ordinary kriging, both over the k
+# nearest sites of every cell, done for all cells at once. Rasters are written as ESRI ASCII grids (.asc), which any
+# GIS reads without extra libraries.
+
+COORDINATE_COLUMNS = ['x [m]', 'y [m]']
+NODATA = -9999
+
+
+def map_columns(date1, date2):
+    return [name + '_' + date for date in [date1, date2]
+            for name in ['LPI', 'LSN', 'h1_basic', 'h2_basic', 'h1_cumulative', 'h2_cumulative']]
+
+
+# Sites of the PGA workbook that have coordinates, and their (x, y)
+def site_coordinates(PGA_filepath):
+    pga = pd.read_excel(PGA_filepath)
+    if not set(COORDINATE_COLUMNS) <= set(pga.columns):
+        return [], np.zeros((0, 2))
+    pga[COORDINATE_COLUMNS] = pga[COORDINATE_COLUMNS].apply(pd.to_numeric, errors='coerce')
+    pga = pga.dropna(subset=COORDINATE_COLUMNS).drop_duplicates('site')
+    return list(pga['site']), pga[COORDINATE_COLUMNS].to_numpy(dtype=float)
+
+
+class SpatialIndex:
+    def __init__(self, sites, xy):
+        self.sites = list(sites)
+        self.xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        self.tree = cKDTree(self.xy)
+        self.position = {site: k for k, site in enumerate(self.sites)}
+
+    @classmethod
+    def from_PGA_table(cls, PGA_filepath):
+        return cls(*site_coordinates(PGA_filepath))
+
+    def __len__(self):
+        return len(self.sites)
+
+    # point is a site name or (x, y)
+    def location(self, point):
+        return self.xy[self.position[point]] if isinstance(point, str) else np.asarray(point, dtype=float)
+
+    # Sites within radius (m) of point, nearest first, as (site, distance) pairs
+    def within(self, point, radius):
+        xy = self.location(point)
+        found = np.asarray(self.tree.query_ball_point(xy, radius), dtype=np.int64)
+        distance = np.hypot(*(self.xy[found] - xy).T)
+        order = np.argsort(distance, kind='stable')
+        return [(self.sites[found[k]], distance[k]) for k in order]
+
+    # The k sites nearest to point, as (site, distance) pairs
+    def nearest(self, point, k=1):
+        distance, found = self.tree.query(self.location(point), k=min(k, len(self)))
+        return [(self.sites[j], d) for d, j in zip(np.atleast_1d(distance), np.atleast_1d(found))]
+
+    # Positions of the sites within radius of every point of an (n, 2) array, one array per point
+    def within_many(self, points, radius):
+        return [np.asarray(found, dtype=np.int64) for found in self.tree.query_ball_point(points, radius)]
+
+
+# ///////////////////////////////////////////////// RASTERS \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+# Raster covering the sites with square cells of cell_size m. Rows go from north to south like the .asc files.
+def raster_grid(xy, cell_size, margin=0.0):
+    lower = xy.min(axis=0) - margin
+    upper = xy.max(axis=0) + margin
+    n_columns, n_rows = np.maximum(np.ceil((upper - lower) / cell_size).astype(int), 1)
+    return {'x': lower[0] + (np.arange(n_columns) + 0.5) * cell_size,
+            'y': lower[1] + (np.arange(n_rows)[::-1] + 0.5) * cell_size,
+            'cell_size': cell_size,
+            'corner': (lower[0], lower[1])}
+
+
+def grid_points(grid):
+    x, y = np.meshgrid(grid['x'], grid['y'])
+    return np.column_stack([x.ravel(), y.ravel()])
+
+
+def write_ascii_grid(path, grid, values):
+    header = ('ncols {}\nnrows {}\nxllcorner {}\nyllcorner {}\ncellsize {}\nNODATA_value {}'
+              .format(len(grid['x']), len(grid['y']), grid['corner'][0], grid['corner'][1], grid['cell_size'], NODATA))
+    np.savetxt(path, np.where(np.isnan(values), NODATA, values), fmt='%.4f', header=header, comments='')
+    return path
+# ///////////////////////////////////////////////// end RASTERS \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+
+
+# /////////////////////////////////////////////// INTERPOLATION \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+# The k nearest sites (within radius) of every point. Missing neighbours get distance inf and position len(index).
+def neighbours(index, points, k, radius=np.inf):
+    distance, found = index.tree.query(points, k=min(k, len(index)), distance_upper_bound=radius)
+    return distance.reshape(len(points), -1), found.reshape(len(points), -1)
+
+
+# Inverse distance weighted values at points. values has one row per site of the index and one column per quantity;
+# NaN site values are skipped. Points are done chunk points at a time to bound the memory.
+def idw(index, values, points, k=12, power=2.0, radius=np.inf, chunk=100000):
+    values = np.asarray(values, dtype=float).reshape(len(index), -1)
+    padded = np.vstack([values, np.full((1, values.shape[1]), np.nan)])
+    result = np.full((len(points), values.shape[1]), np.nan)
+    for start in range(0, len(points), chunk):
+        distance, found = neighbours(index, points[start:start + chunk], k, radius)
+        with np.errstate(divide='ignore'):
+            weight = np.where(np.isinf(distance), 0.0, 1 / distance ** power)
+        hit = distance == 0
+        weight = np.where(hit.any(axis=1)[:, None], hit.astype(float), weight)[:, :, None]
+        neighbour_values = padded[found]
+        weight = np.where(np.isnan(neighbour_values), 0.0, weight)
+        with np.errstate(invalid='ignore'):
+            result[start:start + chunk] = (np.nansum(weight * neighbour_values, axis=1) / weight.sum(axis=1))
+    return result
+
+
+def exponential_variogram(h, nugget, sill, range_):
+    return nugget + sill * (1 - np.exp(-3 * h / range_))
+
+
+# Nugget, sill and range of an exponential variogram fitted to the binned semivariances of up to sample sites
+def fit_variogram(xy, values, n_lags=15, sample=2000, seed=0):
+    keep = ~np.isnan(values)
+    xy, values = xy[keep], values[keep]
+    if len(values) > sample:
+        pick = np.random.default_rng(seed).choice(len(values), sample, replace=False)
+        xy, values = xy[pick], values[pick]
+    variance = np.var(values)
+    h = pdist(xy)
+    if not len(h) or variance == 0:
+        return 0.0, max(variance, 1e-12), max(h.max() if len(h) else 1.0, 1e-12)
+    semivariance = 0.5 * pdist(values[:, None], 'sqeuclidean')
+    bins = np.minimum((h / (h.max() / 2) * n_lags).astype(int), n_lags)  # lags up to half the largest distance
+    use = bins < n_lags
+    count = np.bincount(bins[use], minlength=n_lags)
+    lag = np.bincount(bins[use], weights=h[use], minlength=n_lags)[count > 0] / count[count > 0]
+    gamma = np.bincount(bins[use], weights=semivariance[use], minlength=n_lags)[count > 0] / count[count > 0]
+    try:
+        (nugget, sill, range_), _ = curve_fit(exponential_variogram, lag, gamma, p0=[0, variance, h.max() / 4],
+                                              bounds=([0, 1e-12, 1e-9], [variance, 10 * variance, 10 * h.max()]))
+    except (RuntimeError, ValueError, TypeError):
+        nugget, sill, range_ = 0.0, variance, h.max() / 4
+    return nugget, sill, range_
+
+
+# Ordinary kriging of one quantity at points, from the k nearest sites of each point (sites with NaN values are left
+# out). All the local kriging systems of a chunk of points are solved together.
+def ordinary_kriging(index, values, points, k=12, variogram=None, radius=np.inf, chunk=20000):
+    values = np.asarray(values, dtype=float)
+    keep = ~np.isnan(values)
+    result = np.full(len(points), np.nan)
+    if keep.sum() < 2:
+        return result
+    local = SpatialIndex([index.sites[j] for j in np.nonzero(keep)[0]], index.xy[keep])
+    values = values[keep]
+    nugget, sill, range_ = variogram or fit_variogram(local.xy, values)
+
+    def covariance(h):
+        return np.where(h == 0, nugget + sill, sill - exponential_variogram(h, 0, sill, range_))
+
+    for start in range(0, len(points), chunk):
+        part = points[start:start + chunk]
+        distance, found = neighbours(local, part, k, radius)
+        present = ~np.isinf(distance)
+        found = np.where(present, found, 0)
+        n = found.shape[1]
+        site_xy = local.xy[found]
+        between = np.linalg.norm(site_xy[:, :, None, :] - site_xy[:, None, :, :], axis=-1)
+
+        # [C 1; 1' 0] [w; mu] = [c0; 1], with the missing neighbours turned into unit rows with weight 0
+        A = np.zeros((len(part), n + 1, n + 1))
+        A[:, :n, :n] = covariance(between) * (present[:, :, None] & present[:, None, :])
+        A[:, np.arange(n), np.arange(n)] += np.where(present, 1e-10 * sill, 1.0)
+        A[:, :n, n] = present
+        A[:, n, :n] = present
+        b = np.zeros((len(part), n + 1))
+        b[:, :n] = np.where(present, covariance(np.where(present, distance, 0.0)), 0.0)
+        b[:, n] = 1
+        solvable = present.any(axis=1)
+        weights = np.linalg.solve(A[solvable], b[solvable][:, :, None])[:, :n, 0]
+        result[start:start + chunk][solvable] = np.sum(weights * values[found[solvable]], axis=1)
+    return result
+
+
+# Rasters of the site values. values is a DataFrame indexed by site with one column per quantity (see site_values).
+# Returns the grid and {column: 2D array}.
+def interpolate_maps(index, values, cell_size=100.0, method='idw', k=12, power=2.0, radius=np.inf, margin=0.0):
+    values = values.reindex(index.sites)
+    grid = raster_grid(index.xy, cell_size, margin)
+    points = grid_points(grid)
+    shape = (len(grid['y']), len(grid['x']))
+    if method == 'idw':
+        result = idw(index, values.to_numpy(dtype=float), points, k, power, radius)
+        return grid, {column: result[:, j].reshape(shape) for j, column in enumerate(values.columns)}
+    return grid, {column: ordinary_kriging(index, values[column].to_numpy(dtype=float), points, k,
+                                           radius=radius).reshape(shape) for column in values.columns}
+# ///////////////////////////////////////////// end INTERPOLATION \\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
+
+
+# First row values of the result DataFrames ({site: DataFrame}) as a DataFrame indexed by site
+def site_values(frames, columns):
+    return pd.DataFrame({column: [pd.to_numeric(df.loc[0][column], errors='coerce') if column in df else np.nan
+                                  for df in frames.values()] for column in columns}, index=list(frames))
+
+
+# Writes one .asc raster per column. Returns the paths, or nothing if the PGA workbook has no coordinates.
+def export_maps(frames, PGA_filepath, folder, columns, cell_size=100.0, method='idw', **options):
+    index = SpatialIndex.from_PGA_table(PGA_filepath)
+    if not len(index):
+        return []
+    os.makedirs(folder, exist_ok=True)
+    grid, maps = interpolate_maps(index, site_values(frames, columns), cell_size, method, **options)
+    return [write_ascii_grid(os.path.join(folder, column + '_' + method + '.asc'), grid, values)
+            for column, values in maps.items()]
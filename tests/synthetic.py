@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+from batch import frame_to_sounding, build_batch
+
+# Synthetic soundings for the tests, laid out like the input spreadsheets: the depth series plus the site values (GWT,
+# date, u flag, preforo) on the first row. qc is a random walk with a few zero readings.
+
+
+def site_frame(n=200, seed=0, gwt=1.5, preforo=1.0, dz=0.02):
+    rng = np.random.default_rng(seed)
+    depth = np.round(np.arange(1, n + 1) * dz, 3)
+    qc = np.abs(2 + np.cumsum(rng.normal(0, 0.3, n))) + 0.2
+    qc[rng.random(n) < 0.02] = 0
+    u = rng.normal(20, 5, n)
+    df = pd.DataFrame({'Depth (m)': depth, 'qc (MPa)': qc, 'fs (kPa)': np.abs(rng.normal(30, 15, n)),
+                       'u (kPa)': u, 'qt (MPa)': qc + u / 1000 * 0.2})
+    df['Unnamed: 5'] = np.nan
+    for column, value in [('GWT [m]', gwt), ('Date of CPT [gg/mm/aa]', pd.Timestamp('2012-06-01')),
+                          ('u [si/no]', 'si'), ('preforo [m]', preforo)]:
+        df[column] = pd.Series([value], dtype=object)
+    return df
+
+
+def sounding(site, **options):
+    return frame_to_sounding(site_frame(**options), site)
+
+
+# PGA workbook of the sites, written to path
+def PGA_workbook(path, sites, PGA1=0.25, PGA2=0.2):
+    pd.DataFrame({'site': sites, 'PGA_20may': PGA1, 'PGA_29may': PGA2,
+                  'Liquefaction': [k % 2 for k in range(len(sites))]}).to_excel(path, index=False)
+    return path
+
+
+# Batch of synthetic sites with their PGA and Liquefaction site columns, ready for batch_pipeline
+def site_batch(soundings, PGA1=0.25, PGA2=0.2):
+    batch = build_batch(soundings)
+    n_sites = len(soundings)
+    batch['sites']['PGA_20may'] = np.broadcast_to(np.asarray(PGA1, dtype=float), (n_sites,)).copy()
+    batch['sites']['PGA_29may'] = np.broadcast_to(np.asarray(PGA2, dtype=float), (n_sites,)).copy()
+    batch['sites']['Liquefaction'] = np.arange(n_sites) % 2.0
+    return batch
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+import main
+from batch import ROW_COLUMNS, frame_to_sounding, batch_pipeline, unbatch
+from export import output_columns
+from synthetic import site_frame, sounding, site_batch, PGA_workbook
+
+# Seeds 3 and 4 have readings whose Dr I iteration doesn't converge ('No Solution'), 'shallow' has its preforo below the
+# GWT and 'dry' has every reading above the GWT
+FRAMES = {'no solution 3': (3, 1.5), 'no solution 4': (4, 1.5), 'shallow': (0, 0.3), 'dry': (1, 50.0)}
+
+
+def frames():
+    return {site: site_frame(200, seed, gwt=gwt) for site, (seed, gwt) in FRAMES.items()}
+
+
+# Numbers to 1e-9 and the same text ('No Solution', 'preforo is below GWT') in the same places
+def assert_same_values(expected, actual, column):
+    text = np.array([isinstance(x, str) for x in expected])
+    assert np.array_equal(text, [isinstance(x, str) for x in actual]), column
+    assert np.array_equal(expected[text], actual[text]), column
+    expected = pd.to_numeric(pd.Series(expected), errors='coerce').to_numpy(dtype=float)
+    actual = pd.to_numeric(pd.Series(actual), errors='coerce').to_numpy(dtype=float)
+    np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-9, equal_nan=True, err_msg=column)
+
+
+def test_batch_pipeline_matches_process_site(tmp_path, monkeypatch):
+    sites = frames()
+    monkeypatch.setattr(main, 'vals_pga_and_liq', PGA_workbook(str(tmp_path / 'pga.xlsx'), list(sites)))
+    batch = batch_pipeline(site_batch([frame_to_sounding(df, site) for site, df in sites.items()]),
+                           6.1, 5.9, '20may', '29may')
+    results = unbatch(batch)
+    columns = output_columns('Depth (m)', '20may', '29may')
+    for site, df in sites.items():
+        _, expected, _ = main.process_site(site, df.copy())
+        actual = results[site].reindex(columns=columns)
+        for column in columns:
+            assert_same_values(expected[column].to_numpy(), actual[column].to_numpy(), site + ' ' + column)
+
+    assert (results['no solution 4']['Dr I'] == 'No Solution').sum() == 2
+    dry = results['dry']
+    assert (dry['FS_20may'][dry['Ic'] < 2.6] == 9999).all()
+    assert dry.loc[0, 'LPI_20may'] == 0 and dry.loc[0, 'LSN_20may'] == 0
+
+
+def test_zero_row_site():
+    empty = {'site': 'empty', 'rows': {column: np.zeros(0) for column in ROW_COLUMNS}, 'meta': sounding('x')['meta']}
+    with_empty = batch_pipeline(site_batch([sounding('a', seed=0), empty, sounding('b', seed=1)]),
+                                6.1, 5.9, '20may', '29may')
+    without = batch_pipeline(site_batch([sounding('a', seed=0), sounding('b', seed=1)]), 6.1, 5.9, '20may', '29may')
+    for column, values in without['sites'].items():
+        if column != 'Liquefaction':
+            np.testing.assert_array_equal(with_empty['sites'][column][[0, 2]], values, err_msg=column)
+    sites = with_empty['sites']
+    assert sites['LPI_20may'][1] == 0 and sites['LSN_20may'][1] == 0 and sites['h2_basic_20may'][1] == 0
+    assert np.isnan(sites['h1_basic_20may'][1])
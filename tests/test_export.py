@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+from export import write_xlsx, export_sites, SiteWriter
+
+
+def test_write_xlsx_infinite_values(tmp_path):
+    # A reading at zero effective stress gives +-inf ratios, which xlsxwriter can't write as numbers
+    df = pd.DataFrame({'Depth (m)': [0.0, 0.02, 0.04], 'Qtn': [np.inf, -np.inf, 12.5],
+                       'Dr I': ['No Solution', np.nan, 0.4]})
+    path = str(tmp_path / 'site.xlsx')
+    write_xlsx(df, path)
+    back = pd.read_excel(path)
+    assert list(back['Qtn']) == [np.inf, -np.inf, 12.5]
+    assert back['Dr I'].iloc[0] == 'No Solution' and np.isnan(back['Dr I'].iloc[1])
+
+
+def test_export_sites_single_workbook(tmp_path):
+    frames = {'site' + str(k): pd.DataFrame({'a': np.arange(k + 1.0)}) for k in range(3)}
+    [path] = export_sites(frames, str(tmp_path), single_workbook=True)
+    sheets = pd.read_excel(path, sheet_name=None)
+    assert list(sheets) == list(frames)
+    for site, df in frames.items():
+        pd.testing.assert_frame_equal(sheets[site], df, check_dtype=False)
+
+
+def test_site_writer_bounded_pool(tmp_path):
+    writer = SiteWriter(str(tmp_path), 'csv', workers=2, max_pending=1)
+    for k in range(6):
+        writer.write('site' + str(k), pd.DataFrame({'a': np.arange(k + 1)}))
+    paths = writer.close()
+    assert len(paths) == 6
+    assert all(len(pd.read_csv(path)) == k + 1 for k, path in enumerate(paths))
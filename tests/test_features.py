@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+from features import bin_site, export_feature_tensor, load_feature_tensor, iter_minibatches
+
+
+def site_frame(n=50, seed=0):
+    rng = np.random.default_rng(seed)
+    depth = np.round(np.arange(1, n + 1) * 0.02, 3)
+    df = pd.DataFrame({'Depth (m)': depth, 'Ic': rng.uniform(1, 3, n), 'FS_20may': rng.uniform(0.5, 2, n)})
+    df['Liquefaction'] = np.nan
+    df.loc[0, 'Liquefaction'] = seed % 2
+    return df
+
+
+def test_bin_site_leaves_out_the_FS_placeholder():
+    df = site_frame()
+    df.loc[df['Depth (m)'] <= 0.15, 'FS_20may'] = 9999
+    block = bin_site(df, ['FS_20may'], 0.1, 5)
+    # Bin 2 covers (0.1, 0.2]: two readings above the GWT and five below
+    below = df['FS_20may'][(df['Depth (m)'] > 0.15) & (df['Depth (m)'] <= 0.2)]
+    assert np.isclose(block[1, 0], below.mean())
+    assert np.isnan(block[0, 0])
+
+
+def test_export_feature_tensor_round_trip(tmp_path):
+    frames = {'site' + str(k): site_frame(40 + 10 * k, k) for k in range(3)}
+    manifest = export_feature_tensor(frames, str(tmp_path), ['Ic', 'FS_20may'], ['Liquefaction'], dz=0.1,
+                                     max_depth=1.0)
+    manifest, X, y = load_feature_tensor(str(tmp_path))
+    assert X.shape == (3, 10, 2) and y.shape == (3, 1)
+    assert manifest['sites'] == list(frames)
+    for k, df in enumerate(frames.values()):
+        np.testing.assert_array_equal(X[k], bin_site(df, ['Ic', 'FS_20may'], 0.1, 10))
+        assert y[k, 0] == k % 2
+    assert sum(len(features) for features, _ in iter_minibatches(str(tmp_path), 2, seed=0)) == 3
+
+
+def test_export_feature_tensor_no_sites(tmp_path):
+    export_feature_tensor({}, str(tmp_path), ['Ic'], ['Liquefaction'])
+    _, X, y = load_feature_tensor(str(tmp_path))
+    assert X.shape == (0, 200, 1) and y.shape == (0, 1)
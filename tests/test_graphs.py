@@ -0,0 +1,49 @@
+import numpy as np
+from graphs import decimate
+
+
+# 20 m of readings every 0.2 mm: a noisy baseline with single-reading spikes and dips (one every 0.48 m), a NaN gap and
+# a lone NaN
+def spike_profile(seed=0):
+    rng = np.random.default_rng(seed)
+    n = 100000
+    depth = np.linspace(0, 20, n)
+    values = 2 + rng.normal(0, 0.1, n)
+    spikes = np.arange(40) * 2400 + 1000 + rng.integers(0, 100, 40)
+    values[spikes[:20]] = 50 + np.arange(20)
+    values[spikes[20:]] = -10 - np.arange(20)
+    values[40000:40500] = np.nan
+    values[70001] = np.nan
+    return depth, values, spikes
+
+
+def test_decimate_keeps_spikes_and_gaps():
+    depth, values, spikes = spike_profile()
+    n_rows = 600
+    kept_depth, kept_values = decimate(depth, values, n_rows)
+    assert len(kept_values) <= 5 * n_rows
+    assert np.all(np.diff(kept_depth) >= 0)
+    # Every spike and dip is still there at its depth
+    for k in spikes:
+        assert np.any((kept_depth == depth[k]) & (kept_values == values[k]))
+    # Same smallest and largest value in every pixel row
+    row = np.minimum((depth / 20 * n_rows).astype(int), n_rows - 1)
+    kept_row = np.minimum((kept_depth / 20 * n_rows).astype(int), n_rows - 1)
+    for r in range(n_rows):
+        full, part = values[row == r], kept_values[kept_row == r]
+        if np.isnan(full).all():
+            assert np.isnan(part).all()
+        else:
+            assert np.nanmin(part) == np.nanmin(full) and np.nanmax(part) == np.nanmax(full)
+    # The line still breaks at the gap and at the lone NaN
+    gap = (kept_depth >= depth[40000]) & (kept_depth <= depth[40499])
+    assert gap.any() and np.isnan(kept_values[gap]).all()
+    assert np.isnan(kept_values[kept_depth == depth[70001]]).all()
+    assert np.isnan(kept_values[(kept_depth > depth[39999]) & (kept_depth < depth[40500])]).all()
+
+
+def test_decimate_short_profiles_unchanged():
+    depth, values, _ = spike_profile()
+    depth, values = depth[39000:41000], values[39000:41000]
+    kept_depth, kept_values = decimate(depth, values, 600)
+    assert np.array_equal(kept_depth, depth) and np.array_equal(kept_values, values, equal_nan=True)
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from readers import input_files, read_gef, read_ags, read_csv_cpt, read_soundings, site_name
+
+GEF = """#GEFID= 1, 1, 0
+#COLUMNINFO= 1, m, penetration length, 1
+#COLUMNINFO= 2, {qc}, cone resistance, 2
+#COLUMNINFO= 3, {fs}, local friction, 3
+#COLUMNSEPARATOR= ;
+#EOH=
+1.00;5.0;0.05;
+1.02;6.0;0.06;
+"""
+
+AGS = """"GROUP","SCPT"
+"HEADING","LOCA_ID","SCPG_TESN","SCPT_DPTH","SCPT_RES","SCPT_FRES"
+"UNIT","","","m","{qc}","{fs}"
+"TYPE","ID","X","2DP","2DP","2DP"
+"DATA","CPT1","1","1.00","5.0","50"
+"DATA","CPT1","1","1.02","6.0","60"
+"""
+
+
+def write(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+def test_input_files_only_reads_the_formats_asked_for(tmp_path):
+    for name in ['a.xlsx', 'b.xls', 'c.gef', 'notes.txt', 'list.csv']:
+        (tmp_path / name).write_text('')
+    assert [site_name(f) for f in input_files(str(tmp_path))] == ['a', 'b']
+    assert [site_name(f) for f in input_files(str(tmp_path), ['xls', 'gef'])] == ['a', 'b', 'c']
+
+
+def test_site_name_keeps_trailing_letters():
+    # str.rstrip(".xls") would strip the 's' and 'l' of the site names too
+    assert site_name('/data/Sassuolo_ls.xlsx') == 'Sassuolo_ls'
+    assert site_name('/data/CPT 12.xls') == 'CPT 12'
+
+
+@pytest.mark.parametrize('qc, fs, scale', [('MPa', 'MPa', 1.0), ('', '', 1.0), ('kPa', 'kPa', 0.001)])
+def test_gef_units(tmp_path, qc, fs, scale):
+    [sounding] = read_gef(write(tmp_path / 'site.gef', GEF.format(qc=qc, fs=fs)))
+    np.testing.assert_allclose(sounding['rows']['qc (MPa)'], np.array([5.0, 6.0]) * scale)
+    np.testing.assert_allclose(sounding['rows']['fs (kPa)'], np.array([50.0, 60.0]) * scale)
+
+
+@pytest.mark.parametrize('qc, fs, scale', [('MPa', 'kPa', 1.0), ('', '', 1.0), ('kPa', 'Pa', 0.001)])
+def test_ags_units(tmp_path, qc, fs, scale):
+    [sounding] = read_ags(write(tmp_path / 'site.ags', AGS.format(qc=qc, fs=fs)))
+    assert sounding['site'] == 'CPT1'
+    np.testing.assert_allclose(sounding['rows']['qc (MPa)'], np.array([5.0, 6.0]) * scale)
+    np.testing.assert_allclose(sounding['rows']['fs (kPa)'], np.array([50.0, 60.0]) * scale)
+
+
+def test_unknown_units_are_an_error(tmp_path):
+    with pytest.raises(ValueError, match='furlong'):
+        read_gef(write(tmp_path / 'site.gef', GEF.format(qc='furlong', fs='MPa')))
+    with pytest.raises(ValueError, match='furlong'):
+        read_ags(write(tmp_path / 'site.ags', AGS.format(qc='MPa', fs='furlong')))
+
+
+@pytest.mark.parametrize('text', ['Depth (m)\tqc (MPa)\tfs (kPa)\n1.00\t5.5\t50.5\n1.02\t6.5\t60.5\n',
+                                  'Depth (m)\tqc (MPa)\tfs (kPa)\n1,00\t5,5\t50,5\n1,02\t6,5\t60,5\n',
+                                  'Depth (m);qc (MPa);fs (kPa)\n1.00;5.5;50.5\n1.02;6.5;60.5\n',
+                                  'Depth (m);qc (MPa);fs (kPa)\n1,00;5,5;50,5\n1,02;6,5;60,5\n',
+                                  'Depth (m),qc (MPa),fs (kPa)\n1.00,5.5,50.5\n1.02,6.5,60.5\n',
+                                  'depth qc fs\n1,00 5,5 50,5\n1,02 6,5 60,5\n'])
+def test_csv_decimal_separator(tmp_path, text):
+    [sounding] = read_csv_cpt(write(tmp_path / 'site.txt', text))
+    np.testing.assert_allclose(sounding['rows']['Depth (m)'], [1.0, 1.02])
+    np.testing.assert_allclose(sounding['rows']['qc (MPa)'], [5.5, 6.5])
+    np.testing.assert_allclose(sounding['rows']['fs (kPa)'], [50.5, 60.5])
+    assert read_soundings(str(tmp_path / 'site.txt'))[0]['site'] == 'site'
+
+
+def test_csv_thousands_separator(tmp_path):
+    [sounding] = read_csv_cpt(write(tmp_path / 'site.csv', 'Depth (m);qc (MPa);fs (kPa)\n1.00;5.5;1,050.5\n'))
+    assert sounding['rows']['fs (kPa)'][0] == 1050.5
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from batch import batch_pipeline
+from realtime import IncrementalProfile
+from synthetic import site_frame
+
+EVENTS = {'20may': (6.1, 0.25), '29may': (5.9, 0.2)}
+
+
+def assert_same_as_batch_pipeline(profile, results):
+    batch = batch_pipeline(profile.to_batch(), 6.1, 5.9, '20may', '29may')
+    for column, value in results.items():
+        np.testing.assert_allclose(value, batch['sites'][column][0], rtol=1e-9, atol=1e-9, err_msg=column)
+
+
+# GWT inside the sounding, near the top, and below it (every reading above the GWT)
+@pytest.mark.parametrize('seed, GWT', [(0, 1.5), (1, 0.5), (2, 10.0)])
+def test_readings_one_at_a_time(seed, GWT):
+    df = site_frame(250, seed, gwt=GWT)
+    profile = IncrementalProfile(GWT, EVENTS, preforo=1.0)
+    for k in range(len(df)):
+        results = profile.add(df['Depth (m)'][k], df['qc (MPa)'][k], df['fs (kPa)'][k], df['u (kPa)'][k],
+                              df['qt (MPa)'][k])
+        if k in (0, 1, 40, 120, len(df) - 1):
+            assert_same_as_batch_pipeline(profile, results)
+
+
+def test_readings_in_chunks():
+    df = site_frame(200, 3)
+    profile = IncrementalProfile(1.5, EVENTS, preforo=1.0)
+    for start in range(0, len(df), 37):
+        chunk = df.iloc[start:start + 37]
+        results = profile.add(chunk['Depth (m)'], chunk['qc (MPa)'], chunk['fs (kPa)'], chunk['u (kPa)'])
+    assert len(profile) == len(df)
+    assert_same_as_batch_pipeline(profile, results)
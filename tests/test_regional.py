@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+from regional import DepthStatistics
+
+QUANTITIES = ['Ic', 'qc1ncs', 'FS_20may']
+
+
+# Site DataFrames like main.py computes them, with the FS placeholder above the GWT
+def site_frames(n_sites=12, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = {}
+    for k in range(n_sites):
+        depth = np.round(np.arange(1, 751) * 0.02, 3)
+        FS = rng.lognormal(0, 0.6, len(depth))
+        FS[depth <= 1 + k % 3] = 9999
+        frames['site' + str(k)] = pd.DataFrame({'Depth (m)': depth, 'Ic': rng.uniform(1, 4, len(depth)),
+                                                'qc1ncs': rng.lognormal(4, 0.5, len(depth)), 'FS_20may': FS})
+    return frames
+
+
+def statistics_of(frames, group_of=lambda site: 'all'):
+    statistics = DepthStatistics(QUANTITIES)
+    for site, df in frames.items():
+        statistics.add_frame(df, group_of(site))
+    return statistics
+
+
+def test_merge_matches_one_pass():
+    frames = site_frames()
+    sites = list(frames)
+    # Two workers with half of the sites each
+    merged = statistics_of({site: frames[site] for site in sites[:5]}).merge(
+        statistics_of({site: frames[site] for site in sites[5:]}))
+    pd.testing.assert_frame_equal(merged.profiles(), statistics_of(frames).profiles(), rtol=1e-12)
+
+
+def test_profiles_against_numpy():
+    frames = site_frames()
+    profiles = statistics_of(frames).profiles(percentiles=(10, 50, 90))
+    rows = pd.concat(frames.values(), ignore_index=True)
+    rows['FS_20may'] = rows['FS_20may'].where(rows['FS_20may'] < 9999)
+    rows['bin'] = np.ceil(np.round(rows['Depth (m)'] / 0.5, 9)).astype(int) - 1
+    for q, edges in [('Ic', np.linspace(0, 5, 501)), ('qc1ncs', np.geomspace(1, 1000, 401)),
+                     ('FS_20may', np.geomspace(0.01, 100, 401))]:
+        for k, values in rows.groupby('bin')[q]:
+            values = values.dropna().to_numpy()
+            profile = profiles.iloc[k]
+            assert profile[q + ' count'] == len(values)
+            if not len(values):
+                assert np.isnan(profile[q + ' p50'])
+                continue
+            assert profile[q + ' min'] == values.min() and profile[q + ' max'] == values.max()
+            assert np.isclose(profile[q + ' mean'], values.mean(), rtol=1e-12)
+            assert np.isclose(profile[q + ' std'], values.std(), rtol=1e-9)
+            for p in [10, 50, 90]:
+                # Exact to within one histogram bin. The histogram gives the percentile of the empirical distribution, which
+                # doesn't interpolate between the readings like numpy's default does.
+                exact = np.percentile(values, p, method='inverted_cdf')
+                width = np.diff(edges)[np.clip(np.searchsorted(edges, exact, side='right') - 1, 0, len(edges) - 2)]
+                assert abs(profile[q + ' p' + str(p)] - exact) <= width * (1 + 1e-9)
+    # Sites with FS < 1 among the sites with readings in each bin
+    liquefiable = rows[rows['FS_20may'] < 1].assign(site=lambda df: df.index // 750).groupby('bin')['site'].nunique()
+    fraction = profiles['Liquefiable fraction FS_20may']
+    np.testing.assert_array_equal((fraction * profiles['Sites'])[profiles['Sites'] > 0],
+                                  liquefiable.reindex(range(30), fill_value=0))
+    assert fraction[profiles['Sites'] == 0].isna().all()
+
+
+def test_subset_of_groups():
+    frames = site_frames()
+    statistics = statistics_of(frames, lambda site: 'even' if int(site[4:]) % 2 == 0 else 'odd')
+    even = statistics_of({site: df for site, df in frames.items() if int(site[4:]) % 2 == 0})
+    pd.testing.assert_frame_equal(statistics.profiles(['even']), even.profiles(), rtol=1e-12)
+    pd.testing.assert_frame_equal(statistics.profiles(), statistics_of(frames).profiles(), rtol=1e-12)
+    # Sites aren't groups
+    with pytest.raises(KeyError):
+        statistics.profiles(['site0'])
+
+
+def test_save_load_round_trip(tmp_path):
+    statistics = statistics_of(site_frames(), lambda site: site[-1])
+    path = statistics.save(str(tmp_path / 'regional.npz'))
+    loaded = DepthStatistics.load(path)
+    assert loaded.quantities == statistics.quantities and list(loaded.groups) == list(statistics.groups)
+    for groups in [None, ['1', '2']]:
+        pd.testing.assert_frame_equal(loaded.profiles(groups), statistics.profiles(groups))
+    # More sites can be added to the loaded statistics
+    loaded.merge(statistics)
+    assert (loaded.profiles()['Sites'] == 2 * statistics.profiles()['Sites']).all()
@@ -0,0 +1,43 @@
+import numpy as np
+from batch import build_batch, frame_to_sounding
+from resample import resample_batch, resampling_drift
+from synthetic import site_frame, sounding, site_batch
+
+
+# Readings every 0.01 m alternating between 2 and 5 MPa, five to a 0.05 m bin
+def interbedded(n=200):
+    df = site_frame(n, dz=0.01)
+    df['qc (MPa)'] = np.where(np.arange(n) % 2, 5.0, 2.0)
+    df['qt (MPa)'] = df['qc (MPa)']
+    return build_batch([frame_to_sounding(df, 'site')])
+
+
+def test_thin_layer_rule_keeps_the_peak_qc():
+    # Every bin has a contrast of 2.5 >= thin_layer_ratio, so every bin keeps a 5 MPa reading: the resampled qc is
+    # biased upward from the 3.2 to 3.8 MPa bin averages
+    peaks = resample_batch(interbedded(), 0.05)['rows']['qc (MPa)']
+    assert np.all(peaks == 5.0)
+    averages = resample_batch(interbedded(), 0.05, thin_layer_ratio=None)['rows']['qc (MPa)']
+    assert np.all((averages >= 3.2 - 1e-12) & (averages <= 3.8 + 1e-12))
+    # Below the ratio the bins are averaged
+    assert np.array_equal(resample_batch(interbedded(), 0.05, thin_layer_ratio=3.0)['rows']['qc (MPa)'], averages)
+
+
+def test_resampling_at_the_recorded_step_has_no_drift():
+    batch = site_batch([sounding('site' + str(k), seed=k) for k in range(3)])
+    report = resampling_drift(batch, 0.02, 6.1, 5.9, '20may', '29may')
+    assert list(report['rows']) == list(report['resampled rows'])
+    for index in ['LPI_20may', 'LPI_29may', 'LSN_20may', 'LSN_29may']:
+        np.testing.assert_allclose(report[index + ' drift'], 0, atol=1e-9)
+
+
+def test_thin_layer_rule_lowers_LPI_when_only_qc_changes():
+    batch = site_batch([frame_to_sounding(site_frame(600, dz=0.01, gwt=0.5), 'site')])
+    rows = batch['rows']
+    rows['qc (MPa)'] = np.where(np.arange(600) % 2, 5.0, 2.0)
+    rows['fs (kPa)'] = np.full(600, 20.0)
+    rows['qt (MPa)'] = rows['qc (MPa)']
+    peaks = resampling_drift(batch, 0.05, 6.1, 5.9, '20may', '29may')
+    averages = resampling_drift(batch, 0.05, 6.1, 5.9, '20may', '29may', thin_layer_ratio=None)
+    assert peaks['LPI_20may resampled'][0] < averages['LPI_20may resampled'][0]
+    assert peaks['LPI_20may drift'][0] < 0
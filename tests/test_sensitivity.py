@@ -0,0 +1,72 @@
+import numpy as np
+from batch import copy_batch, batch_soil_parameters, batch_scenario
+from sensitivity import sensitivity_report, PARAMETERS, OUTPUTS, SCENARIO_COLUMNS, FC_COEFF, FC_EXP
+from synthetic import sounding, site_batch
+
+EVENTS = {'20may': 6.1, '29may': 5.9}
+STEP = 0.05
+GWT_STEP = 0.25
+
+
+# A deep GWT, a shallow one (the low GWT case would be above the ground, so it's a forward difference) and none
+def raw_batch():
+    return site_batch([sounding('deep', seed=0, gwt=1.5), sounding('shallow', seed=1, gwt=0.1),
+                       sounding('no GWT', seed=2, gwt=0.0)], PGA1=[0.25, 0.3, 0.2], PGA2=[0.2, 0.15, 0.1])
+
+
+# Low and high outputs of one input from separate batch_scenario runs (and soil_parameters runs for the GWT)
+def separate_runs(raw, date, Magnitude, parameter):
+    outputs = []
+    for sign in (-1, 1):
+        inputs = {'Magnitude': Magnitude, 'PGA': raw['sites']['PGA_' + date], 'FC_coeff': FC_COEFF, 'FC_exp': FC_EXP}
+        batch = copy_batch(raw)
+        if parameter == 'GWT':
+            GWT = batch['sites']['GWT [m]']
+            batch['sites']['GWT [m]'] = np.where(GWT + sign * GWT_STEP > 0, GWT + sign * GWT_STEP, GWT)
+        else:
+            inputs[parameter] = inputs[parameter] * (1 + sign * STEP)
+        batch = batch_scenario(batch_soil_parameters(batch), inputs['Magnitude'], inputs['PGA'],
+                               FC_coeff=inputs['FC_coeff'], FC_exp=inputs['FC_exp'])
+        outputs.append(batch['sites'])
+    return outputs
+
+
+def test_sensitivity_report_matches_separate_runs():
+    raw = raw_batch()
+    batch = batch_soil_parameters(copy_batch(raw))
+    columns = set(batch['rows'])
+    report = sensitivity_report(batch, EVENTS, STEP, GWT_step=GWT_STEP)
+    assert set(batch['rows']) == columns
+
+    base = {date: batch_scenario(copy_batch(batch), Magnitude, batch['sites']['PGA_' + date])['sites']
+            for date, Magnitude in EVENTS.items()}
+    for date, Magnitude in EVENTS.items():
+        for parameter in PARAMETERS:
+            low, high = separate_runs(raw, date, Magnitude, parameter)
+            for output, column in zip(OUTPUTS, SCENARIO_COLUMNS):
+                rows = report[(report['Event'] == date) & (report['Parameter'] == parameter) &
+                              (report['Output'] == output)]
+                for name, expected in [('Base output', base[date]), ('Low output', low), ('High output', high)]:
+                    np.testing.assert_allclose(rows[name], expected[column], rtol=1e-11, atol=1e-11,
+                                               err_msg=date + ' ' + parameter + ' ' + output + ' ' + name)
+
+
+def test_sensitivity_report_notes():
+    batch = batch_soil_parameters(raw_batch())
+    report = sensitivity_report(batch, EVENTS, STEP, GWT_step=GWT_STEP)
+    assert (report['Note'][report['site'] == 'no GWT'] == 'GWT is 0 or missing').all()
+    assert report['Sensitivity'][report['site'] == 'no GWT'].isna().all()
+    shallow = report[(report['site'] == 'shallow') & (report['Parameter'] == 'GWT')]
+    assert (shallow['Note'] == 'Forward difference, GWT - GWT_step is above the ground').all()
+    assert list(shallow['Low input'].unique()) == [0.1]
+    assert (shallow['Low output'] == shallow['Base output']).all()
+    expected = (shallow['High output'] - shallow['Base output']) / shallow['Base output'] / GWT_STEP * 0.1
+    np.testing.assert_allclose(shallow['Sensitivity'], expected.where(shallow['Base output'] != 0), rtol=1e-12)
+    deep = report[(report['site'] == 'deep') & (report['Parameter'] == 'GWT')]
+    assert list(deep['High input'].unique()) == [1.5 + GWT_STEP]
+    # Every NaN coefficient says why
+    assert (report['Note'][report['Sensitivity'].isna()] != '').all()
+    # An event alone gives the same rows as with the other event
+    alone = sensitivity_report(batch, {'29may': 5.9}, STEP, GWT_step=GWT_STEP)
+    both = report[report['Event'] == '29may'].reset_index(drop=True)
+    assert alone.drop(columns='Rank').equals(both.drop(columns='Rank'))
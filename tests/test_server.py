@@ -0,0 +1,75 @@
+import json
+import urllib.error
+import urllib.request
+import numpy as np
+import pytest
+from batch import build_batch, batch_soil_parameters, batch_scenario, batch_pipeline
+from server import SiteStore, serve
+from synthetic import sounding, site_batch, PGA_workbook
+
+SITES = {'site0': {'seed': 0}, 'site1': {'seed': 1, 'gwt': 0.5}, 'site2': {'seed': 2, 'n': 120}}
+
+
+# One site per file, named after it. The 'broken' file can't be read.
+def read_soundings_of(filename):
+    if filename == 'broken':
+        raise OSError('cannot read ' + filename)
+    return [sounding(filename, **SITES[filename])]
+
+
+@pytest.fixture
+def url(tmp_path):
+    store = SiteStore(list(SITES) + ['broken'], PGA_workbook(str(tmp_path / 'pga.xlsx'), list(SITES) + ['broken']),
+                      read_soundings_of, lambda filename: [filename], {'20may': 6.1, '29may': 5.9}, window=0.01)
+    store.preload()
+    server = serve(store, port=0, block=False)
+    yield 'http://127.0.0.1:%d' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def get(url, data=None):
+    try:
+        with urllib.request.urlopen(url, None if data is None else json.dumps(data).encode()) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_site_results_match_the_batch_pipeline(url):
+    expected = batch_pipeline(site_batch([sounding(site, **options) for site, options in SITES.items()]),
+                              6.1, 5.9, '20may', '29may')
+    assert get(url + '/health')[1]['sites'] == 4
+    assert get(url + '/sites')[1] == ['broken'] + list(SITES)
+    for k, site in enumerate(SITES):
+        status, results = get(url + '/site/' + site)
+        assert status == 200
+        for date in ['20may', '29may']:
+            for name in ['LPI', 'LSN', 'h1_basic', 'h2_cumulative']:
+                assert np.isclose(results[date][name], expected['sites'][name + '_' + date][k], equal_nan=True)
+
+
+def test_scenario_queries(url):
+    batch = batch_scenario(batch_soil_parameters(build_batch([sounding('site1', **SITES['site1'])])), 7.0, 0.4)
+    status, result = get(url + '/site/site1?magnitude=7&pga=0.4')
+    assert status == 200 and np.isclose(result['LPI'], batch['sites']['LPI_scenario'][0])
+    status, answer = get(url + '/scenario', {'sites': ['site1', 'nowhere'], 'magnitude': 7.0, 'pga': 0.4})
+    assert status == 200
+    assert answer['results']['site1']['LPI'] == result['LPI']
+    assert answer['results']['nowhere'] == {'error': 'Unknown site'}
+
+
+def test_errors(url):
+    assert get(url + '/site/site0?pga=high')[0] == 400
+    assert get(url + '/site/site0?date=1jan')[0] == 400
+    assert get(url + '/scenario', {'sites': ['site0'], 'pga': [0.1]})[0] == 400
+    assert get(url + '/site/nowhere')[0] == 404
+    assert get(url + '/nowhere')[0] == 404
+
+    # A site that can't be read fails alone, also when it shares a batch with other sites
+    status, result = get(url + '/site/broken?magnitude=6&pga=0.3')
+    assert status == 500 and result['error'] == 'Computation failed' and 'cannot read' in result['detail']
+    status, answer = get(url + '/scenario', {'sites': ['site0', 'broken', 'site2'], 'magnitude': 6.0, 'pga': 0.3})
+    assert status == 200
+    assert answer['results']['broken']['error'] == 'Computation failed'
+    assert answer['results']['site0']['LPI'] == get(url + '/site/site0?magnitude=6&pga=0.3')[1]['LPI']
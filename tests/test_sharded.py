@@ -0,0 +1,72 @@
+import os
+import socket
+import sqlite3
+from multiprocessing import Process
+import pandas as pd
+from sharded import (connect, create_queue, claim_unit, complete_unit, run_sharded, queue_progress, site_summaries,
+                     merge_sites_to_check)
+
+
+# Sites of a test input file: one site per file, named after it. Files ending in 'flaky' fail the first time they are
+# read and files ending in 'broken' always fail.
+def process_file(filename):
+    if filename.endswith('broken'):
+        raise OSError('unreadable ' + filename)
+    if filename.endswith('flaky') and not os.path.exists(filename + '.seen'):
+        open(filename + '.seen', 'w').close()
+        raise OSError('network share went away')
+    site = os.path.basename(filename)
+    return [(site, pd.DataFrame({'Depth (m)': [0.1, 0.2], 'LPI_20may': [len(site), 0.0]}), None)]
+
+
+def summarize(site, df):
+    return {'LPI_20may': df['LPI_20may'].iloc[0]}
+
+
+def attempts(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = dict(conn.execute('SELECT filename, attempts FROM files').fetchall())
+    conn.close()
+    return rows
+
+
+def test_run_sharded_retries_failed_files(tmp_path):
+    db_path = str(tmp_path / 'queue.db')
+    filenames = [str(tmp_path / name) for name in ['a', 'b_flaky', 'c_broken']]
+    create_queue(db_path, filenames, unit_size=2)
+    progress = run_sharded(db_path, process_file, str(tmp_path), 'csv', workers=2, summarize=summarize)
+
+    assert progress == {'done': 2, 'failed': 1}
+    assert attempts(db_path) == {filenames[0]: 1, filenames[1]: 2, filenames[2]: 3}
+    assert dict(site_summaries(db_path)) == {'a': {'LPI_20may': 1}, 'b_flaky': {'LPI_20may': 7}}
+    assert os.path.exists(str(tmp_path / 'b_flaky.csv'))
+    merge_sites_to_check(db_path, str(tmp_path), 'csv')
+    assert list(pd.read_csv(str(tmp_path / 'sites_to_check.csv'))['Failed files']) == [filenames[2]]
+
+
+def test_claim_unit_after_a_crash(tmp_path):
+    db_path = str(tmp_path / 'queue.db')
+    create_queue(db_path, [str(tmp_path / name) for name in 'abc'], unit_size=1)
+    conn = connect(db_path)
+    host = socket.gethostname()
+    dead = Process(target=int)
+    dead.start()
+    dead.join()
+
+    # Fresh leases: the unit of a dead local worker is handed out again, the one of a live worker is not
+    assert claim_unit(conn, host + ':' + str(dead.pid))[0] == 1
+    assert claim_unit(conn, host + ':' + str(os.getpid()))[0] == 2
+    assert claim_unit(conn, 'other-host:1')[0] == 3
+    assert claim_unit(conn, 'new-worker')[0] == 1
+
+    # The crashed worker can't close the unit it lost
+    complete_unit(conn, 1, host + ':' + str(dead.pid))
+    assert conn.execute('SELECT status FROM units WHERE unit_id = 1').fetchone()[0] == 'claimed'
+    complete_unit(conn, 1, 'new-worker')
+    assert conn.execute('SELECT status FROM units WHERE unit_id = 1').fetchone()[0] == 'done'
+
+    # The other units only once their lease runs out
+    assert claim_unit(conn, 'new-worker') is None
+    assert claim_unit(conn, 'new-worker', lease_seconds=0)[0] == 2
+    conn.close()
+    assert queue_progress(db_path) == {'pending': 3}
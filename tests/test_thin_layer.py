@@ -0,0 +1,44 @@
+import numpy as np
+from thin_layer import thin_layer_correction, thin_layer_filter
+
+DZ = 0.02
+DEPTH = np.round(np.arange(1, 301) * DZ, 3)
+
+
+# What the cone measures over a true profile
+def measured(true):
+    kernel = thin_layer_filter(DZ)
+    half = len(kernel) // 2
+    return np.convolve(np.pad(true, half, mode='edge'), kernel, mode='valid')
+
+
+def test_uniform_profile_is_unchanged():
+    values = np.full(300, 3.0)
+    values[[10, 11, 150]] = 0  # bad readings
+    np.testing.assert_array_equal(thin_layer_correction(DEPTH, values, [0, 300]), values)
+
+
+def test_noise_is_not_a_thin_layer():
+    values = np.exp(np.random.default_rng(0).normal(1, 0.2, 300))
+    np.testing.assert_array_equal(thin_layer_correction(DEPTH, values, [0, 300]), values)
+
+
+def test_thin_sand_layer():
+    true = np.ones(300)
+    true[140:150] = 10.0  # 20 cm of sand in clay
+    values = measured(true)
+    corrected = thin_layer_correction(DEPTH, values, [0, 300])
+
+    # Only the layer and the zone the cone senses around it are corrected, within max_correction
+    assert np.abs(corrected[140:150] - true[140:150]).max() < np.abs(values[140:150] - true[140:150]).max()
+    assert np.all(corrected <= 2 * values)
+    np.testing.assert_array_equal(corrected[:110], values[:110])
+    np.testing.assert_array_equal(corrected[190:], values[190:])
+
+    # A batch gives every site the same correction as on its own
+    flat = np.concatenate([np.full(120, 3.0), values, values[:200]])
+    depth = np.concatenate([DEPTH[:120], DEPTH, DEPTH[:200]])
+    batch = thin_layer_correction(depth, flat, [0, 120, 420, 620])
+    np.testing.assert_allclose(batch[120:420], corrected, rtol=1e-12)
+    np.testing.assert_array_equal(batch[:120], flat[:120])
+    np.testing.assert_allclose(batch[420:], thin_layer_correction(DEPTH[:200], values[:200], [0, 200]), rtol=1e-12)
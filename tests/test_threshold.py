@@ -0,0 +1,70 @@
+import numpy as np
+from batch import build_batch, frame_to_sounding, batch_soil_parameters, batch_scenario, concat_batches, segment_sum
+from threshold import threshold_PGA
+from synthetic import site_frame
+
+PGAS = np.geomspace(0.01, 5.0, 700)
+
+
+def sites():
+    frames = {'site0': site_frame(250, 0), 'shallow GWT': site_frame(250, 1, gwt=0.3),
+              'above GWT': site_frame(250, 2, gwt=50.0)}
+    # Loose clean sand with a shallow water table, liquefies at the lowest PGAs
+    loose = site_frame(250, 3, gwt=0.2)
+    loose['qc (MPa)'] = 1.0 + 0.05 * np.sin(np.arange(250) / 7)
+    loose['qt (MPa)'] = loose['qc (MPa)']
+    loose['fs (kPa)'] = 1.0
+    frames['loose'] = loose
+    return batch_soil_parameters(build_batch([frame_to_sounding(df, site) for site, df in frames.items()]))
+
+
+# Index of the first PGA of the sweep that reaches each threshold, -1 if none does
+def sweep(batch, Magnitude):
+    n_sites = len(batch['site'])
+    stacked = batch_scenario(concat_batches([batch] * len(PGAS)), Magnitude, np.repeat(PGAS, n_sites))
+    FS = np.where(stacked['rows']['FS_scenario'] >= 9999, np.nan, stacked['rows']['FS_scenario'])
+    reached = {'PGA FS=1': segment_sum((FS <= 1).astype(float), stacked) > 0,
+               'PGA LPI=5': stacked['sites']['LPI_scenario'] >= 5,
+               'PGA LSN=16': stacked['sites']['LSN_scenario'] >= 16}
+    first = {}
+    for column, values in reached.items():
+        values = values.reshape(len(PGAS), n_sites)
+        index = np.argmax(values, axis=0)
+        first[column] = np.where(values.any(axis=0), index, -1)
+    return first
+
+
+def test_threshold_PGA_matches_a_PGA_sweep():
+    batch = sites()
+    for Magnitude in [6.1, 7.5]:
+        table = threshold_PGA(batch, [Magnitude])
+        for column, first in sweep(batch, Magnitude).items():
+            for k, site in enumerate(batch['site']):
+                threshold = table[column][k]
+                if first[k] < 0:
+                    assert np.isnan(threshold), (column, site)
+                elif first[k] == 0:
+                    assert np.isnan(threshold) or threshold <= PGAS[0], (column, site)
+                else:
+                    # Between the last PGA of the sweep below the threshold and the first one above it
+                    assert PGAS[first[k] - 1] * (1 - 1e-9) <= threshold <= PGAS[first[k]] * (1 + 1e-9), (column, site)
+
+    table = threshold_PGA(batch, [6.1]).set_index('site')
+    # Every reading above the GWT: never liquefies
+    assert table.loc['above GWT', ['PGA FS=1', 'PGA LPI=5', 'PGA LSN=16']].isna().all()
+    assert table.loc['site0', ['PGA FS=1', 'PGA LPI=5', 'PGA LSN=16']].notna().all()
+    assert table.loc['loose', 'PGA FS=1'] < 0.05
+
+
+def test_LSN_threshold_outside_the_bracket():
+    batch = sites()
+    default = threshold_PGA(batch, [6.1]).set_index('site')
+    table = threshold_PGA(batch, [6.1], PGA_bracket=(0.03, 0.04)).set_index('site')
+    assert default.loc['loose', 'PGA LSN=16'] < 0.03 < default.loc['shallow GWT', 'PGA LSN=16'] < 0.04
+    assert 0.04 < default.loc['site0', 'PGA LSN=16']
+    # Already above the target at the lower bound (liquefiable at any PGA of the bracket) or still below it at the
+    # upper bound: NaN for LSN only, the closed-form thresholds don't depend on the bracket
+    assert np.isnan(table.loc['loose', 'PGA LSN=16']) and np.isnan(table.loc['site0', 'PGA LSN=16'])
+    assert np.isclose(table.loc['shallow GWT', 'PGA LSN=16'], default.loc['shallow GWT', 'PGA LSN=16'], rtol=1e-9)
+    columns = ['PGA FS=1', 'Critical depth (m)', 'PGA LPI=5']
+    assert table[columns].equals(default[columns])
@@ -0,0 +1,106 @@
+import numpy as np
+from scipy import fft, signal
+
+# Thin-layer correction of the cone resistance by inverse filtering, after the procedure of Boulanger and DeJong
+# (2018). The measured resistance is taken as the true resistance averaged over the zone the cone senses,
+#     qt,m(z) = sum(w(z') * qt(z + z')) / sum(w),   w(z') = C1 / (1 + |z' / (z50 * dc)| ** mz)
+# with dc the cone diameter and C1 = 1 ahead of the tip and behind_weight behind it. Like Boulanger and DeJong, only
+# thin layers are corrected: peaks (or troughs) of the measured profile at least min_ratio times the soil around them
+# and thinner than max_thickness cone diameters at half height, plus the z50 * dc the cone senses on each side. The
+# cone blurs a real layer over at least z50 * dc, so narrower spikes are taken as noise. The rest of the profile is
+# left as measured. Inside those intervals the true profile is found by iterating
+# qt(k+1) = qt(k) + (qt,m - w * qt(k)) (Van Cittert deconvolution). The iteration stops when the convolved profile
+# matches the measurements within tolerance, when the residual stops falling (the filter is cut off and asymmetric,
+# so the iteration can amplify noise instead of converging) or after iterations steps, and each site keeps its best
+# estimate. Corrections are capped to max_correction times (or 1 / max_correction times) the measured value.
+# Boulanger and DeJong make w depend on the resistance ratio between the tip and the soil around it; here the filter is
+# kept the same along the profile so that the convolutions can be done with FFTs over every site of a batch at once.
+# The filter needs a uniform depth step. Each site uses its average step (see resample.py for irregular soundings).
+
+
+# Filter in samples for a depth step dz, flipped so it can be used as a convolution kernel
+def thin_layer_filter(dz, cone_diameter=0.0357, z50=4.0, mz=3.0, behind_weight=0.5, reach=15):
+    half = max(int(np.ceil(reach * cone_diameter / dz)), 1)
+    offset = np.arange(-half, half + 1) * dz / cone_diameter  # z' / dc, positive is ahead of the tip
+    w = 1 / (1 + np.abs(offset / z50) ** mz)
+    w[offset < 0] *= behind_weight
+    return (w / w.sum())[::-1]
+
+
+# Thin layer intervals of one profile (no bad readings) with depth step dz, as a mask
+def thin_layers(values, dz, cone_diameter=0.0357, z50=4.0, min_ratio=2.0, max_thickness=20.0):
+    log_values = np.log(values)
+    mask = np.zeros(len(values), dtype=bool)
+    reach = int(np.ceil(z50 * cone_diameter / dz))
+    for sign in (1, -1):
+        peaks, properties = signal.find_peaks(sign * log_values, prominence=np.log(min_ratio),
+                                              width=(reach, max_thickness * cone_diameter / dz), rel_height=0.5)
+        for left, right in zip(properties['left_ips'], properties['right_ips']):
+            mask[max(int(np.floor(left)) - reach, 0):int(np.ceil(right)) + reach + 1] = True
+    return mask
+
+
+# Corrected values of a flat (batch.py layout) array. values <= 0 or NaN are bad readings and are returned as they are.
+def thin_layer_correction(depth, values, offsets, cone_diameter=0.0357, z50=4.0, mz=3.0, behind_weight=0.5,
+                          iterations=20, tolerance=0.01, max_correction=2.0, min_ratio=2.0, max_thickness=20.0):
+    depth = np.asarray(depth, dtype=float)
+    values = np.asarray(values, dtype=float)
+    offsets = np.asarray(offsets)
+    lengths = np.diff(offsets)
+    corrected = values.copy()
+    valid = values > 0
+    if not valid.any():
+        return corrected
+
+    # Bad readings are interpolated so they don't leak into the convolution
+    seg = np.repeat(np.arange(len(lengths)), lengths)
+    position = depth + seg * 1e6
+    filled = np.interp(position, position[valid], values[valid])
+
+    # Sites with the same depth step share the filter and are filtered together as one 2D array
+    with np.errstate(invalid='ignore', divide='ignore'):
+        steps = ((depth[np.maximum(offsets[1:] - 1, 0)] - depth[np.minimum(offsets[:-1], len(depth) - 1)])
+                 / (lengths - 1))
+    steps = np.round(np.where(lengths > 1, steps, np.nan), 4)
+    for dz in np.unique(steps[steps > 0]):
+        sites = np.nonzero(steps == dz)[0]
+        kernel = thin_layer_filter(dz, cone_diameter, z50, mz, behind_weight)
+        half = len(kernel) // 2
+        n = lengths[sites].max()
+        index = offsets[sites][:, None] + np.minimum(np.arange(n)[None, :], lengths[sites][:, None] - 1)
+        inside = np.arange(n)[None, :] < lengths[sites][:, None]
+        layers = np.zeros((len(sites), n), dtype=bool)
+        for i, k in enumerate(sites):
+            layers[i, :lengths[k]] = thin_layers(filled[offsets[k]:offsets[k + 1]], dz, cone_diameter, z50,
+                                                 min_ratio, max_thickness)
+        if not layers.any():
+            continue
+        measured = np.pad(filled[index], ((0, 0), (half, half)), mode='edge')
+        layers = np.pad(layers, ((0, 0), (half, half)))
+
+        # The filter is transformed once and every iteration is one forward and one inverse FFT
+        size = fft.next_fast_len(measured.shape[1] + len(kernel) - 1, real=True)
+        kernel_fft = fft.rfft(kernel, size)
+        estimate = measured.copy()
+        previous = estimate
+        best = np.full(len(sites), np.inf)
+        active = layers.any(axis=1)
+        for _ in range(iterations):
+            convolved = fft.irfft(fft.rfft(estimate, size, axis=1) * kernel_fft, size, axis=1)
+            residual = np.where(layers, measured - convolved[:, half:half + measured.shape[1]], 0)
+            error = np.max(np.abs(residual) / measured, axis=1)
+            # Sites whose residual went up go back to their previous estimate and stop there
+            worse = active & (error >= best)
+            estimate[worse] = previous[worse]
+            active &= ~worse & (error >= tolerance)
+            best = np.minimum(best, error)
+            if not active.any():
+                break
+            previous = estimate.copy()
+            estimate[active] = np.clip(estimate + residual, measured / max_correction,
+                                       measured * max_correction)[active]
+
+        corrected_sites = estimate[:, half:-half]
+        rows = index[inside]
+        corrected[rows] = np.where(valid[rows], corrected_sites[inside], values[rows])
+    return corrected
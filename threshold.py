@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+from batch import (liq_event_terms, FS_from_terms, LPI_rows, LSN_strain, LSN_rows, depth_above, segment_sum,
+                   site_to_rows)
+
+# Threshold PGA of every site, i.e. the PGA at which
+#   - the critical layer reaches FS = 1
+#   - LPI reaches LPI_target (5 by default)
+#   - LSN reaches LSN_target (16 by default)
+# CSR in FS_liq is proportional to the PGA while CRR doesn't depend on it, so every row has FS = c / PGA with
+# c = CRR / (CSR for a PGA of 1 g). That gives the FS threshold of a row directly (PGA = c). LPI is a sum of
+# w * (1 - c / PGA) over the rows with c <= PGA, which between two consecutive c values is W - V / PGA, so it also has
+# a closed form. LSN goes through the piecewise strain curves, so it is found by bisection, done for every site at
+# once. The batch has to have gone through batch_soil_parameters.
+
+
+# Per site smallest value and the row it comes from
+def segment_argmin(values, batch):
+    n_sites = len(batch['site'])
+    valid = ~np.isnan(values)
+    index = np.nonzero(valid)[0]
+    order = index[np.lexsort((values[index], batch['seg'][index]))]
+    first = np.r_[True, batch['seg'][order][1:] != batch['seg'][order][:-1]] if len(order) else np.zeros(0, bool)
+    rows = np.full(n_sites, -1)
+    rows[batch['seg'][order[first]]] = order[first]
+    smallest = np.where(rows >= 0, values[np.maximum(rows, 0)], np.nan)
+    return smallest, rows
+
+
+# PGA (1 g units) that makes FS = 1 in each row. Rows above the GWT never liquefy in FS_liq (FS = 9999).
+def row_threshold_PGA(batch, terms):
+    rows = batch['rows']
+    below_GWT = rows['Depth (m)'] > site_to_rows(batch['sites']['GWT [m]'], batch)
+    with np.errstate(all='ignore'):
+        c = terms['CRR'] / terms['CSR/PGA']
+    return np.where(below_GWT & (c > 0), c, np.nan)
+
+
+# PGA at which the LPI of each site reaches target
+def LPI_threshold_PGA(batch, c, target, depth_column_name='Depth (m)'):
+    n_sites = len(batch['site'])
+    seg = batch['seg']
+    depth = batch['rows'][depth_column_name]
+    w = LPI_rows(depth, depth_above(batch, depth_column_name), np.zeros_like(depth))
+
+    # Rows sorted by c inside each site, with the running sums W = sum(w) and V = sum(w * c)
+    index = np.nonzero(~np.isnan(c) & (w > 0))[0]
+    order = index[np.lexsort((c[index], seg[index]))]
+    s, c_sorted, w_sorted = seg[order], c[order], w[order]
+    W = np.cumsum(w_sorted)
+    V = np.cumsum(w_sorted * c_sorted)
+    starts = np.r_[True, s[1:] != s[:-1]] if len(order) else np.zeros(0, bool)
+    start_position = np.maximum.accumulate(np.where(starts, np.arange(len(order)), 0))
+    W -= np.r_[0, W][start_position]
+    V -= np.r_[0, V][start_position]
+
+    # Between c_k and c_k+1 LPI = W_k - V_k / PGA, so the candidate PGA is V_k / (W_k - target). Only one of the
+    # candidates of a site falls inside its own interval.
+    c_next = np.r_[c_sorted[1:], np.inf]
+    c_next[np.r_[s[1:] != s[:-1], True] if len(order) else np.zeros(0, bool)] = np.inf
+    with np.errstate(all='ignore'):
+        candidate = V / (W - target)
+    valid = (W > target) & (candidate >= c_sorted) & (candidate <= c_next)
+    threshold = np.full(n_sites, np.inf)
+    np.minimum.at(threshold, s[valid], candidate[valid])
+    return np.where(np.isinf(threshold), np.nan, threshold)
+
+
+def LSN_at_PGA(batch, terms, PGA, depth_column_name='Depth (m)'):
+    depth = batch['rows'][depth_column_name]
+    _, FS = FS_from_terms(batch, terms, PGA)
+    eps = LSN_strain(terms['qc1ncs'], FS, depth)
+    return segment_sum(LSN_rows(batch, depth, eps), batch)
+
+
+# PGA at which the LSN of each site reaches target, by bisection between PGA_bracket (in log space). Sites that are
+# already above the target at the lower bound or below it at the upper bound get NaN.
+def LSN_threshold_PGA(batch, terms, target, PGA_bracket=(0.01, 5.0), iterations=40, depth_column_name='Depth (m)'):
+    n_sites = len(batch['site'])
+    low = np.full(n_sites, np.log(PGA_bracket[0]))
+    high = np.full(n_sites, np.log(PGA_bracket[1]))
+    bracketed = ((LSN_at_PGA(batch, terms, np.exp(low), depth_column_name) < target) &
+                 (LSN_at_PGA(batch, terms, np.exp(high), depth_column_name) >= target))
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        above = LSN_at_PGA(batch, terms, np.exp(middle), depth_column_name) >= target
+        high = np.where(above, middle, high)
+        low = np.where(above, low, middle)
+    return np.where(bracketed, np.exp(high), np.nan)
+
+
+# Threshold PGA values of every site for each event magnitude. Returns one row per site and magnitude.
+def threshold_PGA(batch, Magnitudes, LPI_target=5, LSN_target=16, PGA_bracket=(0.01, 5.0),
+                  depth_column_name='Depth (m)'):
+    tables = []
+    for Magnitude in Magnitudes:
+        terms = liq_event_terms(batch, Magnitude)
+        c = row_threshold_PGA(batch, terms)
+        critical_PGA, critical_row = segment_argmin(c, batch)
+        depth = batch['rows'][depth_column_name]
+        tables.append(pd.DataFrame({
+            'site': batch['site'],
+            'Magnitude': Magnitude,
+            'PGA FS=1': critical_PGA,
+            'Critical depth (m)': np.where(critical_row >= 0, depth[np.maximum(critical_row, 0)], np.nan),
+            'PGA LPI=' + str(LPI_target): LPI_threshold_PGA(batch, c, LPI_target, depth_column_name),
+            'PGA LSN=' + str(LSN_target): LSN_threshold_PGA(batch, terms, LSN_target, PGA_bracket,
+                                                            depth_column_name=depth_column_name)}))
+    return pd.concat(tables, ignore_index=True)